@@ -0,0 +1,634 @@
+"""
+Offline benchmarks for the backend.
+
+Usage:
+    python benchmark.py concurrency --requests 8 --latency 0.5
+    python benchmark.py neo4j-writes --tables 2000 --batch-size 500   # needs a local Neo4j
+    python benchmark.py embeddings --tables 2000 --rate-limit-every 3
+    python benchmark.py export --rows 10000000 --format csv
+    python benchmark.py encoding --rows 100000 --columns 20
+    python benchmark.py e2e --tables 10 500 5000 --requests 50 --concurrency 8 --chat-latency 0.2
+    python benchmark.py few-shot --examples 10000 50000 --lookups 1000
+    python benchmark.py wide-schema --dimensions 24 --width 200 --budgets 0 8000 4000 2000
+"""
+import argparse
+import asyncio
+import datetime
+import decimal
+import json
+import os
+import resource
+import sqlite3
+import tempfile
+import time
+
+# The OpenAI clients are created at import time and refuse to start without a key
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("DEEPSEEK_API_KEY", "benchmark")
+
+import httpx
+import numpy as np
+import openai
+from sqlalchemy import MetaData, Table, Column, Integer, String, ForeignKey
+from sqlalchemy import create_engine
+import few_shot
+import neo4j_setup
+import result_encoding
+import result_export
+import schema_pruning
+import server
+import stub_graph
+import stub_llm_server
+import tracing
+import user_query_runner
+from vector_index import EmbeddingIndex
+
+
+def create_sqlite_database(path: str):
+    """Create a tiny SQLite database for the benchmarks to point at."""
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE IF NOT EXISTS orders (id INTEGER PRIMARY KEY, amount REAL)")
+    connection.executemany("INSERT INTO orders (amount) VALUES (?)", [(i * 1.5,) for i in range(100)])
+    connection.commit()
+    connection.close()
+
+
+def build_synthetic_metadata(num_tables: int, columns_per_table: int = 5):
+    """Build a MetaData with `num_tables` tables, each holding a foreign key to its predecessor."""
+    metadata = MetaData()
+    for i in range(num_tables):
+        columns = [Column("id", Integer, primary_key=True)]
+        if i > 0:
+            columns.append(Column(f"table_{i - 1}_id", Integer, ForeignKey(f"table_{i - 1}.id")))
+        columns.extend(Column(f"col_{j}", String) for j in range(columns_per_table))
+        Table(f"table_{i}", metadata, *columns)
+    return metadata
+
+
+class CountingSession:
+    """Wraps a Neo4j session and counts the statements and transactions sent to the server."""
+
+    def __init__(self, session, counter):
+        self._session = session
+        self._counter = counter
+
+    def __enter__(self):
+        self._session.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._session.__exit__(*exc)
+
+    def run(self, *args, **kwargs):
+        self._counter["round_trips"] += 1
+        return self._session.run(*args, **kwargs)
+
+    def execute_write(self, *args, **kwargs):
+        self._counter["round_trips"] += 1
+        return self._session.execute_write(*args, **kwargs)
+
+
+class CountingDriver:
+    def __init__(self, driver):
+        self._driver = driver
+        self.counter = {"round_trips": 0}
+
+    def session(self, *args, **kwargs):
+        return CountingSession(self._driver.session(*args, **kwargs), self.counter)
+
+
+def write_graph_per_row(driver, database_name, table_descriptions, metadata, table_embeddings):
+    """The previous write path: one auto-commit statement per table, foreign key and embedding."""
+    with driver.session() as session:
+        session.run("MATCH (t:Table {database: $database}) DETACH DELETE t", database=database_name)
+        for table_name, description in table_descriptions.items():
+            session.run(
+                "CREATE (t:Table {database: $database, name: $name, description: $description})",
+                database=database_name, name=table_name, description=description,
+            )
+        for table in metadata.tables.values():
+            for fk in table.foreign_keys:
+                session.run(
+                    """
+                    MATCH (a:Table {database: $database, name: $source})
+                    MATCH (b:Table {database: $database, name: $target})
+                    MERGE (a)-[:RELATES_TO]->(b)
+                    """,
+                    database=database_name, source=fk.parent.table.name, target=fk.column.table.name,
+                )
+        for table_name, embedding in table_embeddings.items():
+            session.run(
+                "MATCH (t:Table {database: $database, name: $name}) SET t.embedding = $embedding",
+                database=database_name, name=table_name, embedding=embedding,
+            )
+
+
+def benchmark_neo4j_writes(num_tables: int, batch_size: int):
+    """Compare per-row and batched UNWIND graph writes against the Neo4j at NEO4J_URI."""
+    database_name = "benchmark_neo4j_writes"
+    metadata = build_synthetic_metadata(num_tables)
+    table_descriptions = {name: f"Synthetic table {name}" for name in metadata.tables}
+    table_embeddings = {name: [float(i % 7), 1.0, 0.5] for i, name in enumerate(metadata.tables)}
+
+    real_driver = neo4j_setup.neo4j_driver
+    try:
+        baseline = CountingDriver(real_driver)
+        start = time.perf_counter()
+        write_graph_per_row(baseline, database_name, table_descriptions, metadata, table_embeddings)
+        baseline_time = time.perf_counter() - start
+
+        batched = CountingDriver(real_driver)
+        neo4j_setup.neo4j_driver = batched
+        start = time.perf_counter()
+        neo4j_setup.create_graph_in_neo4j(database_name, table_descriptions, metadata, batch_size=batch_size)
+        neo4j_setup.write_table_embeddings(database_name, table_embeddings, batch_size=batch_size)
+        batched_time = time.perf_counter() - start
+    finally:
+        neo4j_setup.neo4j_driver = real_driver
+        with real_driver.session() as session:
+            session.run("MATCH (t:Table {database: $database}) DETACH DELETE t", database=database_name)
+
+    print(f"tables={num_tables} batch_size={batch_size}")
+    print(f"per-row: round_trips={baseline.counter['round_trips']} wall_time={baseline_time:.3f}s")
+    print(f"batched: round_trips={batched.counter['round_trips']} wall_time={batched_time:.3f}s")
+
+
+def benchmark_embeddings(num_tables: int, rate_limit_every: int, port: int = 8100):
+    """Embed synthetic table descriptions through the stub server and report request counts."""
+    stub_llm_server.settings["rate_limit_every"] = rate_limit_every
+    stub = stub_llm_server.start_in_thread(port)
+    real_client = neo4j_setup.client
+    # Let the batching helper handle 429s itself instead of the SDK's built-in retries
+    neo4j_setup.client = openai.OpenAI(base_url=f"http://127.0.0.1:{port}/v1", api_key="stub", max_retries=0)
+    try:
+        descriptions = [f"Table table_{i} stores synthetic rows for benchmark number {i}. " * 5 for i in range(num_tables)]
+        start = time.perf_counter()
+        embeddings = neo4j_setup.embed_texts_in_batches(descriptions)
+        elapsed = time.perf_counter() - start
+        stats = httpx.get(f"http://127.0.0.1:{port}/stats").json()
+    finally:
+        neo4j_setup.client = real_client
+        stub.should_exit = True
+
+    assert len(embeddings) == num_tables
+    print(f"tables={num_tables} token_budget={neo4j_setup.EMBEDDING_BATCH_TOKENS} max_inputs={neo4j_setup.EMBEDDING_BATCH_SIZE}")
+    print(f"requests={stats['embedding_requests']} rate_limited={stats['rate_limited']} "
+          f"(one request per table would be {num_tables}) wall_time={elapsed:.3f}s")
+
+
+def current_rss_mb():
+    """Resident set size of this process in MB (Linux), falling back to the peak RSS."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def create_fact_table(path: str, num_rows: int):
+    """Create a SQLite table with `num_rows` generated rows using a recursive CTE."""
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE facts (id INTEGER PRIMARY KEY, amount REAL, label TEXT, created_at TEXT)")
+    connection.execute(
+        """
+        INSERT INTO facts (id, amount, label, created_at)
+        WITH RECURSIVE counter(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM counter WHERE x < ?)
+        SELECT x, x * 1.5, 'row ' || x, datetime('2024-01-01', '+' || (x % 365) || ' days') FROM counter
+        """,
+        (num_rows,),
+    )
+    connection.commit()
+    connection.close()
+
+
+def benchmark_export(num_rows: int, export_format: str, chunk_size: int):
+    """Stream a full export of a large SQLite table and report RSS as it progresses."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "export.db")
+        print(f"Creating {num_rows} rows...")
+        create_fact_table(db_path, num_rows)
+        engine = create_engine(f"sqlite:///{db_path}")
+
+        chunks_total = max(1, -(-num_rows // chunk_size))
+        checkpoints = {max(1, chunks_total * step // 10) for step in range(1, 11)}
+        baseline_rss = current_rss_mb()
+        total_bytes = 0
+        start = time.perf_counter()
+        for chunk_number, data in enumerate(
+            result_export.export_query(engine, "SELECT * FROM facts", export_format, chunk_size), 1
+        ):
+            total_bytes += len(data)
+            if chunk_number in checkpoints:
+                print(f"  {min(chunk_number * chunk_size, num_rows):>10} rows  rss={current_rss_mb():8.1f} MB")
+        elapsed = time.perf_counter() - start
+        engine.dispose()
+
+    print(f"format={export_format} rows={num_rows} chunk_size={chunk_size}")
+    print(f"bytes={total_bytes} wall_time={elapsed:.2f}s rows_per_s={num_rows / elapsed:,.0f}")
+    print(f"rss_before={baseline_rss:.1f} MB rss_after={current_rss_mb():.1f} MB")
+
+
+def benchmark_encoding(num_rows: int, num_columns: int, repeat: int = 3):
+    """Compare serialization time and size of the default rows response against the compact formats."""
+    from fastapi.encoders import jsonable_encoder
+
+    makers = [
+        lambda i: i,
+        lambda i: i * 1.25,
+        lambda i: decimal.Decimal(i) / 100,
+        lambda i: datetime.datetime(2024, 1, 1) + datetime.timedelta(minutes=i),
+        lambda i: f"label {i}",
+    ]
+    columns = [f"col_{j}" for j in range(num_columns)]
+    rows = [[makers[j % len(makers)](i) for j in range(num_columns)] for i in range(num_rows)]
+    formatted = {"columns": columns, "rows": rows, "query": "SELECT 1", "table_name": "Benchmark"}
+
+    def default_path():
+        # What FastAPI's JSONResponse does with the dict returned by run_query
+        return json.dumps(jsonable_encoder({"status": "success", "results": formatted}),
+                          ensure_ascii=False, separators=(",", ":")).encode()
+
+    def columnar_path():
+        return result_encoding.dumps({"status": "success", "results": result_encoding.to_columnar(formatted)})
+
+    paths = [("rows (jsonable_encoder)", default_path), ("columnar", columnar_path)]
+    if result_encoding.pa is not None:
+        paths.append(("arrow", lambda: result_encoding.encode_arrow(formatted)))
+
+    print(f"rows={num_rows} columns={num_columns} orjson={'yes' if result_encoding.orjson else 'no'}")
+    for name, encode in paths:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            body = encode()
+            timings.append(time.perf_counter() - start)
+        print(f"{name:>24}: best={min(timings) * 1000:8.1f} ms  size={len(body) / 2**20:7.2f} MB")
+
+
+def benchmark_concurrency(num_requests: int, latency: float):
+    """
+    Fire `num_requests` simultaneous /api/run-query calls whose pipeline blocks for `latency`
+    seconds (standing in for the LLM round-trips) and report the total wall time.
+    A non-blocking server finishes in roughly one pipeline latency, a blocking one in N of them.
+    """
+    def blocking_pipeline(user_query, database_name, dbtype="default", engine=None, metadata=None, **kwargs):
+        time.sleep(latency)
+        return [(1,)], "SELECT 1;", "Benchmark", []
+
+    user_query_runner.run_pipeline = blocking_pipeline
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "bench.db")
+        create_sqlite_database(db_path)
+        payload = {"query": "How many orders?", "dbConfig": {"type": "default", "database": db_path}}
+
+        async def run():
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http_client:
+                # Warm the engine registry so reflection isn't part of the measurement
+                await http_client.post("/api/run-query", json=payload)
+                start = time.perf_counter()
+                responses = await asyncio.gather(
+                    *(http_client.post("/api/run-query", json=payload) for _ in range(num_requests))
+                )
+                elapsed = time.perf_counter() - start
+            failures = sum(1 for response in responses if response.status_code != 200)
+            return elapsed, failures
+
+        elapsed, failures = asyncio.run(run())
+
+    print(f"requests={num_requests} pipeline_latency={latency:.3f}s workers={server.PIPELINE_WORKERS}")
+    print(f"wall_time={elapsed:.3f}s ({elapsed / latency:.2f}x one pipeline) failures={failures}")
+
+
+def benchmark_few_shot(example_counts, dimensions: int, lookups: int, top_k: int = few_shot.FEW_SHOT_EXAMPLES):
+    """
+    Lookup latency of the few-shot ExampleIndex against an exact full-vector scan, with the
+    share of exact top-k results the prefix search finds. Embeddings are random vectors with
+    decaying per-dimension variance, roughly how text-embedding-3 concentrates information
+    in its leading dimensions; queries are perturbed copies of stored questions.
+    """
+    rng = np.random.default_rng(0)
+    scale = 1.0 / np.sqrt(1.0 + np.arange(dimensions) / 32.0)
+    print(f"dimensions={dimensions} prefix={few_shot.FEW_SHOT_PREFIX_DIMENSIONS} "
+          f"candidates={few_shot.FEW_SHOT_CANDIDATES} top_k={top_k}")
+    for num_examples in example_counts:
+        embeddings = (rng.standard_normal((num_examples, dimensions)) * scale).astype(np.float32)
+        examples = [{"question": f"question {i}", "sql": "SELECT 1"} for i in range(num_examples)]
+        start = time.perf_counter()
+        index = few_shot.ExampleIndex(examples, embeddings)
+        build = time.perf_counter() - start
+        exact = EmbeddingIndex([example["question"] for example in examples], embeddings)
+        targets = rng.integers(0, num_examples, lookups)
+        queries = embeddings[targets] + (rng.standard_normal((lookups, dimensions)) * scale * 0.5).astype(np.float32)
+
+        def timed(search):
+            timings, found = [], []
+            for query in queries:
+                start = time.perf_counter()
+                found.append(search(query, top_k))
+                timings.append(time.perf_counter() - start)
+            return timings, found
+
+        # Separate passes, so the exact scan doesn't evict the prefix matrix between lookups
+        approximate_timings, approximate = timed(index.search)
+        exact_timings, expected = timed(exact.search)
+        found = sum(
+            len({example["question"] for example, _ in got} & {key for key, _, _ in want})
+            for got, want in zip(approximate, expected)
+        )
+        print(f"examples={num_examples} build={build * 1000:.0f} ms recall@{top_k}={found / (lookups * top_k):.3f}")
+        for name, values in (("prefix + rerank", approximate_timings), ("exact scan", exact_timings)):
+            print(f"  {name:<16} p50={percentile(values, 50) * 1000:7.3f} ms  p99={percentile(values, 99) * 1000:7.3f} ms")
+
+
+def create_wide_sqlite_database(path: str, num_tables: int, rows_per_table: int = 20):
+    """
+    Create `num_tables` small tables in SQLite linked as a tree: table_i has a foreign key to
+    table_((i - 1) // 4). A long chain would make SQLAlchemy's reflection recurse too deep.
+    """
+    connection = sqlite3.connect(path)
+    for i in range(num_tables):
+        parent = f", table_{(i - 1) // 4}_id INTEGER REFERENCES table_{(i - 1) // 4}(id)" if i > 0 else ""
+        connection.execute(f"CREATE TABLE table_{i} (id INTEGER PRIMARY KEY, name TEXT, amount REAL, created_at TEXT{parent})")
+        values = [
+            (row, f"item {row}", row * 1.5, f"2024-01-{row % 28 + 1:02d}") + ((row,) if i > 0 else ())
+            for row in range(1, rows_per_table + 1)
+        ]
+        connection.executemany(f"INSERT INTO table_{i} VALUES ({', '.join('?' * len(values[0]))})", values)
+    connection.commit()
+    connection.close()
+
+
+def create_star_sqlite_database(path: str, dimensions: int, width: int, rows_per_table: int = 10):
+    """
+    A star schema of `width`-column tables: a fact table with a foreign key to each of
+    `dimensions` dimension tables, every dimension with one narrow outrigger table.
+    """
+    connection = sqlite3.connect(path)
+    kinds = ("TEXT", "REAL", "INTEGER", "TEXT", "DATE")
+
+    def attributes(prefix):
+        return [f"{prefix}_attr_{j} {kinds[j % len(kinds)]}" for j in range(width)]
+
+    def insert(table_name, count):
+        values = [tuple(row if j < 2 else f"v{row}" for j in range(count)) for row in range(1, rows_per_table + 1)]
+        connection.executemany(f"INSERT INTO {table_name} VALUES ({', '.join('?' * count)})", values)
+
+    for d in range(dimensions):
+        connection.execute(f"CREATE TABLE outrigger_{d} (id INTEGER PRIMARY KEY, label TEXT)")
+        insert(f"outrigger_{d}", 2)
+        connection.execute(
+            f"CREATE TABLE dim_{d} (id INTEGER PRIMARY KEY, outrigger_{d}_id INTEGER REFERENCES outrigger_{d}(id), "
+            f"{', '.join(attributes(f'dim_{d}'))})"
+        )
+        insert(f"dim_{d}", width + 2)
+    foreign_keys = [f"dim_{d}_id INTEGER REFERENCES dim_{d}(id)" for d in range(dimensions)]
+    measures = [f"measure_{j} REAL" for j in range(max(0, width - dimensions - 1))]
+    connection.execute(f"CREATE TABLE fact_sales (id INTEGER PRIMARY KEY, {', '.join(foreign_keys + measures)})")
+    insert("fact_sales", 1 + len(foreign_keys) + len(measures))
+    connection.commit()
+    connection.close()
+
+
+def benchmark_wide_schema(dimensions: int, width: int, num_requests: int, budgets, chat_latency: float,
+                          prompt_latency: float, port: int = 8100):
+    """
+    Prompt size and latency of run_pipeline on a wide star schema for each schema token budget
+    (0 shows every column), with stub LLM services whose latency grows with the prompt. The
+    stub embeddings are random, so this measures size and speed, not which columns are picked.
+    """
+    stub_llm_server.settings.update(chat_latency=chat_latency, prompt_latency=prompt_latency)
+    graph, restore = install_offline_services(port, 0.0)
+    tracing.TRACING_ENABLED = True
+    # Keep earlier answers out of the way: every question goes through generation
+    few_shot.FEW_SHOT_ENABLED = False
+    server.answer_cache.max_entries = 0
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "star.db")
+            create_star_sqlite_database(path, dimensions, width)
+            engine = create_engine(f"sqlite:///{path}")
+            metadata = MetaData()
+            metadata.reflect(bind=engine)
+            start = time.perf_counter()
+            neo4j_setup.sync_schema_in_neo4j("wide", engine, metadata)
+            columns = sum(len(table.columns) for table in metadata.tables.values())
+            print(f"tables={len(metadata.tables)} columns={columns} configure={time.perf_counter() - start:.1f}s "
+                  f"column_embeddings={sum(len(c) for c in graph.columns.values())} chat_latency={chat_latency}s "
+                  f"prompt_latency={prompt_latency}s per 1k tokens")
+
+            for budget in budgets:
+                schema_pruning.SCHEMA_PROMPT_TOKEN_BUDGET = budget
+                prompt_tokens, generate, pipeline, shown = [], [], [], []
+                for i in range(num_requests):
+                    with tracing.trace() as trace:
+                        start = time.perf_counter()
+                        user_query_runner.run_pipeline(
+                            f"Question {i}: total measure_1 by dim_{i % dimensions}_attr_3", "wide",
+                            engine=engine, metadata=metadata
+                        )
+                        pipeline.append(time.perf_counter() - start)
+                    spans = {span.name: span for span in trace.spans}
+                    prompt_tokens.append(spans["generate_sql"].attributes.get("prompt_tokens", 0))
+                    generate.append(spans["generate_sql"].duration)
+                    shown.append(spans["prune_columns"].attributes.get("columns", columns))
+                label = f"budget={budget}" if budget else "all columns"
+                print(f"{label:>14}: prompt_tokens p50={percentile(prompt_tokens, 50):>6} "
+                      f"columns_shown p50={percentile(shown, 50):>5} "
+                      f"generate_sql p50={percentile(generate, 50) * 1000:7.0f} ms "
+                      f"pipeline p50={percentile(pipeline, 50) * 1000:7.0f} ms")
+    finally:
+        restore()
+
+
+def percentile(values, pct: float):
+    ordered = sorted(values)
+    if not ordered:
+        return float("nan")
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB (Linux reports KB)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def run_concurrently(send, total: int, concurrency: int):
+    """Call `send(i)` for i in range(total), at most `concurrency` at a time; returns (latencies, failures, wall time)."""
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    latencies, failures = [], []
+
+    async def one(i):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await send(i)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                failures.append(response.status_code)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return latencies, failures, time.perf_counter() - start
+
+
+def report(label: str, latencies, failures, elapsed: float):
+    print(f"  {label:<22} n={len(latencies):<5} throughput={len(latencies) / elapsed:8.2f}/s  "
+          f"p50={percentile(latencies, 50) * 1000:9.1f} ms  p99={percentile(latencies, 99) * 1000:9.1f} ms  "
+          f"failures={len(failures)}  peak_rss={peak_rss_mb():8.1f} MB")
+
+
+def install_offline_services(port: int, graph_latency: float):
+    """Point every LLM client at the stub server and every Neo4j driver at the in-memory graph."""
+    stub = stub_llm_server.start_in_thread(port)
+    stub_client = openai.OpenAI(base_url=f"http://127.0.0.1:{port}/v1", api_key="stub")
+    graph = stub_graph.StubGraphDriver(latency=graph_latency)
+    originals = {
+        (neo4j_setup, "client"): neo4j_setup.client,
+        (neo4j_setup, "neo4j_driver"): neo4j_setup.neo4j_driver,
+        (user_query_runner, "client"): user_query_runner.client,
+        (user_query_runner, "deepseek_client"): user_query_runner.deepseek_client,
+        (user_query_runner, "neo4j_driver"): user_query_runner.neo4j_driver,
+        (few_shot, "neo4j_driver"): few_shot.neo4j_driver,
+        (schema_pruning, "neo4j_driver"): schema_pruning.neo4j_driver,
+    }
+    for module, name in originals:
+        setattr(module, name, graph if name == "neo4j_driver" else stub_client)
+
+    def restore():
+        for (module, name), value in originals.items():
+            setattr(module, name, value)
+        stub.should_exit = True
+    return graph, restore
+
+
+def benchmark_e2e(table_counts, databases: int, num_requests: int, concurrency: int, chat_latency: float,
+                  embedding_latency: float, error_rate: float, graph_latency: float, embedding_dimensions: int,
+                  port: int = 8100):
+    """
+    Drive /api/configure-db and /api/run-query end to end against generated SQLite schemas,
+    with the LLM and embedding APIs served by the stub server and Neo4j replaced by an
+    in-memory graph. Peak RSS is process-wide, so schema sizes run smallest first.
+    """
+    stub_llm_server.settings.update(
+        chat_latency=chat_latency,
+        embedding_latency=embedding_latency,
+        error_rate=error_rate,
+        embedding_dimensions=embedding_dimensions,
+    )
+    graph, restore = install_offline_services(port, graph_latency)
+    print(f"databases={databases} requests={num_requests} concurrency={concurrency} chat_latency={chat_latency}s "
+          f"embedding_latency={embedding_latency}s error_rate={error_rate} graph_latency={graph_latency}s")
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for num_tables in sorted(table_counts):
+                db_configs = []
+                for d in range(databases):
+                    path = os.path.join(tmp_dir, f"e2e_{num_tables}_{d}.db")
+                    create_wide_sqlite_database(path, num_tables)
+                    db_configs.append({"type": "default", "database": path})
+                print(f"tables={num_tables}")
+                asyncio.run(_e2e_rounds(db_configs, num_tables, num_requests, concurrency))
+    finally:
+        restore()
+
+    stats = stub_llm_server.stats
+    print(f"stub: chat_requests={stats['chat_requests']} embedding_requests={stats['embedding_requests']} "
+          f"injected_errors={stats['errors']} rate_limited={stats['rate_limited']} graph_round_trips={graph.round_trips}")
+    if tracing.TRACING_ENABLED:
+        print("mean time per stage:")
+        for (stage,), (count, total) in sorted(tracing.stage_seconds.totals().items()):
+            print(f"  {stage:<22} n={count:<6} mean={total / count * 1000:9.1f} ms")
+
+
+async def _e2e_rounds(db_configs, num_tables: int, num_requests: int, concurrency: int):
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http_client:
+        async def configure(i):
+            return await http_client.post("/api/configure-db", json=db_configs[i % len(db_configs)])
+
+        # Cold: describe, embed and write every table; warm: fingerprints match, nothing to do
+        report("configure-db (cold)", *await run_concurrently(configure, len(db_configs), concurrency))
+        report("configure-db (warm)", *await run_concurrently(configure, num_requests, concurrency))
+
+        async def run_query(i):
+            # Distinct questions so the semantic cache doesn't answer them
+            return await http_client.post("/api/run-query", json={
+                "query": f"Question {i}: what is the total amount in table_{i % num_tables}?",
+                "dbConfig": db_configs[i % len(db_configs)],
+            })
+
+        report("run-query", *await run_concurrently(run_query, num_requests, concurrency))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline backend benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    concurrency_parser = subparsers.add_parser("concurrency", help="Simultaneous /api/run-query calls")
+    concurrency_parser.add_argument("--requests", type=int, default=8)
+    concurrency_parser.add_argument("--latency", type=float, default=0.5)
+
+    neo4j_parser = subparsers.add_parser("neo4j-writes", help="Per-row vs batched graph writes")
+    neo4j_parser.add_argument("--tables", type=int, default=2000)
+    neo4j_parser.add_argument("--batch-size", type=int, default=neo4j_setup.NEO4J_BATCH_SIZE)
+
+    embeddings_parser = subparsers.add_parser("embeddings", help="Batched embeddings against the stub server")
+    embeddings_parser.add_argument("--tables", type=int, default=2000)
+    embeddings_parser.add_argument("--rate-limit-every", type=int, default=0)
+    embeddings_parser.add_argument("--port", type=int, default=8100)
+
+    export_parser = subparsers.add_parser("export", help="Memory profile of a streamed full export")
+    export_parser.add_argument("--rows", type=int, default=10_000_000)
+    export_parser.add_argument("--format", choices=sorted(result_export.ENCODERS), default="csv")
+    export_parser.add_argument("--chunk-size", type=int, default=result_export.EXPORT_CHUNK_SIZE)
+
+    encoding_parser = subparsers.add_parser("encoding", help="Response serialization time per result format")
+    encoding_parser.add_argument("--rows", type=int, default=100_000)
+    encoding_parser.add_argument("--columns", type=int, default=20)
+
+    e2e_parser = subparsers.add_parser("e2e", help="configure-db and run-query end to end against stub services")
+    e2e_parser.add_argument("--tables", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    e2e_parser.add_argument("--databases", type=int, default=1, help="Distinct databases per schema size")
+    e2e_parser.add_argument("--requests", type=int, default=50)
+    e2e_parser.add_argument("--concurrency", type=int, default=8)
+    e2e_parser.add_argument("--chat-latency", type=float, default=0.2)
+    e2e_parser.add_argument("--embedding-latency", type=float, default=0.05)
+    e2e_parser.add_argument("--error-rate", type=float, default=0.0)
+    e2e_parser.add_argument("--graph-latency", type=float, default=0.002, help="Seconds per Neo4j statement")
+    e2e_parser.add_argument("--embedding-dimensions", type=int, default=stub_llm_server.EMBEDDING_DIMENSIONS)
+    e2e_parser.add_argument("--port", type=int, default=8100)
+
+    few_shot_parser = subparsers.add_parser("few-shot", help="Few-shot example lookup latency and recall")
+    few_shot_parser.add_argument("--examples", type=int, nargs="+", default=[1000, 10000, 50000])
+    few_shot_parser.add_argument("--dimensions", type=int, default=1536)
+    few_shot_parser.add_argument("--lookups", type=int, default=1000)
+
+    wide_parser = subparsers.add_parser("wide-schema", help="Prompt size and latency with column pruning on a wide star schema")
+    wide_parser.add_argument("--dimensions", type=int, default=24)
+    wide_parser.add_argument("--width", type=int, default=200, help="Columns per fact and dimension table")
+    wide_parser.add_argument("--requests", type=int, default=10)
+    wide_parser.add_argument("--budgets", type=int, nargs="+", default=[0, 8000, 4000, 2000])
+    wide_parser.add_argument("--chat-latency", type=float, default=0.2)
+    wide_parser.add_argument("--prompt-latency", type=float, default=0.05, help="Seconds per 1,000 prompt tokens")
+    wide_parser.add_argument("--port", type=int, default=8100)
+
+    args = parser.parse_args()
+    if args.benchmark == "concurrency":
+        benchmark_concurrency(args.requests, args.latency)
+    elif args.benchmark == "neo4j-writes":
+        benchmark_neo4j_writes(args.tables, args.batch_size)
+    elif args.benchmark == "embeddings":
+        benchmark_embeddings(args.tables, args.rate_limit_every, args.port)
+    elif args.benchmark == "export":
+        benchmark_export(args.rows, args.format, args.chunk_size)
+    elif args.benchmark == "encoding":
+        benchmark_encoding(args.rows, args.columns)
+    elif args.benchmark == "e2e":
+        benchmark_e2e(args.tables, args.databases, args.requests, args.concurrency, args.chat_latency,
+                      args.embedding_latency, args.error_rate, args.graph_latency, args.embedding_dimensions, args.port)
+    elif args.benchmark == "few-shot":
+        benchmark_few_shot(args.examples, args.dimensions, args.lookups)
+    elif args.benchmark == "wide-schema":
+        benchmark_wide_schema(args.dimensions, args.width, args.requests, args.budgets, args.chat_latency,
+                              args.prompt_latency, args.port)
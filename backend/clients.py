@@ -0,0 +1,104 @@
+"""
+Process-wide clients shared by the whole backend: one Neo4j driver, pooled keep-alive HTTP
+clients for the LLM APIs and the pool settings for warehouse engines.
+
+Everything is configured from the environment. server.py warms the clients up on startup
+and closes them on shutdown.
+"""
+import os
+import httpx
+import openai
+from neo4j import GraphDatabase
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+
+# Neo4j connection and driver pool
+NEO4J_URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
+NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
+NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "test123123")
+NEO4J_MAX_POOL_SIZE = int(os.getenv("NEO4J_MAX_POOL_SIZE", "50"))
+NEO4J_MAX_CONNECTION_LIFETIME = float(os.getenv("NEO4J_MAX_CONNECTION_LIFETIME", "3600"))
+NEO4J_CONNECTION_ACQUISITION_TIMEOUT = float(os.getenv("NEO4J_CONNECTION_ACQUISITION_TIMEOUT", "60"))
+
+# HTTP pool of each LLM client: open connections, idle keep-alive connections and how long they idle
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+# Open the LLM connections on startup, at the cost of one models.list() call per client
+LLM_WARMUP = os.getenv("LLM_WARMUP", "false").lower() == "true"
+
+DEEPSEEK_BASE_URL = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1")
+# Required; there is no default key
+DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
+
+# Connection pool of each warehouse engine; sized so parallel table descriptions don't churn connections
+WAREHOUSE_POOL_SIZE = int(os.getenv("WAREHOUSE_POOL_SIZE", "10"))
+WAREHOUSE_MAX_OVERFLOW = int(os.getenv("WAREHOUSE_MAX_OVERFLOW", "10"))
+WAREHOUSE_POOL_RECYCLE = int(os.getenv("WAREHOUSE_POOL_RECYCLE", "1800"))
+WAREHOUSE_POOL_PRE_PING = os.getenv("WAREHOUSE_POOL_PRE_PING", "true").lower() == "true"
+
+neo4j_driver = GraphDatabase.driver(
+    NEO4J_URI,
+    auth=(NEO4J_USER, NEO4J_PASSWORD),
+    max_connection_pool_size=NEO4J_MAX_POOL_SIZE,
+    max_connection_lifetime=NEO4J_MAX_CONNECTION_LIFETIME,
+    connection_acquisition_timeout=NEO4J_CONNECTION_ACQUISITION_TIMEOUT,
+)
+
+
+def _http_client():
+    return openai.DefaultHttpxClient(
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=LLM_TIMEOUT,
+    )
+
+
+openai_client = openai.OpenAI(http_client=_http_client())
+# The placeholder keeps the SDK from falling back to OPENAI_API_KEY; warm_up refuses to start without the real key
+deepseek_client = openai.OpenAI(
+    base_url=DEEPSEEK_BASE_URL, api_key=DEEPSEEK_API_KEY or "DEEPSEEK_API_KEY-not-set", http_client=_http_client()
+)
+
+
+def engine_options(connection_string: str) -> dict:
+    """Pool arguments for create_engine; in-memory SQLite uses a single-connection pool that takes none."""
+    url = make_url(connection_string)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return {}
+    return {
+        "pool_size": WAREHOUSE_POOL_SIZE,
+        "max_overflow": WAREHOUSE_MAX_OVERFLOW,
+        "pool_recycle": WAREHOUSE_POOL_RECYCLE,
+        "pool_pre_ping": WAREHOUSE_POOL_PRE_PING,
+    }
+
+
+def create_warehouse_engine(connection_string: str):
+    return create_engine(connection_string, **engine_options(connection_string))
+
+
+def warm_up():
+    """Open the Neo4j pool (and the LLM connections with LLM_WARMUP) before the first request."""
+    if not DEEPSEEK_API_KEY:
+        raise RuntimeError("DEEPSEEK_API_KEY is not set; the SQL generation client needs it")
+    try:
+        neo4j_driver.verify_connectivity()
+    except Exception as e:
+        print(f"Warning: Neo4j is not reachable at {NEO4J_URI}: {e}")
+    if LLM_WARMUP:
+        for name, llm_client in (("openai", openai_client), ("deepseek", deepseek_client)):
+            try:
+                llm_client.models.list()
+            except Exception as e:
+                print(f"Warning: could not warm up the {name} client: {e}")
+
+
+def close():
+    neo4j_driver.close()
+    openai_client.close()
+    deepseek_client.close()
@@ -0,0 +1,88 @@
+from collections import OrderedDict
+import os
+import threading
+from sqlalchemy import MetaData
+from clients import create_warehouse_engine
+
+# Maximum number of databases kept with a live engine and reflected metadata
+ENGINE_REGISTRY_SIZE = int(os.getenv("ENGINE_REGISTRY_SIZE", "8"))
+
+
+class _RegistryEntry:
+    def __init__(self, engine):
+        self.engine = engine
+        self.metadata = None
+        # Serializes reflection so concurrent requests don't reflect the same database twice
+        self.lock = threading.Lock()
+
+
+class EngineRegistry:
+    """
+    Process-wide cache of one pooled engine and one reflected MetaData per database.
+
+    Entries are keyed by the database name (see server.generate_database_name) and
+    evicted in least-recently-used order once more than `max_size` databases are held.
+    Evicted engines are disposed so their connection pools are closed.
+    """
+
+    def __init__(self, max_size: int = ENGINE_REGISTRY_SIZE):
+        self.max_size = max(1, max_size)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_entry(self, database_name: str, connection_string: str) -> _RegistryEntry:
+        evicted = []
+        with self._lock:
+            entry = self._entries.get(database_name)
+            if entry is not None:
+                self._entries.move_to_end(database_name)
+                return entry
+
+            entry = _RegistryEntry(create_warehouse_engine(connection_string))
+            self._entries[database_name] = entry
+            while len(self._entries) > self.max_size:
+                _, old_entry = self._entries.popitem(last=False)
+                evicted.append(old_entry)
+
+        # Dispose outside the registry lock so slow pool shutdowns don't block lookups
+        for old_entry in evicted:
+            old_entry.engine.dispose()
+        return entry
+
+    def get_engine(self, database_name: str, connection_string: str):
+        """Return the pooled engine for a database, creating it on first use."""
+        return self._get_entry(database_name, connection_string).engine
+
+    def get(self, database_name: str, connection_string: str):
+        """Return (engine, metadata) for a database, reflecting the schema only on first use."""
+        entry = self._get_entry(database_name, connection_string)
+        with entry.lock:
+            if entry.metadata is None:
+                metadata = MetaData()
+                metadata.reflect(bind=entry.engine)
+                entry.metadata = metadata
+            return entry.engine, entry.metadata
+
+    def put_metadata(self, database_name: str, connection_string: str, metadata: MetaData):
+        """Replace the cached reflection for a database, e.g. after a fresh reflect on configure."""
+        entry = self._get_entry(database_name, connection_string)
+        with entry.lock:
+            entry.metadata = metadata
+
+    def invalidate(self, database_name: str):
+        """Drop a database from the registry and dispose its engine."""
+        with self._lock:
+            entry = self._entries.pop(database_name, None)
+        if entry is not None:
+            entry.engine.dispose()
+
+    def clear(self):
+        """Dispose every engine held by the registry."""
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            entry.engine.dispose()
+
+
+engine_registry = EngineRegistry()
@@ -0,0 +1,188 @@
+"""
+Per-database store of question -> SQL pairs that executed and passed the judge, retrieved by
+question embedding as few-shot examples for SQL generation.
+
+Pairs are persisted as Example nodes in Neo4j and loaded lazily into one append-only
+ExampleIndex per database. A search scores a short prefix of every embedding first
+(text-embedding-3 embeddings stay meaningful when truncated) and reranks the best
+candidates on the full vectors, which keeps a lookup over 30,000 pairs under a
+millisecond on one core (see `benchmark.py few-shot`).
+"""
+import os
+import threading
+import time
+import numpy as np
+import clients
+from vector_index import IndexRegistry
+
+# Store validated pairs and inject the closest ones into the SQL generation prompt
+FEW_SHOT_ENABLED = os.getenv("FEW_SHOT_ENABLED", "true").lower() == "true"
+# Examples injected per prompt and the similarity they need to be injected at all
+FEW_SHOT_EXAMPLES = int(os.getenv("FEW_SHOT_EXAMPLES", "3"))
+FEW_SHOT_MIN_SIMILARITY = float(os.getenv("FEW_SHOT_MIN_SIMILARITY", "0.80"))
+# Similarity of the best example above which the column-analysis LLM call is skipped
+FEW_SHOT_STRONG_SIMILARITY = float(os.getenv("FEW_SHOT_STRONG_SIMILARITY", "0.90"))
+# Only store pairs the judge accepted; with "false" every pair that executed is stored
+FEW_SHOT_REQUIRE_JUDGE = os.getenv("FEW_SHOT_REQUIRE_JUDGE", "true").lower() == "true"
+# Embedding prefix scored against every example, and how many candidates are reranked in full
+FEW_SHOT_PREFIX_DIMENSIONS = int(os.getenv("FEW_SHOT_PREFIX_DIMENSIONS", "64"))
+FEW_SHOT_CANDIDATES = int(os.getenv("FEW_SHOT_CANDIDATES", "64"))
+
+neo4j_driver = clients.neo4j_driver
+
+# Run by neo4j_setup when a database is configured, so storing an answer never writes the schema
+CREATE_EXAMPLE_INDEX_QUERY = (
+    "CREATE INDEX example_database_question IF NOT EXISTS FOR (e:Example) ON (e.database, e.question)"
+)
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class ExampleIndex:
+    """
+    Append-only index of example embeddings with a two-stage search.
+
+    Rows live in preallocated arrays that double when full. A writer fills the next row
+    before publishing the new row count, and readers take one snapshot of
+    (arrays, count), so searches never lock and never see a half-written row.
+    """
+
+    def __init__(self, examples=(), embeddings=(), prefix_dimensions: int = FEW_SHOT_PREFIX_DIMENSIONS,
+                 candidates: int = FEW_SHOT_CANDIDATES):
+        self.prefix_dimensions = prefix_dimensions
+        self.candidates = candidates
+        self._rows = {}
+        self._lock = threading.Lock()
+        self._state = (None, None, [], 0)
+        examples = list(examples)
+        if examples:
+            self._load(examples, np.asarray(embeddings, dtype=np.float32).reshape(len(examples), -1))
+
+    def _load(self, examples, matrix):
+        """Fill an empty index in one pass; later duplicates of a question win, as with add."""
+        rows = {example["question"]: i for i, example in enumerate(examples)}
+        keep = sorted(rows.values())
+        count, dimensions = len(keep), matrix.shape[1]
+        full = np.zeros((max(1024, 2 * count), dimensions), dtype=np.float32)
+        prefix = np.zeros((full.shape[0], min(self.prefix_dimensions, dimensions)), dtype=np.float32)
+        full[:count] = _normalize(matrix[keep])
+        prefix[:count] = _normalize(matrix[keep, :prefix.shape[1]])
+        self._rows = {examples[i]["question"]: row for row, i in enumerate(keep)}
+        self._state = (full, prefix, [examples[i] for i in keep], count)
+
+    def __len__(self):
+        return self._state[3]
+
+    def add(self, example: dict, embedding):
+        """Add a pair, or replace the SQL of a question that is already indexed."""
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        with self._lock:
+            full, prefix, examples, count = self._state
+            row = self._rows.get(example["question"])
+            if row is not None:
+                examples[row] = example
+                return
+            if full is not None and vector.shape[0] != full.shape[1]:
+                raise ValueError(f"Embedding has {vector.shape[0]} dimensions, the index {full.shape[1]}")
+            if full is None or count == full.shape[0]:
+                capacity = max(1024, 2 * count)
+                dimensions = vector.shape[0]
+                grown_full = np.zeros((capacity, dimensions), dtype=np.float32)
+                grown_prefix = np.zeros((capacity, min(self.prefix_dimensions, dimensions)), dtype=np.float32)
+                if full is not None:
+                    grown_full[:count] = full[:count]
+                    grown_prefix[:count] = prefix[:count]
+                full, prefix, examples = grown_full, grown_prefix, list(examples)
+            full[count] = _normalize(vector)
+            prefix[count] = _normalize(vector[:prefix.shape[1]])
+            examples.append(example)
+            self._rows[example["question"]] = count
+            self._state = (full, prefix, examples, count + 1)
+
+    def search(self, query_embedding, top_k: int = FEW_SHOT_EXAMPLES):
+        """Return [(example, cosine similarity)] for the top_k closest questions."""
+        full, prefix, examples, count = self._state
+        if count == 0 or top_k <= 0:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32).ravel()
+        if query.shape[0] != full.shape[1] or not np.any(query):
+            return []
+        query = _normalize(query)
+        if count > self.candidates:
+            coarse = prefix[:count] @ _normalize(query[:prefix.shape[1]])
+            candidates = np.argpartition(-coarse, self.candidates - 1)[:self.candidates]
+        else:
+            candidates = np.arange(count)
+        scores = full[candidates] @ query
+        top_k = min(top_k, len(candidates))
+        ranked = np.argsort(-scores)[:top_k]
+        return [(examples[candidates[i]], float(scores[i])) for i in ranked]
+
+
+def load_examples(database_name: str) -> ExampleIndex:
+    """Load every stored pair of a database from Neo4j into an ExampleIndex."""
+    with neo4j_driver.session() as session:
+        records = list(session.run(
+            """
+            MATCH (e:Example)
+            WHERE e.database = $database
+            RETURN e.question AS question, e.sql AS sql, e.embedding AS embedding
+            ORDER BY e.created_at
+            """,
+            database=database_name,
+        ))
+    return ExampleIndex(
+        [{"question": record["question"], "sql": record["sql"]} for record in records],
+        [record["embedding"] for record in records],
+    )
+
+
+# Example indexes, one per database
+example_indexes = IndexRegistry()
+
+
+def find_examples(database_name: str, query_embedding, top_k: int = FEW_SHOT_EXAMPLES,
+                  min_similarity: float = FEW_SHOT_MIN_SIMILARITY):
+    """Return [(example, similarity)] for the stored pairs closest to the question, best first."""
+    if not FEW_SHOT_ENABLED:
+        return []
+    index = example_indexes.get(database_name, load_examples)
+    return [(example, similarity) for example, similarity in index.search(query_embedding, top_k)
+            if similarity >= min_similarity]
+
+
+def has_examples(database_name: str) -> bool:
+    return FEW_SHOT_ENABLED and len(example_indexes.get(database_name, load_examples)) > 0
+
+
+def store_example(database_name: str, question: str, sql: str, embedding):
+    """Persist a validated pair and add it to the in-memory index of its database."""
+    if not FEW_SHOT_ENABLED:
+        return
+    with neo4j_driver.session() as session:
+        session.run(
+            """
+            MERGE (e:Example {database: $database, question: $question})
+            SET e.sql = $sql, e.embedding = $embedding, e.created_at = $created_at
+            """,
+            database=database_name,
+            question=question,
+            sql=sql,
+            embedding=[float(value) for value in embedding],
+            created_at=time.time(),
+        )
+    example_indexes.get(database_name, load_examples).add({"question": question, "sql": sql}, embedding)
+
+
+def format_examples(examples) -> str:
+    """Render examples as a prompt section, or an empty string without any."""
+    if not examples:
+        return ""
+    lines = ["Examples of questions about this database answered with correct SQL:\n"]
+    for example, _ in examples:
+        lines.append(f"Question: {example['question']}\nSQL:\n```sql\n{example['sql']}\n```\n")
+    return "\n".join(lines)
@@ -1,91 +1,212 @@
-from neo4j import GraphDatabase
-import openai
 from sqlalchemy import create_engine, MetaData, text
+import clients
+import few_shot
+import openai
+from schema_fingerprint import table_fingerprint
+import schema_pruning
+from vector_index import table_indexes
+import tracing
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
+import random
+import threading
+import time
+
+# Shared LLM client and Neo4j driver (see clients.py)
+client = clients.openai_client
+neo4j_driver = clients.neo4j_driver
+
+# Embedding request limits: approximate token budget and input count per request
+EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", "100000"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "2048"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "5"))
 
-client = openai.OpenAI()
+# Parallel description generation: worker count, LLM token budget and expected completion size
+DESCRIPTION_CONCURRENCY = int(os.getenv("DESCRIPTION_CONCURRENCY", "8"))
+DESCRIPTION_TOKENS_PER_MINUTE = int(os.getenv("DESCRIPTION_TOKENS_PER_MINUTE", "200000"))
+DESCRIPTION_COMPLETION_TOKENS = 300
 
-# Neo4j Connection Details
-NEO4J_URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
-NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
-NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "test123123")
+# Rows per UNWIND batch when writing tables, relationships and embeddings
+NEO4J_BATCH_SIZE = int(os.getenv("NEO4J_BATCH_SIZE", "500"))
 
-# Connect to Neo4j
-neo4j_driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+def chunked(items, size):
+    """Yield successive slices of `items` with at most `size` elements."""
+    size = max(1, size)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def run_in_batches(session, query, rows, batch_size, **params):
+    """Run an UNWIND $rows query in one write transaction per chunk of rows."""
+    for batch in chunked(rows, batch_size):
+        session.execute_write(lambda tx: tx.run(query, rows=batch, **params).consume())
 
 # Function to generate embeddings using OpenAI
-def get_openai_embeddings(texts):
+def get_openai_embeddings(texts, model="text-embedding-ada-002"):
     response = client.embeddings.create(
         input=texts,
-        model="text-embedding-ada-002"
+        model=model
     )
+    tracing.record_llm_usage(response.usage)
     return [data.embedding for data in response.data]
 
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (about four characters per token) used for batch sizing."""
+    return max(1, len(text) // 4)
+
+def batch_by_token_budget(texts, max_tokens: int = EMBEDDING_BATCH_TOKENS, max_inputs: int = EMBEDDING_BATCH_SIZE):
+    """Split texts into consecutive batches that stay within the token budget and input limit."""
+    batches = []
+    current, current_tokens = [], 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_inputs):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def get_embeddings_with_retry(texts, max_retries: int = EMBEDDING_MAX_RETRIES, **kwargs):
+    """Embed one batch, backing off exponentially with jitter on rate limits and transient errors."""
+    for attempt in range(max_retries + 1):
+        try:
+            return get_openai_embeddings(texts, **kwargs)
+        except (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError) as e:
+            if attempt == max_retries:
+                raise
+            delay = min(30.0, 2 ** attempt) * (0.5 + random.random() / 2)
+            print(f"Embedding request failed ({e.__class__.__name__}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+def embed_texts_in_batches(texts, **kwargs):
+    """Embed a list of texts with as few requests as the batch limits allow, preserving order."""
+    embeddings = []
+    for batch in batch_by_token_budget(texts):
+        embeddings.extend(get_embeddings_with_retry(batch, **kwargs))
+    return embeddings
+
+class TokenRateLimiter:
+    """Token bucket that blocks callers until their estimated tokens fit the per-minute budget."""
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = max(1, tokens_per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: int):
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+def fetch_sample_row(engine, table_name, table):
+    """Fetch one row with non-null and non-zero values to use as column examples."""
+    try:
+        with engine.connect() as connection:
+            query = f'SELECT * FROM "{table_name}" WHERE '
+            conditions = []
+            for col in table.columns:
+                col_name = col.name if col.name.isidentifier() else f'"{col.name}"'
+                col_type = str(col.type).lower()
+                if any(t in col_type for t in ('int', 'float', 'numeric', 'real', 'decimal')):
+                    conditions.append(f"({col_name} IS NOT NULL AND {col_name} != 0)")
+                else:
+                    conditions.append(f"{col_name} IS NOT NULL")
+            query += " AND ".join(conditions) + " LIMIT 1"
+            row = connection.execute(text(query)).fetchone()
+            return dict(row._mapping) if row else {}
+    except Exception as e:
+        print(f"Warning: Could not fetch sample data for {table_name}: {e}")
+        return {}
+
+def describe_table(engine, table_name, table, rate_limiter=None):
+    """Generate an LLM description of one table from its schema and a sample row."""
+    # Get primary key columns
+    pk_columns = [key.name for key in table.primary_key]
+    
+    # Get foreign key relationships
+    fk_relationships = []
+    for fk in table.foreign_keys:
+        fk_relationships.append(f"{fk.parent.name} -> {fk.column.table.name}.{fk.column.name}")
+    
+    # Get sample data for each column
+    sample_data = fetch_sample_row(engine, table_name, table)
+
+    # Prepare table schema details with example values
+    columns = []
+    for col in table.columns:
+        col_name = col.name if col.name.isidentifier() else f'"{col.name}"'
+        example_value = str(sample_data.get(col.name, 'N/A'))
+        if len(example_value) > 50:
+            example_value = example_value[:47] + "..."
+        columns.append(f"{col_name} ({col.type}) - Example: {example_value}")
+
+    schema_description = (
+        f"Table {table_name}:\n"
+        f"Primary Keys: {', '.join(pk_columns)}\n"
+        f"Columns with examples:\n- " + "\n- ".join(columns) + "\n"
+        f"Foreign Keys: {', '.join(fk_relationships)}"
+    )
+    messages = [
+        {"role": "system", "content": "You are a database schema documentation assistant. Include example values in your description when available."},
+        {"role": "user", "content": f"Describe the following table schema concisely, mentioning the example values where relevant:\n{schema_description}"},
+    ]
+
+    if rate_limiter:
+        prompt_tokens = sum(estimate_tokens(message["content"]) for message in messages)
+        rate_limiter.acquire(prompt_tokens + DESCRIPTION_COMPLETION_TOKENS)
+
+    # Use OpenAI to generate description
+    response = client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=messages,
+    )
+    tracing.record_llm_usage(response.usage)
+    return response.choices[0].message.content.strip()
+
 # Function to generate table descriptions using OpenAI
-def generate_table_descriptions(engine, metadata):
+def generate_table_descriptions(engine, metadata, concurrency: int = DESCRIPTION_CONCURRENCY,
+                                tokens_per_minute: int = DESCRIPTION_TOKENS_PER_MINUTE, progress_callback=None,
+                                table_names=None):
+    """
+    Describe every table (or only `table_names`), running sample fetches and LLM calls on a bounded worker pool.
+
+    progress_callback(completed, total, table_name) is called as each table finishes.
+    """
     if not engine or not metadata:
         raise ValueError("Database configuration not initialized")
-        
+
+    if table_names is None:
+        table_names = list(metadata.tables.keys())
+    rate_limiter = TokenRateLimiter(tokens_per_minute) if tokens_per_minute > 0 else None
+    total = len(table_names)
     descriptions = {}
-    for table_name, table in metadata.tables.items():
-        # Get primary key columns
-        pk_columns = [key.name for key in table.primary_key]
-        
-        # Get foreign key relationships
-        fk_relationships = []
-        for fk in table.foreign_keys:
-            fk_relationships.append(f"{fk.parent.name} -> {fk.column.table.name}.{fk.column.name}")
-        
-        # Get sample data for each column
-        sample_data = {}
-        try:
-            with engine.connect() as connection:
-                # Fetch one row with non-null and non-zero values
-                query = f'SELECT * FROM "{table_name}" WHERE '
-                conditions = []
-                for col in table.columns:
-                    col_name = col.name if col.name.isidentifier() else f'"{col.name}"'
-                    col_type = str(col.type).lower()
-                    if any(t in col_type for t in ('int', 'float', 'numeric', 'real', 'decimal')):
-                        conditions.append(f"({col_name} IS NOT NULL AND {col_name} != 0)")
-                    else:
-                        conditions.append(f"{col_name} IS NOT NULL")
-                query += " AND ".join(conditions) + " LIMIT 1"
-                result = connection.execute(text(query))
-                row = result.fetchone()
-                if row:
-                    sample_data = dict(row._mapping)
-        except Exception as e:
-            connection.rollback()
-            print(f"Warning: Could not fetch sample data for {table_name}: {e}")
-
-        # Prepare table schema details with example values
-        columns = []
-        for col in table.columns:
-            col_name = col.name if col.name.isidentifier() else f'"{col.name}"'
-            example_value = str(sample_data.get(col.name, 'N/A'))
-            if len(example_value) > 50:
-                example_value = example_value[:47] + "..."
-            columns.append(f"{col_name} ({col.type}) - Example: {example_value}")
-
-        schema_description = (
-            f"Table {table_name}:\n"
-            f"Primary Keys: {', '.join(pk_columns)}\n"
-            f"Columns with examples:\n- " + "\n- ".join(columns) + "\n"
-            f"Foreign Keys: {', '.join(fk_relationships)}"
-        )
-        
-        # Use OpenAI to generate description
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a database schema documentation assistant. Include example values in your description when available."},
-                {"role": "user", "content": f"Describe the following table schema concisely, mentioning the example values where relevant:\n{schema_description}"},
-            ],
-        )
-        descriptions[table_name] = response.choices[0].message.content.strip()
-    
-    return descriptions
+    describe = tracing.propagate(describe_table)
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="describe") as executor:
+        futures = {
+            executor.submit(describe, engine, table_name, metadata.tables[table_name], rate_limiter): table_name
+            for table_name in table_names
+        }
+        for completed, future in enumerate(as_completed(futures), 1):
+            table_name = futures[future]
+            descriptions[table_name] = future.result()
+            print(f"Described table {completed}/{total}: {table_name}")
+            if progress_callback:
+                progress_callback(completed, total, table_name)
+
+    # Keep the requested table order regardless of completion order
+    return {table_name: descriptions[table_name] for table_name in table_names}
 
 def get_table_descriptions_from_neo4j():
     """Retrieve existing table descriptions from Neo4j with exact name matching"""
@@ -117,7 +238,8 @@ def get_table_info_from_neo4j(database_name: str):
                 t.database as database,
                 t.name as name,
                 t.description as description,
-                t.embedding as embedding
+                t.embedding IS NOT NULL as has_embedding,
+                t.fingerprint as fingerprint
         """, database_name=database_name)
         
         table_info = {}
@@ -126,21 +248,21 @@ def get_table_info_from_neo4j(database_name: str):
         for record in result:
             name = record["name"]
             desc = record["description"]
-            emb = record["embedding"]
             
             # Check if table has all required properties
-            is_valid = all(x is not None for x in [name, desc, emb])
+            is_valid = name is not None and desc is not None and record["has_embedding"]
             all_valid = all_valid and is_valid
             
             table_info[name] = {
                 "description": desc,
+                "fingerprint": record["fingerprint"],
                 "has_required_props": is_valid
             }
         
         return table_info, all_valid
 
 # Step 1: Create Graph in Neo4j
-def create_graph_in_neo4j(database_name, table_descriptions, metadata):
+def create_graph_in_neo4j(database_name, table_descriptions, metadata, batch_size: int = NEO4J_BATCH_SIZE):
     """Create graph with exact table name matching for specific database"""
     tables = metadata.tables
     with neo4j_driver.session() as session:
@@ -149,78 +271,306 @@ def create_graph_in_neo4j(database_name, table_descriptions, metadata):
             MATCH (t:Table {database: $database_name})
             DETACH DELETE t
         """, database_name=database_name)
+        session.run("""
+            MATCH (c:Column {database: $database_name})
+            DETACH DELETE c
+        """, database_name=database_name)
+        table_indexes.invalidate(database_name)
+        schema_pruning.column_indexes.invalidate(database_name)
 
         # Create indices for better performance
         session.run("CREATE INDEX table_name IF NOT EXISTS FOR (t:Table) ON (t.name)")
+        session.run("CREATE INDEX table_database_name IF NOT EXISTS FOR (t:Table) ON (t.database, t.name)")
+        session.run(few_shot.CREATE_EXAMPLE_INDEX_QUERY)
+
+        # Add tables as nodes with exact names, one transaction per batch
+        upsert_table_nodes(session, database_name, table_descriptions, metadata, batch_size)
+
+        # Add relationships with exact name matching
+        relationship_rows = [
+            {"source": source, "target": target}
+            for source, target in foreign_key_edges(metadata)
+        ]
+        run_in_batches(session, MERGE_RELATIONSHIPS_QUERY, relationship_rows, batch_size, database=database_name)
+
+def foreign_key_edges(metadata):
+    """Distinct (source, target) table pairs implied by the reflected foreign keys."""
+    return {
+        (fk.parent.table.name, fk.column.table.name)
+        for table in metadata.tables.values()
+        for fk in table.foreign_keys
+    }
+
+MERGE_RELATIONSHIPS_QUERY = """
+    UNWIND $rows AS row
+    MATCH (a:Table {database: $database, name: row.source})
+    MATCH (b:Table {database: $database, name: row.target})
+    MERGE (a)-[:RELATES_TO]->(b)
+"""
 
-        # Add tables as nodes with exact names
-        for table_name, description in table_descriptions.items():
-            session.run(
+def upsert_table_nodes(session, database_name, table_descriptions, metadata, batch_size: int = NEO4J_BATCH_SIZE):
+    """Create or update Table nodes with their description and schema fingerprint."""
+    rows = [
+        {
+            "name": table_name,
+            "description": description,
+            "fingerprint": table_fingerprint(metadata.tables[table_name]),
+        }
+        for table_name, description in table_descriptions.items()
+    ]
+    run_in_batches(
+        session,
+        """
+        UNWIND $rows AS row
+        MERGE (t:Table {database: $database, name: row.name})
+        SET t.description = row.description, t.fingerprint = row.fingerprint
+        """,
+        rows,
+        batch_size,
+        database=database_name,
+    )
+
+def plan_schema_sync(metadata, database_name):
+    """
+    Compare reflected tables against the Table nodes in Neo4j using per-table fingerprints.
+
+    Returns a dict with the added, changed, dropped and unchanged table names, the
+    unchanged nodes that only need their fingerprint backfilled, and the existing descriptions.
+    """
+    neo4j_tables, _ = get_table_info_from_neo4j(database_name)
+    added, changed, unchanged, backfill = [], [], [], []
+    for table_name, table in metadata.tables.items():
+        info = neo4j_tables.get(table_name)
+        if info is None:
+            added.append(table_name)
+        elif not info["has_required_props"]:
+            changed.append(table_name)
+        elif info["fingerprint"] is None:
+            # Nodes written before fingerprints existed: trust them, just record the fingerprint
+            backfill.append(table_name)
+            unchanged.append(table_name)
+        elif info["fingerprint"] != table_fingerprint(table):
+            changed.append(table_name)
+        else:
+            unchanged.append(table_name)
+
+    return {
+        "added": added,
+        "changed": changed,
+        "dropped": [name for name in neo4j_tables if name not in metadata.tables],
+        "unchanged": unchanged,
+        "backfill": backfill,
+        "descriptions": {name: info["description"] for name, info in neo4j_tables.items()},
+    }
+
+def sync_relationships(session, database_name, metadata, batch_size: int = NEO4J_BATCH_SIZE):
+    """Delete RELATES_TO edges that no longer exist and merge the missing ones."""
+    result = session.run("""
+        MATCH (a:Table {database: $database})-[:RELATES_TO]->(b:Table {database: $database})
+        RETURN a.name AS source, b.name AS target
+    """, database=database_name)
+    existing = {(record["source"], record["target"]) for record in result}
+    desired = foreign_key_edges(metadata)
+
+    stale_rows = [{"source": source, "target": target} for source, target in existing - desired]
+    missing_rows = [{"source": source, "target": target} for source, target in desired - existing]
+    run_in_batches(
+        session,
+        """
+        UNWIND $rows AS row
+        MATCH (a:Table {database: $database, name: row.source})-[r:RELATES_TO]->(b:Table {database: $database, name: row.target})
+        DELETE r
+        """,
+        stale_rows,
+        batch_size,
+        database=database_name,
+    )
+    run_in_batches(session, MERGE_RELATIONSHIPS_QUERY, missing_rows, batch_size, database=database_name)
+    return len(stale_rows), len(missing_rows)
+
+def prune_graph(database_name, metadata, plan, batch_size: int = NEO4J_BATCH_SIZE):
+    """Delete dropped tables and backfill fingerprints on legacy nodes."""
+    with neo4j_driver.session() as session:
+        session.run("CREATE INDEX table_name IF NOT EXISTS FOR (t:Table) ON (t.name)")
+        session.run("CREATE INDEX table_database_name IF NOT EXISTS FOR (t:Table) ON (t.database, t.name)")
+        session.run(few_shot.CREATE_EXAMPLE_INDEX_QUERY)
+
+        if plan["dropped"]:
+            delete_column_nodes(session, database_name, plan["dropped"], batch_size)
+            run_in_batches(
+                session,
                 """
-                CREATE (t:Table {database: $database, name: $name, description: $description})
-                WITH t
-                MATCH (existing:Table {database: $database, name: $name})
-                WHERE id(existing) <> id(t)
-                DELETE existing
+                UNWIND $rows AS name
+                MATCH (t:Table {database: $database, name: name})
+                DETACH DELETE t
                 """,
+                plan["dropped"],
+                batch_size,
                 database=database_name,
-                name=table_name,
-                description=description
             )
+            table_indexes.invalidate(database_name)
 
-        # Add relationships with exact name matching
-        for table_name, table in tables.items():
-            for fk in table.foreign_keys:
-                source = fk.parent.table.name
-                target = fk.column.table.name
-                session.run(
-                    """
-                    MATCH (a:Table {database: $database, name: $source})
-                    MATCH (b:Table {database: $database, name: $target})
-                    MERGE (a)-[:RELATES_TO]->(b)
-                    """,
-                    database=database_name,
-                    source=source,
-                    target=target
-                )
+        if plan["backfill"]:
+            run_in_batches(
+                session,
+                """
+                UNWIND $rows AS row
+                MATCH (t:Table {database: $database, name: row.name})
+                SET t.fingerprint = row.fingerprint
+                """,
+                [{"name": name, "fingerprint": table_fingerprint(metadata.tables[name])} for name in plan["backfill"]],
+                batch_size,
+                database=database_name,
+            )
+
+def write_graph_changes(database_name, new_descriptions, metadata, batch_size: int = NEO4J_BATCH_SIZE):
+    """Upsert described tables and rewire changed edges. Returns (edges_removed, edges_added)."""
+    with neo4j_driver.session() as session:
+        upsert_table_nodes(session, database_name, new_descriptions, metadata, batch_size)
+        return sync_relationships(session, database_name, metadata, batch_size)
+
+def _run_now(name, func):
+    return func()
+
+def sync_schema_in_neo4j(database_name, engine, metadata, progress_callback=None, batch_size: int = NEO4J_BATCH_SIZE,
+                         run_stage=_run_now):
+    """
+    Bring the Neo4j graph in line with the reflected schema, touching only what changed.
+
+    Descriptions and embeddings are regenerated only for added or changed tables, dropped
+    tables are deleted, and only RELATES_TO edges that differ are rewired. Wide tables also
+    get column embeddings (see schema_pruning) when they change or don't have any yet. Each step goes
+    through run_stage(name, func), which lets a setup job track and resume the stages.
+
+    Returns (descriptions for every current table, summary of the changes).
+    """
+    plan = run_stage("plan", lambda: plan_schema_sync(metadata, database_name))
+    to_describe = plan["added"] + plan["changed"]
+
+    run_stage("prune", lambda: prune_graph(database_name, metadata, plan, batch_size))
+
+    new_descriptions = run_stage("describe", lambda: generate_table_descriptions(
+        engine, metadata, progress_callback=progress_callback, table_names=to_describe
+    ) if to_describe else {})
+
+    edges_removed, edges_added = run_stage(
+        "graph", lambda: write_graph_changes(database_name, new_descriptions, metadata, batch_size)
+    )
+
+    run_stage("embed", lambda: store_table_embeddings(database_name, new_descriptions, batch_size)
+              if new_descriptions else None)
+
+    run_stage("embed_columns", lambda: store_column_embeddings(database_name, metadata, to_describe, batch_size)
+              if schema_pruning.COLUMN_EMBEDDING_MIN_COLUMNS > 0 else 0)
+
+    descriptions = {
+        table_name: new_descriptions.get(table_name, plan["descriptions"].get(table_name))
+        for table_name in metadata.tables
+    }
+    changes = {
+        "added": plan["added"],
+        "changed": plan["changed"],
+        "dropped": plan["dropped"],
+        "edges_added": edges_added,
+        "edges_removed": edges_removed,
+    }
+    return descriptions, changes
 
 def check_neo4j_setup(metadata, database_name):
-    """Check if tables are already set up in Neo4j and match with current metadata"""
-    current_tables = set(metadata.tables.keys())
-    
-    # Get table info from Neo4j
-    neo4j_tables, all_valid = get_table_info_from_neo4j(database_name)
-    
-    # Check if:
-    # 1. We have valid tables in Neo4j
-    # 2. All current tables exist in Neo4j
-    # 3. Table names match exactly
-    tables_exist = len(neo4j_tables) > 0 and all_valid
-    tables_match = current_tables.issubset(neo4j_tables.keys())
-    
-    # Extract just the descriptions for the response
-    descriptions = {name: info["description"] 
-                   for name, info in neo4j_tables.items()}
-    
-    return tables_exist and tables_match, descriptions
+    """Check if tables are already set up in Neo4j and match the current metadata's fingerprints"""
+    plan = plan_schema_sync(metadata, database_name)
+    matches = not (plan["added"] or plan["changed"] or plan["dropped"])
+    return matches, plan["descriptions"]
+
+def write_table_embeddings(database_name, table_embeddings, batch_size: int = NEO4J_BATCH_SIZE):
+    """Store {table_name: embedding} on the Table nodes in batched write transactions."""
+    rows = [
+        {"name": table_name, "embedding": embedding}
+        for table_name, embedding in table_embeddings.items()
+    ]
+    with neo4j_driver.session() as session:
+        run_in_batches(
+            session,
+            """
+            UNWIND $rows AS row
+            MATCH (t:Table {database: $database, name: row.name})
+            SET t.embedding = row.embedding
+            """,
+            rows,
+            batch_size,
+            database=database_name,
+        )
+
+    # Drop the in-memory index so the next query reloads the fresh embeddings
+    table_indexes.invalidate(database_name)
 
 # Step 2: Store Table Embeddings
-def store_table_embeddings(database_name, table_descriptions):
+def store_table_embeddings(database_name, table_descriptions, batch_size: int = NEO4J_BATCH_SIZE):
+    # Embed all descriptions in as few batched requests as possible
+    table_names = list(table_descriptions.keys())
+    embeddings = embed_texts_in_batches([table_descriptions[name] for name in table_names])
+    table_embeddings = dict(zip(table_names, embeddings))
+    write_table_embeddings(database_name, table_embeddings, batch_size)
+
+DELETE_COLUMNS_QUERY = """
+    UNWIND $rows AS name
+    MATCH (c:Column {database: $database, table: name})
+    DETACH DELETE c
+"""
+
+def delete_column_nodes(session, database_name, table_names, batch_size: int = NEO4J_BATCH_SIZE):
+    run_in_batches(session, DELETE_COLUMNS_QUERY, list(table_names), batch_size, database=database_name)
+    schema_pruning.column_indexes.invalidate(database_name)
+
+def store_column_embeddings(database_name, metadata, changed_tables, batch_size: int = NEO4J_BATCH_SIZE):
+    """
+    Embed every column of the wide tables that changed or have no Column nodes yet, and
+    store them as Column nodes linked to their Table. Returns the number of tables embedded.
+    """
     with neo4j_driver.session() as session:
-        for table_name, description in table_descriptions.items():
-            # Generate embedding for table description
-            embedding = get_openai_embeddings([description])[0]
+        result = session.run("""
+            MATCH (t:Table {database: $database})-[:HAS_COLUMN]->(c:Column)
+            RETURN DISTINCT t.name AS name
+        """, database=database_name)
+        embedded = {record["name"] for record in result}
+        changed = set(changed_tables)
+        table_names = [
+            table_name for table_name, table in metadata.tables.items()
+            if schema_pruning.is_wide(table) and (table_name in changed or table_name not in embedded)
+        ]
+        if not table_names:
+            return 0
 
-            # Store embedding in Neo4j
-            session.run(
-                """
-                MATCH (t:Table {database: $database, name: $table_name})
-                SET t.embedding = $embedding
-                """,
-                database=database_name,
-                table_name=table_name,
-                embedding=embedding,
-            )
+        session.run("CREATE INDEX column_database_table IF NOT EXISTS FOR (c:Column) ON (c.database, c.table)")
+        delete_column_nodes(session, database_name, [name for name in table_names if name in embedded], batch_size)
+        columns = [
+            (table_name, column)
+            for table_name in table_names
+            for column in metadata.tables[table_name].columns
+        ]
+        embeddings = embed_texts_in_batches(
+            [schema_pruning.column_embedding_text(table_name, column) for table_name, column in columns],
+            model=schema_pruning.COLUMN_EMBEDDING_MODEL,
+        )
+        rows = [
+            {"table": table_name, "name": column.name, "embedding": embedding}
+            for (table_name, column), embedding in zip(columns, embeddings)
+        ]
+        run_in_batches(
+            session,
+            """
+            UNWIND $rows AS row
+            MATCH (t:Table {database: $database, name: row.table})
+            MERGE (c:Column {database: $database, table: row.table, name: row.name})
+            SET c.embedding = row.embedding
+            MERGE (t)-[:HAS_COLUMN]->(c)
+            """,
+            rows,
+            batch_size,
+            database=database_name,
+        )
+    schema_pruning.column_indexes.invalidate(database_name)
+    return len(table_names)
 
 # Step 6: Initialize and Run
 if __name__ == "__main__":
@@ -246,18 +596,10 @@ if __name__ == "__main__":
         metadata = MetaData()
         metadata.reflect(bind=engine)
 
-        # Check if Neo4j setup is needed
-        tables_ready, existing_descriptions = check_neo4j_setup(metadata, database_name)
-
-        if not tables_ready:
-            print("Generating new table descriptions...")
-            table_descriptions = generate_table_descriptions(engine, metadata)
-            print("Creating graph in Neo4j...")
-            create_graph_in_neo4j(database_name, table_descriptions, metadata)
-            print("Storing table embeddings...")
-            store_table_embeddings(database_name, table_descriptions)
-        else:
-            print("Tables already set up in Neo4j with valid embeddings")
+        # Sync only the tables whose schema changed since the last run
+        print("Syncing schema with Neo4j...")
+        _, changes = sync_schema_in_neo4j(database_name, engine, metadata)
+        print(f"Added: {len(changes['added'])}, changed: {len(changes['changed'])}, dropped: {len(changes['dropped'])}")
 
     except Exception as e:
         print(f"Error during Neo4j setup: {str(e)}")
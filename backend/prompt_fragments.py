@@ -0,0 +1,107 @@
+"""
+Per-table prompt fragments for SQL generation, built once per schema instead of on every request.
+
+A fragment holds a table's header (its name and the LLM description stored in Neo4j),
+the prompt text of each column and its join hints, so a request assembles the schema
+context by joining strings. Fragments are built at configure time and cached in memory
+per database, keyed by the schema fingerprint, so any schema change misses the cache.
+"""
+from collections import OrderedDict
+import os
+import threading
+import neo4j_setup
+import schema_pruning
+
+# Databases whose fragments stay in memory
+PROMPT_FRAGMENT_CACHE_SIZE = int(os.getenv("PROMPT_FRAGMENT_CACHE_SIZE", "32"))
+
+NO_DESCRIPTION = "No description available."
+
+
+class TableFragment:
+    """Prompt text of one table: header, every column and the join hints to other tables."""
+
+    def __init__(self, table, description=None):
+        self.name = table.name
+        self.description = description or table.comment or NO_DESCRIPTION
+        self.header = f"Table Name: {self.name}\nDescription: {self.description}\n"
+        self.column_names = [column.name for column in table.columns]
+        self.column_texts = {column.name: schema_pruning.column_text(column) for column in table.columns}
+        self.all_columns = f"Columns: {', '.join(self.column_texts.values())}\n\n"
+        # (target table, hint line) for every foreign key, in schema order
+        self.joins = [
+            (fk.column.table.name,
+             f"- {self.name} relates to {fk.column.table.name} via {fk.parent.name} -> {fk.column.name}\n")
+            for fk in table.foreign_keys
+        ]
+
+    def render(self, columns=None):
+        """Header and column list, limited to `columns` (names) when given."""
+        if columns is None or len(columns) == len(self.column_names):
+            return self.header + self.all_columns
+        listed = ", ".join(self.column_texts[name] for name in columns)
+        return (f"{self.header}Columns ({len(columns)} of {len(self.column_names)}, "
+                f"the rest omitted as unrelated): {listed}\n\n")
+
+
+def build_fragments(tables, descriptions=None) -> dict:
+    """{table name: TableFragment} for a MetaData's tables and {table name: description}."""
+    descriptions = descriptions or {}
+    return {name: TableFragment(table, descriptions.get(name)) for name, table in tables.items()}
+
+
+def render_schema(fragments, table_names, columns=None) -> str:
+    """The schema context of the SQL generation prompt for `table_names`, with their join hints."""
+    selected = set(table_names)
+    parts = ["Relevant Database Schema:\n\n"]
+    parts.extend(
+        fragments[name].render(columns[name] if columns is not None else None)
+        for name in table_names
+    )
+    parts.append("Relationships Between Tables:\n")
+    parts.extend(
+        line
+        for name in table_names
+        for target, line in fragments[name].joins
+        if target in selected
+    )
+    return "".join(parts)
+
+
+def _load_descriptions(database_name: str) -> dict:
+    table_info, _ = neo4j_setup.get_table_info_from_neo4j(database_name)
+    return {name: info["description"] for name, info in table_info.items()}
+
+
+class FragmentCache:
+    """LRU map of database name -> (schema fingerprint, fragments)."""
+
+    def __init__(self, max_size: int = PROMPT_FRAGMENT_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, database_name: str, fingerprint: str, fragments: dict):
+        with self._lock:
+            self._entries[database_name] = (fingerprint, fragments)
+            self._entries.move_to_end(database_name)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return fragments
+
+    def get(self, database_name: str, fingerprint: str, metadata):
+        """Fragments for the schema, rebuilt from the Neo4j descriptions when missing or stale."""
+        with self._lock:
+            entry = self._entries.get(database_name)
+            if entry is not None and entry[0] == fingerprint:
+                self._entries.move_to_end(database_name)
+                return entry[1]
+        fragments = build_fragments(metadata.tables, _load_descriptions(database_name))
+        return self.put(database_name, fingerprint, fragments)
+
+    def invalidate(self, database_name: str):
+        with self._lock:
+            self._entries.pop(database_name, None)
+
+
+fragment_cache = FragmentCache()
@@ -0,0 +1,349 @@
+"""
+Data-versioned cache of query results, keyed on the database and the normalized SQL.
+
+The cache is off unless a TTL is set, globally or per database. Only complete results
+(ones that fit in their first page) are cached. An entry is served until the database's
+TTL runs out and, when the database has a probe configured, only while the data version
+of the tables the query reads is unchanged:
+- "row_count": COUNT(*) of each table
+- "last_modified": the warehouse's last-modified metadata (the file's mtime for SQLite,
+  the modification counters of pg_stat_user_tables for PostgreSQL), looked up by schema
+  and table name
+
+Entries are pickled and kept in memory or, with RESULT_CACHE_DIR set, in files on local
+disk; the least recently used are evicted beyond RESULT_CACHE_MAX_BYTES.
+"""
+from collections import OrderedDict
+import hashlib
+import os
+import pickle
+import re
+import tempfile
+import threading
+import time
+from sqlalchemy import text
+from result_pages import ResultPage
+import sql_validation
+
+try:
+    import sqlglot
+    from sqlglot import exp
+except ImportError:  # Without sqlglot SQL is normalized by whitespace only and probes can't see the tables
+    sqlglot = None
+
+# Default seconds a result stays valid and default probe: none, row_count or last_modified.
+# Off (0) unless enabled here or per database, since "none" serves results until they expire
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "0"))
+RESULT_CACHE_PROBE = os.getenv("RESULT_CACHE_PROBE", "none")
+# Total size of the pickled entries, the largest single entry, and where to keep them (memory when unset)
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(256 * 2**20)))
+RESULT_CACHE_MAX_ENTRY_BYTES = int(os.getenv("RESULT_CACHE_MAX_ENTRY_BYTES", str(16 * 2**20)))
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR") or None
+
+PROBE_NAMES = ("none", "row_count", "last_modified")
+
+
+def default_policy():
+    return {"ttl": RESULT_CACHE_TTL, "probe": RESULT_CACHE_PROBE}
+
+
+def normalize_sql(sql_query: str, dialect=None) -> str:
+    """Canonical text of a query, so formatting and comments don't split the cache."""
+    if sqlglot is not None:
+        try:
+            return sqlglot.parse_one(sql_query, dialect=dialect).sql(dialect=dialect)
+        except Exception:
+            pass
+    return " ".join(sql_query.split()).rstrip(";").strip()
+
+
+def referenced_tables(sql_query: str, dialect=None):
+    """Sorted names of the tables a query reads (qualified as db.table when it says so), or None if unknown."""
+    if sqlglot is None:
+        return None
+    try:
+        expression = sqlglot.parse_one(sql_query, dialect=dialect)
+    except Exception:
+        return None
+    ctes = {cte.alias_or_name for cte in expression.find_all(exp.CTE)}
+    return sorted({
+        f"{table.db}.{table.name}" if table.db else table.name
+        for table in expression.find_all(exp.Table)
+        if table.name not in ctes
+    })
+
+
+def _quote_table(connection, table_name):
+    preparer = connection.dialect.identifier_preparer
+    return ".".join(preparer.quote(part) for part in table_name.split("."))
+
+
+def _probe_row_count(engine, tables):
+    with engine.connect() as connection:
+        return [
+            connection.execute(text(f"SELECT COUNT(*) FROM {_quote_table(connection, table)}")).scalar()
+            for table in tables
+        ]
+
+
+def _modified_sqlite(engine, tables):
+    path = engine.url.database
+    if not path or path == ":memory:":
+        return None
+    # Writes in WAL mode land in the -wal file first
+    return [os.path.getmtime(name) for name in (path, path + "-wal") if os.path.exists(name)]
+
+
+def _schema_and_name(table_name):
+    """("schema", "table") for a qualified name, (None, "table") for a bare one."""
+    schema, _, name = table_name.rpartition(".")
+    return schema or None, name
+
+
+def _modified_postgres(engine, tables):
+    # Bare names resolve in the current schema, so same-named tables elsewhere don't collide
+    query = text("""
+        SELECT n_tup_ins + n_tup_upd + n_tup_del
+        FROM pg_stat_user_tables
+        WHERE schemaname = COALESCE(:schema, current_schema()) AND relname = :name
+    """)
+    versions = []
+    with engine.connect() as connection:
+        for table in tables:
+            schema, name = _schema_and_name(table)
+            versions.append(connection.execute(query, {"schema": schema, "name": name}).scalar())
+    return versions
+
+
+def _modified_snowflake(engine, tables):
+    query = text("""
+        SELECT last_altered
+        FROM information_schema.tables
+        WHERE table_schema = COALESCE(:schema, CURRENT_SCHEMA()) AND table_name = :name
+    """)
+    versions = []
+    with engine.connect() as connection:
+        for table in tables:
+            schema, name = _schema_and_name(table)
+            # Unquoted identifiers are stored upper-case
+            value = connection.execute(query, {"schema": schema and schema.upper(), "name": name.upper()}).scalar()
+            versions.append(None if value is None else str(value))
+    return versions
+
+
+def _modified_bigquery(engine, tables):
+    versions = []
+    with engine.connect() as connection:
+        for table in tables:
+            if "." not in table:
+                return None
+            dataset, name = table.rsplit(".", 1)
+            if not re.fullmatch(r"[\w.-]+", dataset):
+                return None
+            versions.append(connection.execute(
+                text(f"SELECT last_modified_time FROM `{dataset}.__TABLES__` WHERE table_id = :name"), {"name": name}
+            ).scalar())
+    return versions
+
+
+# SQLAlchemy dialect name -> last-modified probe
+LAST_MODIFIED_PROBES = {
+    "sqlite": _modified_sqlite,
+    "postgresql": _modified_postgres,
+    "snowflake": _modified_snowflake,
+    "bigquery": _modified_bigquery,
+}
+
+
+def data_version(engine, sql_query, probe: str, dialect=None):
+    """
+    The probe's view of the data a query reads, compared between store and lookup.
+
+    Returns () with no probe, and None when the version can't be determined, in which
+    case the result isn't cached.
+    """
+    if probe in (None, "none"):
+        return ()
+    tables = referenced_tables(sql_query, dialect)
+    if not tables:
+        return None
+    if probe == "row_count":
+        func = _probe_row_count
+    elif probe == "last_modified":
+        func = LAST_MODIFIED_PROBES.get(engine.dialect.name)
+    else:
+        func = None
+    if func is None:
+        return None
+    try:
+        version = func(engine, tables)
+    except Exception as e:
+        print(f"Warning: {probe} probe failed, not caching: {e}")
+        return None
+    return None if version is None else tuple(version)
+
+
+class ResultCache:
+    """
+    Size-bounded LRU of pickled query results, in memory or in `directory`.
+
+    The index (key -> database, size) always lives in memory; with a directory it is
+    rebuilt from the files on startup, oldest first.
+    """
+
+    def __init__(self, max_bytes: int = RESULT_CACHE_MAX_BYTES, max_entry_bytes: int = RESULT_CACHE_MAX_ENTRY_BYTES,
+                 directory: str = RESULT_CACHE_DIR):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.directory = directory
+        self._index = OrderedDict()
+        self._values = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "expired": 0, "stale": 0, "evictions": 0}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            files = [name for name in os.listdir(directory) if name.endswith(".pkl")]
+            for name in sorted(files, key=lambda name: os.path.getmtime(os.path.join(directory, name))):
+                database_name, key = name[:-len(".pkl")].rsplit("_", 1)
+                size = os.path.getsize(os.path.join(directory, name))
+                self._index[key] = (database_name, size)
+                self._size += size
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key(database_name: str, sql_query: str, dialect=None) -> str:
+        return hashlib.sha256(f"{database_name}\0{normalize_sql(sql_query, dialect)}".encode()).hexdigest()
+
+    def _path(self, database_name, key):
+        return os.path.join(self.directory, f"{database_name}_{key}.pkl")
+
+    def _read(self, key):
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                return None
+            self._index.move_to_end(key)
+            if not self.directory:
+                return self._values[key]
+        try:
+            with open(self._path(entry[0], key), "rb") as f:
+                return f.read()
+        except OSError:
+            self._delete(key)
+            return None
+
+    def _write(self, database_name, key, data):
+        if self.directory:
+            # Write then rename, so a concurrent reader never sees a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(database_name, key))
+        evicted = []
+        with self._lock:
+            previous = self._index.pop(key, None)
+            if previous is not None:
+                self._size -= previous[1]
+            self._index[key] = (database_name, len(data))
+            self._size += len(data)
+            if not self.directory:
+                self._values[key] = data
+            while self._size > self.max_bytes and len(self._index) > 1:
+                old_key, (old_database, size) = self._index.popitem(last=False)
+                self._size -= size
+                self._values.pop(old_key, None)
+                self._stats["evictions"] += 1
+                evicted.append((old_database, old_key))
+        for old_database, old_key in evicted:
+            self._remove_file(old_database, old_key)
+
+    def _delete(self, key):
+        with self._lock:
+            entry = self._index.pop(key, None)
+            if entry is None:
+                return
+            self._size -= entry[1]
+            self._values.pop(key, None)
+        self._remove_file(entry[0], key)
+
+    def _remove_file(self, database_name, key):
+        if self.directory:
+            try:
+                os.remove(self._path(database_name, key))
+            except OSError:
+                pass
+
+    def lookup(self, engine, database_name: str, sql_query: str, policy=None):
+        """
+        Return (cached ResultPage or None, data version).
+
+        The version is computed once per call and should be passed to `store` on a miss,
+        so a result is tagged with the version read before it was executed.
+        """
+        policy = policy or default_policy()
+        if not self.enabled or policy["ttl"] <= 0:
+            return None, None
+        dialect = sql_validation.dialect_for_engine(engine)
+        version = data_version(engine, sql_query, policy["probe"], dialect)
+        key = self.key(database_name, sql_query, dialect)
+        data = self._read(key)
+        if data is None:
+            with self._lock:
+                self._stats["misses"] += 1
+            return None, version
+        entry = pickle.loads(data)
+        if time.time() - entry["stored_at"] > policy["ttl"]:
+            reason = "expired"
+        elif version is None or entry["version"] != version:
+            reason = "stale"
+        else:
+            with self._lock:
+                self._stats["hits"] += 1
+            page = ResultPage(entry["columns"], entry["rows"], 0, row_count=entry["row_count"], truncated=entry["truncated"])
+            page.cached_at = entry["stored_at"]
+            return page, version
+        self._delete(key)
+        with self._lock:
+            self._stats[reason] += 1
+            self._stats["misses"] += 1
+        return None, version
+
+    def store(self, engine, database_name: str, sql_query: str, page, version, policy=None):
+        """Cache a complete result under the version `lookup` returned; partial or oversized ones are skipped."""
+        policy = policy or default_policy()
+        if not self.enabled or policy["ttl"] <= 0 or version is None or page.cursor is not None:
+            return False
+        data = pickle.dumps({
+            "columns": page.columns,
+            "rows": page.rows,
+            "row_count": page.row_count,
+            "truncated": page.truncated,
+            "stored_at": time.time(),
+            "version": version,
+        }, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > min(self.max_entry_bytes, self.max_bytes):
+            return False
+        self._write(database_name, self.key(database_name, sql_query, sql_validation.dialect_for_engine(engine)), data)
+        with self._lock:
+            self._stats["stores"] += 1
+        return True
+
+    def invalidate(self, database_name: str):
+        with self._lock:
+            keys = [key for key, (database, _) in self._index.items() if database == database_name]
+        for key in keys:
+            self._delete(key)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._index), bytes=self._size)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+result_cache = ResultCache()
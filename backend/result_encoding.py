@@ -0,0 +1,108 @@
+"""
+Opt-in compact encodings for query results.
+
+"columnar" returns column-major arrays plus a type per column, serialized with orjson
+when it is installed. "arrow" returns an Arrow IPC stream with the response fields in
+the schema metadata.
+"""
+import datetime
+import decimal
+import json
+import uuid
+
+try:
+    import orjson
+except ImportError:  # Fall back to the standard library encoder
+    orjson = None
+
+try:
+    import pyarrow as pa
+except ImportError:  # Arrow responses are optional
+    pa = None
+
+RESULT_FORMATS = ("rows", "columnar", "arrow")
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+# Checked in order, so bool comes before int and datetime before date
+_COLUMN_TYPES = (
+    (bool, "boolean"),
+    (int, "integer"),
+    (float, "float"),
+    (decimal.Decimal, "decimal"),
+    (datetime.datetime, "datetime"),
+    (datetime.date, "date"),
+    (datetime.time, "time"),
+    ((bytes, bytearray, memoryview), "bytes"),
+    (str, "string"),
+)
+
+
+def infer_column_type(values) -> str:
+    """Name the type of a column from its first non-null value."""
+    for value in values:
+        if value is None:
+            continue
+        for python_type, name in _COLUMN_TYPES:
+            if isinstance(value, python_type):
+                return name
+        return "string"
+    return "null"
+
+
+def _default(value):
+    # Decimals keep their precision as strings; the column type tells the client to parse them
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value)
+
+
+def to_columnar(formatted_results: dict) -> dict:
+    """Turn a row-major result dict into column-major arrays with per-column types."""
+    columns = formatted_results.get("columns", [])
+    rows = formatted_results.get("rows", [])
+    data = [list(values) for values in zip(*rows)] if rows else [[] for _ in columns]
+    columnar = {key: value for key, value in formatted_results.items() if key != "rows"}
+    columnar["format"] = "columnar"
+    columnar["column_types"] = [infer_column_type(values) for values in data]
+    columnar["data"] = data
+    return columnar
+
+
+def dumps(payload) -> bytes:
+    """Serialize a response payload to JSON bytes, using orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(payload, default=_default, separators=(",", ":")).encode()
+
+
+def _arrow_array(values, column_type):
+    if column_type == "decimal":
+        # Mixed-scale decimals don't share one Arrow decimal type; keep them exact as strings
+        return pa.array([None if value is None else str(value) for value in values], type=pa.string())
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array([None if value is None else str(value) for value in values], type=pa.string())
+
+
+def encode_arrow(formatted_results: dict) -> bytes:
+    """Encode the rows as an Arrow IPC stream; the other response fields go in the schema metadata."""
+    if pa is None:
+        raise RuntimeError("Arrow responses require pyarrow")
+    columnar = to_columnar(formatted_results)
+    arrays = [
+        _arrow_array(values, column_type)
+        for values, column_type in zip(columnar.pop("data"), columnar["column_types"])
+    ]
+    table = pa.Table.from_arrays(arrays, names=[str(column) for column in columnar["columns"]])
+    metadata = {key: dumps(value) for key, value in columnar.items()}
+    table = table.replace_schema_metadata(metadata)
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
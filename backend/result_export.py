@@ -0,0 +1,236 @@
+from collections import OrderedDict
+import csv
+import datetime
+import io
+import json
+import os
+import pickle
+import secrets
+import tempfile
+import threading
+import time
+from sqlalchemy import text
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = None
+    pq = None
+
+# Rows fetched from the database per chunk, and how many validated queries stay exportable
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "10000"))
+EXPORT_HISTORY_SIZE = int(os.getenv("EXPORT_HISTORY_SIZE", "200"))
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+class ValidatedQueryStore:
+    """
+    Remembers the SQL that a run-query call validated, under an opaque export id.
+
+    Exports only re-run SQL the pipeline produced itself; clients never send SQL.
+    """
+
+    def __init__(self, max_size: int = EXPORT_HISTORY_SIZE):
+        self.max_size = max(1, max_size)
+        self._queries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, database_name: str, connection_string: str, sql_query: str, question: str = None) -> str:
+        export_id = secrets.token_urlsafe(16)
+        with self._lock:
+            self._queries[export_id] = {
+                "database_name": database_name,
+                "connection_string": connection_string,
+                "sql": sql_query,
+                "question": question,
+                "created_at": time.time(),
+            }
+            while len(self._queries) > self.max_size:
+                self._queries.popitem(last=False)
+        return export_id
+
+    def get(self, export_id: str):
+        with self._lock:
+            return self._queries.get(export_id)
+
+
+validated_queries = ValidatedQueryStore()
+
+
+def stream_row_chunks(engine, sql_query, chunk_size: int = EXPORT_CHUNK_SIZE):
+    """Yield (columns, rows) chunks from a server-side cursor so memory stays constant."""
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True, max_row_buffer=chunk_size).execute(text(sql_query))
+        columns = list(result.keys())
+        empty = True
+        for partition in result.partitions(chunk_size):
+            empty = False
+            yield columns, partition
+        if empty:
+            # Still produce a header (CSV) or a schema (Parquet) for an empty result
+            yield columns, []
+
+
+def _json_default(value):
+    # Decimal, datetime, UUID and friends go out as their string form
+    return str(value)
+
+
+def unique_names(columns):
+    """Column names with repeats suffixed (id, id_2), for formats that key values by name."""
+    seen = {}
+    names = []
+    for column in columns:
+        seen[column] = seen.get(column, 0) + 1
+        names.append(column if seen[column] == 1 else f"{column}_{seen[column]}")
+    return names
+
+
+def csv_preamble(query: dict) -> str:
+    """The metadata lines the chat's own CSV download starts with: question, time and SQL."""
+    generated_at = datetime.datetime.fromtimestamp(query["created_at"], datetime.timezone.utc).isoformat()
+    return f"User Query: {query.get('question') or ''}\nGenerated at: {generated_at}\nSQL Query: {query['sql']}\n\n"
+
+
+def encode_csv(chunks, preamble: str = None):
+    buffer = io.StringIO()
+    if preamble:
+        buffer.write(preamble)
+    writer = csv.writer(buffer)
+    header_written = False
+    for columns, rows in chunks:
+        if not header_written:
+            writer.writerow(columns)
+            header_written = True
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def encode_ndjson(chunks):
+    for columns, rows in chunks:
+        names = unique_names(columns)
+        yield "".join(
+            json.dumps(dict(zip(names, row)), default=_json_default) + "\n" for row in rows
+        ).encode()
+
+
+class _ChunkSink:
+    """Write-only file object that hands written bytes back in pieces while tracking the offset."""
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.parts.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+
+def _unify_types(types):
+    """One Arrow type for a column whose chunks inferred `types`; string when they don't agree."""
+    types = {t for t in types if not pa.types.is_null(t)}
+    if len(types) == 1:
+        return types.pop()
+    if types and all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in types):
+        return pa.float64()
+    if types and all(pa.types.is_decimal(t) for t in types):
+        scale = max(t.scale for t in types)
+        integer_digits = max(t.precision - t.scale for t in types)
+        if integer_digits + scale <= 38:
+            return pa.decimal128(integer_digits + scale, scale)
+    # All NULL, or mixed types as SQLite allows: keep every value as text
+    return pa.string()
+
+
+def _column_array(values, arrow_type):
+    if pa.types.is_string(arrow_type):
+        values = [None if value is None else value if isinstance(value, str) else str(value) for value in values]
+    return pa.array(values, type=arrow_type)
+
+
+def encode_parquet(chunks):
+    """
+    Encode the result as Parquet, one row group per chunk.
+
+    A Parquet file has a single schema, and a column's values can change type between rows
+    (SQLite has no column types at all), so the chunks are first spooled to a temporary file
+    while each column's type is inferred from every row; the file is written once the
+    schema is known. Memory stays at one chunk, at the cost of the time to the first byte.
+    """
+    if pa is None:
+        raise RuntimeError("Parquet export requires pyarrow")
+    with tempfile.TemporaryFile() as spool:
+        columns = None
+        column_types = None
+        chunk_count = 0
+        for chunk_columns, rows in chunks:
+            if columns is None:
+                columns = chunk_columns
+                column_types = [set() for _ in columns]
+            for i, types in enumerate(column_types):
+                values = [row[i] for row in rows]
+                try:
+                    types.add(pa.array(values).type)
+                except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, OverflowError):
+                    types.add(pa.string())
+            pickle.dump([tuple(row) for row in rows], spool, protocol=pickle.HIGHEST_PROTOCOL)
+            chunk_count += 1
+        if columns is None:
+            return
+
+        schema = pa.schema([
+            pa.field(name, _unify_types(types)) for name, types in zip(unique_names(columns), column_types)
+        ])
+        spool.seek(0)
+        sink = _ChunkSink()
+        writer = pq.ParquetWriter(sink, schema)
+        for _ in range(chunk_count):
+            rows = pickle.load(spool)
+            arrays = [
+                _column_array([row[i] for row in rows], field.type)
+                for i, field in enumerate(schema)
+            ]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            yield sink.drain()
+        writer.close()
+        yield sink.drain()
+
+
+ENCODERS = {
+    "csv": encode_csv,
+    "ndjson": encode_ndjson,
+    "parquet": encode_parquet,
+}
+
+
+def export_query(engine, sql_query, export_format: str, chunk_size: int = EXPORT_CHUNK_SIZE, preamble: str = None):
+    """Return a generator of encoded byte chunks for the full result of `sql_query`; `preamble` starts a CSV."""
+    chunks = stream_row_chunks(engine, sql_query, chunk_size)
+    if export_format == "csv":
+        return encode_csv(chunks, preamble)
+    return ENCODERS[export_format](chunks)
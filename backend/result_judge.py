@@ -0,0 +1,139 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import os
+import random
+import re
+import threading
+import time
+import traceback
+import uuid
+
+# When to ask the LLM whether a result answers the question: "off", "sampled" or "always"
+JUDGE_POLICY = os.getenv("JUDGE_POLICY", "always").lower()
+JUDGE_SAMPLE_RATE = float(os.getenv("JUDGE_SAMPLE_RATE", "0.1"))
+
+# Judge in the background and return the answer right away; a "no" then starts a follow-up correction
+JUDGE_ASYNC = os.getenv("JUDGE_ASYNC", "false").lower() == "true"
+
+# Size of the result preview shown to the judge
+JUDGE_PREVIEW_ROWS = int(os.getenv("JUDGE_PREVIEW_ROWS", "5"))
+JUDGE_PREVIEW_VALUE_CHARS = int(os.getenv("JUDGE_PREVIEW_VALUE_CHARS", "40"))
+
+# Background reviews running at once, and how many finished reviews stay queryable
+JUDGE_WORKERS = int(os.getenv("JUDGE_WORKERS", "4"))
+JUDGE_HISTORY_SIZE = int(os.getenv("JUDGE_HISTORY_SIZE", "200"))
+
+REJECTION_MESSAGE = "User indicated that the query did not return the correct result."
+
+_VERDICT_NO = re.compile(r"^\W*no\b")
+
+
+def should_judge(policy: str = None, sample_rate: float = None) -> bool:
+    policy = policy or JUDGE_POLICY
+    if policy == "off":
+        return False
+    if policy == "sampled":
+        return random.random() < (JUDGE_SAMPLE_RATE if sample_rate is None else sample_rate)
+    return True
+
+
+def _clip(value, max_chars):
+    text = str(value)
+    return text if len(text) <= max_chars else text[:max_chars - 1] + "…"
+
+
+def result_preview(page, max_rows: int = JUDGE_PREVIEW_ROWS, max_value_chars: int = JUDGE_PREVIEW_VALUE_CHARS) -> str:
+    """Column names plus the first `max_rows` rows, each value clipped; the rest of the page isn't touched."""
+    lines = [" | ".join(str(column) for column in page.columns)]
+    for row in itertools.islice(page.rows, max_rows):
+        lines.append(" | ".join(_clip(value, max_value_chars) for value in row))
+    if page.row_count is not None:
+        lines.append(f"({page.row_count} rows in total)")
+    else:
+        lines.append(f"(at least {len(page.rows)} rows)")
+    return "\n".join(lines)
+
+
+def judge_message(page) -> dict:
+    return {
+        "role": "user",
+        "content": f"SQL query execution result:\n{result_preview(page)}\nDoes the result accurately answer my question? Reply with 'yes' or 'no'.",
+    }
+
+
+def accepts(verdict: str) -> bool:
+    """A verdict rejects the result only if it starts with "no"."""
+    return not _VERDICT_NO.match(verdict.strip().lower())
+
+
+class JudgeReview:
+    """A judge call running after its answer was returned, plus the follow-up correction if it said no."""
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = "pending"  # pending -> accepted | corrected | failed
+        self.verdict = None
+        self.sql = None
+        self.result = None
+        self.table_name = None  # Title and related questions of a corrected answer
+        self.related_questions = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.future = None
+
+    def to_dict(self):
+        return {
+            "review_id": self.id,
+            "status": self.status,
+            "verdict": self.verdict,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JudgeReviewRegistry:
+    """Runs background judge reviews on a bounded pool and keeps the most recent ones queryable."""
+
+    def __init__(self, max_workers: int = JUDGE_WORKERS, history_size: int = JUDGE_HISTORY_SIZE):
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="judge")
+        self.history_size = max(1, history_size)
+        self._reviews = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, target, *args):
+        """
+        Start `target(review, *args)` and return the review.
+
+        The target returns (status, verdict, sql, result); the future resolves to the review.
+        """
+        review = JudgeReview()
+        with self._lock:
+            self._reviews[review.id] = review
+            while len(self._reviews) > self.history_size:
+                self._reviews.popitem(last=False)
+        review.future = self.executor.submit(self._run, review, target, args)
+        return review
+
+    def _run(self, review, target, args):
+        try:
+            review.status, review.verdict, review.sql, review.result = target(review, *args)
+        except Exception as e:
+            traceback.print_exc()
+            review.error = str(e)
+            review.status = "failed"
+        finally:
+            review.finished_at = time.time()
+        return review
+
+    def get(self, review_id: str):
+        with self._lock:
+            return self._reviews.get(review_id)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+judge_reviews = JudgeReviewRegistry()
@@ -0,0 +1,213 @@
+from collections import OrderedDict
+import os
+import secrets
+import threading
+import time
+from sqlalchemy import text
+from sqlalchemy.pool import QueuePool
+
+# Rows per page, total rows served for one query, and how long an idle cursor stays open
+RESULT_PAGE_SIZE = int(os.getenv("RESULT_PAGE_SIZE", "500"))
+RESULT_MAX_ROWS = int(os.getenv("RESULT_MAX_ROWS", "100000"))
+RESULT_CURSOR_TTL = float(os.getenv("RESULT_CURSOR_TTL", "300"))
+RESULT_MAX_OPEN_CURSORS = int(os.getenv("RESULT_MAX_OPEN_CURSORS", "32"))
+# Share of an engine's pool (pool_size + max_overflow) that open cursors may hold, so queries still get connections
+RESULT_CURSOR_POOL_SHARE = float(os.getenv("RESULT_CURSOR_POOL_SHARE", "0.5"))
+
+
+class ResultPage:
+    """One page of a query result plus what the client needs to fetch the next one."""
+
+    def __init__(self, columns, rows, offset, cursor=None, row_count=None, truncated=False):
+        self.columns = columns
+        self.rows = rows
+        self.offset = offset
+        self.cursor = cursor
+        self.row_count = row_count
+        self.truncated = truncated
+        self.review_id = None  # Set when the judge reviews this result in the background
+        self.judged = False  # Set when the judge accepted this result before it was returned
+        self.cached_at = None  # Set to the time it was stored when served from the result cache
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __bool__(self):
+        return bool(self.rows) or bool(self.columns)
+
+    def __str__(self):
+        return str(self.rows)
+
+
+def _pool_capacity(engine):
+    """Connections the engine's pool hands out at most, or None if it isn't bounded."""
+    pool = engine.pool
+    if not isinstance(pool, QueuePool) or pool._max_overflow < 0:
+        return None
+    return pool.size() + pool._max_overflow
+
+
+class _OpenCursor:
+    def __init__(self, engine, connection, result, columns, max_rows):
+        self.engine = engine
+        self.connection = connection
+        self.result = result
+        self.columns = columns
+        self.max_rows = max_rows
+        self.fetched = 0
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+
+    def close(self):
+        try:
+            self.result.close()
+        finally:
+            self.connection.close()
+
+
+class ResultCursorRegistry:
+    """
+    Keeps streaming result cursors open between page requests.
+
+    Each cursor holds its own pooled connection, so cursors are closed as soon as
+    the result is exhausted, after RESULT_CURSOR_TTL seconds idle, or when more than
+    RESULT_MAX_OPEN_CURSORS are open (oldest first). Per engine they never hold more
+    than RESULT_CURSOR_POOL_SHARE of its pool: `reserve` evicts the oldest ones before
+    a query takes its connection, and with no share left the first page is all a
+    result gets.
+    """
+
+    def __init__(self, ttl: float = RESULT_CURSOR_TTL, max_open: int = RESULT_MAX_OPEN_CURSORS,
+                 pool_share: float = RESULT_CURSOR_POOL_SHARE):
+        self.ttl = ttl
+        self.max_open = max(1, max_open)
+        self.pool_share = pool_share
+        self._cursors = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _read_page(self, cursor, token, page_size):
+        limit = min(page_size, cursor.max_rows - cursor.fetched)
+        rows = [list(row) for row in cursor.result.fetchmany(limit)] if limit > 0 else []
+        offset = cursor.fetched
+        cursor.fetched += len(rows)
+        cursor.last_used = time.monotonic()
+
+        exhausted = len(rows) < limit
+        truncated = not exhausted and cursor.fetched >= cursor.max_rows
+        if exhausted or truncated:
+            self._discard(token, cursor)
+            token = None
+        # The total is only known for free once the stream has been read to the end
+        row_count = cursor.fetched if exhausted else None
+        return ResultPage(cursor.columns, rows, offset, token, row_count, truncated)
+
+    def engine_limit(self, engine) -> int:
+        """How many cursors may stay open on `engine`."""
+        capacity = _pool_capacity(engine)
+        if capacity is None:
+            return self.max_open
+        return min(self.max_open, int(capacity * self.pool_share))
+
+    def _evict(self, engine, room: int, keep=None):
+        """Close the oldest cursors but `keep` until `room` more fit, overall and on `engine`."""
+        limit = self.engine_limit(engine)
+        evicted = []
+        with self._lock:
+            on_engine = [token for token, cursor in self._cursors.items() if cursor.engine is engine]
+            excess = len(on_engine) + room - limit
+            for token in [token for token in on_engine if token != keep][:max(0, excess)]:
+                evicted.append(self._cursors.pop(token))
+            while self._cursors and len(self._cursors) + room > self.max_open:
+                evicted.append(self._cursors.popitem(last=False)[1])
+        for cursor in evicted:
+            with cursor.lock:
+                cursor.close()
+
+    def reserve(self, engine):
+        """Make room for one more cursor on `engine`; call before taking a connection for the query."""
+        self.close_expired()
+        self._evict(engine, 1)
+
+    def open(self, engine, connection, result, page_size: int = RESULT_PAGE_SIZE, max_rows: int = RESULT_MAX_ROWS):
+        """
+        Take ownership of a connection and its streaming result and return the first page.
+
+        The connection is closed when the result is exhausted; otherwise the page
+        carries a cursor token for fetch_page.
+        """
+        if self.engine_limit(engine) <= 0:
+            # No connection to spare for a cursor: serve what fits in the first page and mark it truncated
+            max_rows = min(max_rows, page_size)
+        columns = list(result.keys())
+        cursor = _OpenCursor(engine, connection, result, columns, max_rows)
+        token = secrets.token_urlsafe(16)
+        with self._lock:
+            self._cursors[token] = cursor
+        # Concurrent queries may have reserved the same room; the newest cursor always stays
+        self._evict(engine, 0, keep=token)
+        with cursor.lock:
+            return self._read_page(cursor, token, page_size)
+
+    def fetch_page(self, token: str, page_size: int = RESULT_PAGE_SIZE):
+        """Return the next page for a cursor token, or None if it expired or doesn't exist."""
+        with self._lock:
+            cursor = self._cursors.get(token)
+            if cursor is not None:
+                self._cursors.move_to_end(token)
+        if cursor is None:
+            return None
+        with cursor.lock:
+            if token not in self._cursors:
+                return None
+            return self._read_page(cursor, token, page_size)
+
+    def _discard(self, token, cursor):
+        with self._lock:
+            self._cursors.pop(token, None)
+        cursor.close()
+
+    def close_expired(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [token for token, cursor in self._cursors.items() if now - cursor.last_used > self.ttl]
+            cursors = [self._cursors.pop(token) for token in expired]
+        for cursor in cursors:
+            with cursor.lock:
+                cursor.close()
+
+    def close(self, token: str):
+        """Close a cursor early, e.g. when its result was rejected."""
+        with self._lock:
+            cursor = self._cursors.pop(token, None)
+        if cursor is not None:
+            with cursor.lock:
+                cursor.close()
+
+    def close_all(self):
+        with self._lock:
+            cursors = list(self._cursors.values())
+            self._cursors.clear()
+        for cursor in cursors:
+            cursor.close()
+
+
+result_cursors = ResultCursorRegistry()
+
+
+def execute_paged(engine, sql_query, page_size: int = RESULT_PAGE_SIZE, max_rows: int = RESULT_MAX_ROWS):
+    """Execute a query with a server-side streaming cursor and return its first ResultPage."""
+    result_cursors.reserve(engine)
+    connection = engine.connect()
+    try:
+        result = connection.execution_options(stream_results=True).execute(text(sql_query))
+        if not result.returns_rows:
+            result.close()
+            connection.close()
+            return ResultPage([], [], 0, row_count=0)
+        return result_cursors.open(engine, connection, result, page_size, max_rows)
+    except Exception:
+        connection.close()
+        raise
@@ -0,0 +1,30 @@
+import hashlib
+import json
+import weakref
+
+_schema_fingerprints = weakref.WeakKeyDictionary()
+
+
+def table_fingerprint(table) -> str:
+    """Hash of a table's columns, types, primary key and foreign keys, used to detect schema changes."""
+    spec = {
+        "columns": [[col.name, str(col.type), bool(col.nullable)] for col in table.columns],
+        "primary_key": sorted(col.name for col in table.primary_key),
+        "foreign_keys": sorted(
+            [fk.parent.name, fk.column.table.name, fk.column.name] for fk in table.foreign_keys
+        ),
+    }
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+
+
+def schema_fingerprint(metadata) -> str:
+    """Hash of every table fingerprint in a reflected MetaData, computed once per MetaData object."""
+    fingerprint = _schema_fingerprints.get(metadata)
+    if fingerprint is None:
+        digest = hashlib.sha256()
+        for table_name in sorted(metadata.tables):
+            digest.update(table_name.encode())
+            digest.update(table_fingerprint(metadata.tables[table_name]).encode())
+        fingerprint = digest.hexdigest()
+        _schema_fingerprints[metadata] = fingerprint
+    return fingerprint
@@ -0,0 +1,203 @@
+"""
+Column-level retrieval that keeps the schema part of the SQL generation prompt within a
+token budget on very wide schemas.
+
+At configure time every table with at least COLUMN_EMBEDDING_MIN_COLUMNS columns gets one
+embedding per column, stored as Column nodes linked to its Table node (see neo4j_setup).
+At query time `select_columns` keeps, for each expanded table, its key and join columns
+plus the columns closest to the question, and drops the furthest expanded tables if even
+that doesn't fit. Narrow tables are always shown in full.
+"""
+import os
+import numpy as np
+import clients
+from vector_index import IndexRegistry
+
+# Approximate token budget for the schema context of the SQL generation prompt; 0 shows every column
+SCHEMA_PROMPT_TOKEN_BUDGET = int(os.getenv("SCHEMA_PROMPT_TOKEN_BUDGET", "4000"))
+# Columns each wide table gets beyond its keys before the rest of the budget is shared across tables
+SCHEMA_PRUNE_MIN_COLUMNS = int(os.getenv("SCHEMA_PRUNE_MIN_COLUMNS", "5"))
+# Tables this wide get column embeddings; must match the model the question is embedded with
+COLUMN_EMBEDDING_MIN_COLUMNS = int(os.getenv("COLUMN_EMBEDDING_MIN_COLUMNS", "30"))
+COLUMN_EMBEDDING_MODEL = os.getenv("COLUMN_EMBEDDING_MODEL", "text-embedding-3-small")
+
+# Rough cost of the fixed text around each table and relationship line in the prompt
+TABLE_OVERHEAD_TOKENS = 12
+RELATIONSHIP_TOKENS = 16
+
+neo4j_driver = clients.neo4j_driver
+
+
+def estimate_tokens(text: str) -> int:
+    """Same four-characters-per-token estimate as the embedding batcher."""
+    return max(1, len(text) // 4)
+
+
+def column_text(column) -> str:
+    """How a column is listed in the prompt."""
+    return f"{column.name} ({column.type})"
+
+
+def column_embedding_text(table_name: str, column) -> str:
+    """The text embedded for a column: its name, type, table and any foreign key target."""
+    text = f"Column {column.name} ({column.type}) of table {table_name}"
+    targets = [f"{fk.column.table.name}.{fk.column.name}" for fk in column.foreign_keys]
+    if targets:
+        text += f", references {', '.join(targets)}"
+    return text
+
+
+def is_wide(table) -> bool:
+    return COLUMN_EMBEDDING_MIN_COLUMNS > 0 and len(table.columns) >= COLUMN_EMBEDDING_MIN_COLUMNS
+
+
+class ColumnIndex:
+    """Normalized column embeddings of one database, grouped per table. Immutable once built."""
+
+    def __init__(self, rows):
+        grouped = {}
+        for table_name, column_name, embedding in rows:
+            grouped.setdefault(table_name, ([], []))
+            grouped[table_name][0].append(column_name)
+            grouped[table_name][1].append(embedding)
+        self.tables = {}
+        for table_name, (names, embeddings) in grouped.items():
+            matrix = np.asarray(embeddings, dtype=np.float32)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            matrix = matrix / norms
+            matrix.setflags(write=False)
+            self.tables[table_name] = (names, matrix)
+
+    def __len__(self):
+        return len(self.tables)
+
+    def scores(self, table_name: str, query_embedding):
+        """{column name: cosine similarity to the question}, or None if the table has no column embeddings."""
+        entry = self.tables.get(table_name)
+        if entry is None:
+            return None
+        names, matrix = entry
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0 or query.shape[0] != matrix.shape[1]:
+            return None
+        return dict(zip(names, (matrix @ (query / norm)).tolist()))
+
+
+def load_column_index(database_name: str) -> ColumnIndex:
+    """Load every column embedding of a database from Neo4j."""
+    with neo4j_driver.session() as session:
+        result = session.run(
+            """
+            MATCH (c:Column)
+            WHERE c.database = $database AND c.embedding IS NOT NULL
+            RETURN c.table AS table_name, c.name AS column_name, c.embedding AS embedding
+            """,
+            database=database_name,
+        )
+        rows = [(record["table_name"], record["column_name"], record["embedding"]) for record in result]
+    return ColumnIndex(rows)
+
+
+# Column embeddings, one index per database
+column_indexes = IndexRegistry()
+
+
+def _key_columns(metadata, table_name: str, kept: set) -> set:
+    """Primary key columns plus the columns that join the table to another kept table, either way."""
+    table = metadata.tables[table_name]
+    keys = {column.name for column in table.primary_key}
+    for fk in table.foreign_keys:
+        if fk.column.table.name in kept:
+            keys.add(fk.parent.name)
+    for other_name in kept:
+        for fk in metadata.tables[other_name].foreign_keys:
+            if fk.column.table.name == table_name:
+                keys.add(fk.column.name)
+    return keys
+
+
+def _relationship_count(metadata, kept: set) -> int:
+    return sum(
+        1
+        for table_name in kept
+        for fk in metadata.tables[table_name].foreign_keys
+        if fk.column.table.name in kept
+    )
+
+
+def select_columns(metadata, table_names, query_embedding, database_name: str, budget: int = None,
+                   required_tables: int = 0, descriptions=None):
+    """
+    Choose which tables and columns the SQL generation prompt shows.
+
+    Returns (table names, {table name: column names in schema order}), or (table_names, None)
+    when the budget is 0 and every column is shown. Every table keeps its key and join
+    columns; wide tables then get up to SCHEMA_PRUNE_MIN_COLUMNS of their columns closest
+    to the question (in schema order when they have no embeddings) while the budget
+    lasts, and the rest of it goes to the best remaining columns across all tables. If the keys alone
+    don't fit, tables are dropped from the end of `table_names`, never the first
+    `required_tables`. `descriptions` ({table name: text}) sizes each table's header.
+    """
+    budget = SCHEMA_PROMPT_TOKEN_BUDGET if budget is None else budget
+    if budget <= 0:
+        return list(table_names), None
+    tables = metadata.tables
+    descriptions = descriptions or {}
+    index = column_indexes.get(database_name, load_column_index)
+
+    kept = list(table_names)
+    header_tokens = {
+        name: TABLE_OVERHEAD_TOKENS + estimate_tokens(f"{name} {descriptions.get(name) or tables[name].comment or ''}")
+        for name in kept
+    }
+    column_tokens = {
+        name: {column.name: estimate_tokens(column_text(column)) + 1 for column in tables[name].columns}
+        for name in kept
+    }
+
+    def base_selection(names):
+        names_set = set(names)
+        selection = {}
+        for name in names:
+            if is_wide(tables[name]):
+                selection[name] = _key_columns(metadata, name, names_set)
+            else:
+                selection[name] = {column.name for column in tables[name].columns}
+        cost = sum(header_tokens[name] + sum(column_tokens[name][column] for column in selection[name])
+                   for name in names)
+        return selection, cost + RELATIONSHIP_TOKENS * _relationship_count(metadata, names_set)
+
+    selection, cost = base_selection(kept)
+    while cost > budget and len(kept) > max(1, required_tables):
+        kept.pop()
+        selection, cost = base_selection(kept)
+
+    # Rank the remaining columns of wide tables, each table's best SCHEMA_PRUNE_MIN_COLUMNS first
+    guaranteed, ranked = [], []
+    for name in kept:
+        if not is_wide(tables[name]):
+            continue
+        scores = index.scores(name, query_embedding)
+        columns = [column.name for column in tables[name].columns if column.name not in selection[name]]
+        if scores is None:
+            ordered = [(column, -position) for position, column in enumerate(columns)]
+        else:
+            ordered = sorted(((column, scores.get(column, -1.0)) for column in columns), key=lambda item: -item[1])
+        guaranteed.extend((name, column) for column, _ in ordered[:SCHEMA_PRUNE_MIN_COLUMNS])
+        ranked.extend((score, name, column) for column, score in ordered[SCHEMA_PRUNE_MIN_COLUMNS:])
+    ranked.sort(key=lambda item: -item[0])
+
+    for name, column in guaranteed + [(name, column) for _, name, column in ranked]:
+        tokens = column_tokens[name][column]
+        if cost + tokens > budget:
+            continue
+        selection[name].add(column)
+        cost += tokens
+
+    columns = {
+        name: [column.name for column in tables[name].columns if column.name in selection[name]]
+        for name in kept
+    }
+    return kept, columns
@@ -0,0 +1,112 @@
+import os
+import threading
+import time
+from vector_index import EmbeddingIndex
+
+# Minimum cosine similarity for a question to reuse a cached answer, and entries kept per database
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "500"))
+
+
+class SemanticCache:
+    """
+    Per-database cache of validated answers, looked up by question embedding.
+
+    A question whose embedding is within `threshold` cosine similarity of a cached
+    question reuses that question's SQL, title and related questions. Each database's
+    entries are tied to the schema fingerprint they were generated against and are
+    dropped as soon as a lookup sees a different fingerprint.
+    """
+
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD, max_entries: int = SEMANTIC_CACHE_SIZE):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._databases = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "invalidations": 0}
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def lookup(self, database_name: str, schema_fingerprint: str, embedding):
+        """Return (cached entry, similarity) for the closest cached question, or (None, None) on a miss."""
+        if not self.enabled:
+            return None, None
+        with self._lock:
+            cached = self._databases.get(database_name)
+            if cached is not None and cached["fingerprint"] != schema_fingerprint:
+                del self._databases[database_name]
+                self._stats["invalidations"] += 1
+                cached = None
+        matches = cached["index"].search(embedding, 1) if cached is not None else []
+        with self._lock:
+            if matches and matches[0][2] >= self.threshold:
+                self._stats["hits"] += 1
+                _, entry, similarity = matches[0]
+                return entry, similarity
+            self._stats["misses"] += 1
+        return None, None
+
+    def store(self, database_name: str, schema_fingerprint: str, question: str, embedding, entry: dict):
+        """Cache a validated answer; the oldest entries are dropped beyond `max_entries`."""
+        if not self.enabled:
+            return
+        entry = dict(entry, question=question, cached_at=time.time())
+        with self._lock:
+            cached = self._databases.get(database_name)
+            if cached is None or cached["fingerprint"] != schema_fingerprint:
+                cached = {"fingerprint": schema_fingerprint, "questions": [], "embeddings": [], "entries": []}
+            self._databases[database_name] = self._build(
+                schema_fingerprint,
+                (cached["questions"] + [question])[-self.max_entries:],
+                (cached["embeddings"] + [embedding])[-self.max_entries:],
+                (cached["entries"] + [entry])[-self.max_entries:],
+            )
+            self._stats["stores"] += 1
+
+    @staticmethod
+    def _build(schema_fingerprint, questions, embeddings, entries):
+        # A new immutable index each time, so concurrent lookups never see a half-updated one
+        return {
+            "fingerprint": schema_fingerprint,
+            "questions": questions,
+            "embeddings": embeddings,
+            "entries": entries,
+            "index": EmbeddingIndex(questions, embeddings, payloads=entries),
+        }
+
+    def discard(self, database_name: str, question: str):
+        """Drop the cached answer to one question, e.g. after its SQL stopped working."""
+        with self._lock:
+            cached = self._databases.get(database_name)
+            if cached is None or question not in cached["questions"]:
+                return
+            keep = [i for i, cached_question in enumerate(cached["questions"]) if cached_question != question]
+            if keep:
+                self._databases[database_name] = self._build(
+                    cached["fingerprint"],
+                    [cached["questions"][i] for i in keep],
+                    [cached["embeddings"][i] for i in keep],
+                    [cached["entries"][i] for i in keep],
+                )
+            else:
+                del self._databases[database_name]
+            self._stats["invalidations"] += 1
+
+    def invalidate(self, database_name: str):
+        with self._lock:
+            if self._databases.pop(database_name, None) is not None:
+                self._stats["invalidations"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = sum(len(cached["entries"]) for cached in self._databases.values())
+            stats["databases"] = len(self._databases)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+answer_cache = SemanticCache()
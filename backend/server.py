@@ -1,16 +1,50 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, Dict, List, Any
+from typing import Optional, Dict, List, Any, Literal
 from urllib.parse import quote_plus
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+from contextlib import asynccontextmanager
+import functools
 import os
+import time
+import clients
 import neo4j_setup
+import prompt_fragments
+import result_cache
 import user_query_runner
-from sqlalchemy import create_engine, text, MetaData
+from engine_registry import engine_registry
+import result_encoding
+from result_encoding import ARROW_MEDIA_TYPE, RESULT_FORMATS
+import result_export
+from result_export import EXPORT_MEDIA_TYPES, validated_queries
+from result_judge import judge_reviews
+from result_pages import RESULT_PAGE_SIZE, ResultPage, result_cursors
+from schema_fingerprint import schema_fingerprint
+from semantic_cache import answer_cache
+from setup_jobs import SetupJob, setup_jobs
+import sql_preflight
+import tracing
+from sqlalchemy import text, MetaData
 import traceback
 import hashlib
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warm up the shared clients before serving, and close every pool and worker on shutdown."""
+    await asyncio.get_running_loop().run_in_executor(None, clients.warm_up)
+    yield
+    pipeline_executor.shutdown(wait=False)
+    user_query_runner.stage_executor.shutdown(wait=False)
+    setup_jobs.shutdown()
+    judge_reviews.shutdown()
+    result_cursors.close_all()
+    engine_registry.clear()
+    clients.close()
+
+app = FastAPI(lifespan=lifespan)
 
 # Get CORS origins from environment variable or use default
 CORS_ORIGINS = os.environ.get('ALLOWED_ORIGINS', 'http://localhost:3000').split(',')
@@ -22,8 +56,31 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Request-Id"],
 )
 
+# Per-request trace with a Server-Timing header; not installed at all when tracing is off
+if tracing.TRACING_ENABLED:
+    @app.middleware("http")
+    async def trace_requests(request: Request, call_next):
+        with tracing.trace(request.headers.get("x-request-id")) as trace:
+            response = await call_next(request)
+        response.headers["X-Request-Id"] = trace.request_id
+        if tracing.TRACE_HEADER:
+            response.headers["Server-Timing"] = trace.server_timing()
+        return response
+
+# Bounded pool for the blocking pipeline work (SQLAlchemy, Neo4j driver, OpenAI clients)
+# so a slow LLM round-trip never stalls the event loop for other requests
+PIPELINE_WORKERS = int(os.environ.get('PIPELINE_WORKERS', '16'))
+pipeline_executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="pipeline")
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking callable on the pipeline executor and await its result."""
+    loop = asyncio.get_running_loop()
+    # Carry the request's trace over to the worker thread
+    return await loop.run_in_executor(pipeline_executor, functools.partial(tracing.propagate(func), *args, **kwargs))
+
 PLATFORMS = [
     'Snowflake',
     'Amazon Redshift',
@@ -46,10 +103,18 @@ class DBConfig(BaseModel):
     database: str
     username: Optional[str] = None
     password: Optional[str] = None
+    # Per-database pre-flight budget; unset fields fall back to the PREFLIGHT_MAX_* defaults
+    maxEstimatedRows: Optional[float] = None
+    maxEstimatedCost: Optional[float] = None
+    maxScanBytes: Optional[float] = None
+    # Per-database result cache: seconds a result stays valid (0 disables it) and how data changes are detected
+    resultCacheTtl: Optional[float] = None
+    resultCacheProbe: Optional[Literal["none", "row_count", "last_modified"]] = None
 
 class QueryRequest(BaseModel):
     query: str
     dbConfig: DBConfig
+    resultFormat: str = "rows"  # "rows", "columnar" or "arrow"
 
 def create_connection_string(config: DBConfig) -> str:
     if config.type == "default":
@@ -83,48 +148,101 @@ def create_connection_string(config: DBConfig) -> str:
     else:
         raise ValueError(f"Unsupported database type: {config.type}")
 
+def query_budget(config: DBConfig) -> dict:
+    """The pre-flight budget for a database, with the environment defaults for unset limits."""
+    budget = sql_preflight.default_budget()
+    overrides = {
+        "max_rows": config.maxEstimatedRows,
+        "max_cost": config.maxEstimatedCost,
+        "max_bytes": config.maxScanBytes,
+    }
+    budget.update({key: value for key, value in overrides.items() if value is not None})
+    return budget
+
+def result_cache_policy(config: DBConfig) -> dict:
+    """The result cache settings for a database, with the environment defaults for unset ones."""
+    policy = result_cache.default_policy()
+    overrides = {
+        "ttl": config.resultCacheTtl,
+        "probe": config.resultCacheProbe,
+    }
+    policy.update({key: value for key, value in overrides.items() if value is not None})
+    return policy
+
 def generate_database_name(config: DBConfig) -> str:
     connection_string = create_connection_string(config)
     return hashlib.sha256(connection_string.encode()).hexdigest()
 
-@app.post("/api/configure-db")
-async def configure_database(config: DBConfig):
-    print(config)
+def setup_database(config: DBConfig, database_name: str, job: SetupJob):
+    """Blocking configure work: connect, reflect and sync the Neo4j graph, stage by stage."""
     try:
-        # Create connection string and initialize DB
+        # Create connection string and get the pooled engine for this database
         connection_string = create_connection_string(config)
         print(connection_string)
-        db_engine = create_engine(connection_string)
-        metadata = MetaData()
-        
+        db_engine = engine_registry.get_engine(database_name, connection_string)
+
         # Test the connection
-        with db_engine.connect() as conn:
-            conn.execute(text("SELECT 1"))
-        
-        # Reflect database metadata
-        metadata.reflect(bind=db_engine)
-        
-        # Generate a unique database name
-        database_name = generate_database_name(config)
+        def test_connection():
+            with db_engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+        job.run_stage("connect", test_connection)
 
-        # Check if Neo4j setup matches current metadata
-        neo4j_matches, existing_descriptions = neo4j_setup.check_neo4j_setup(metadata, database_name)
-        
-        if not neo4j_matches:
-            print("Running Neo4j setup - tables don't match...")
-            table_descriptions = neo4j_setup.generate_table_descriptions(db_engine, metadata)
-            neo4j_setup.create_graph_in_neo4j(database_name, table_descriptions, metadata)
-            neo4j_setup.store_table_embeddings(database_name, table_descriptions)
-        else:
-            print("Using existing Neo4j setup - tables match...")
-            table_descriptions = existing_descriptions
+        # Reflect database metadata fresh so schema changes are picked up
+        def reflect():
+            metadata = MetaData()
+            metadata.reflect(bind=db_engine)
+            return metadata
+        metadata = job.run_stage("reflect", reflect)
 
-        return {
-            "status": "success",
-            "message": "Database configured successfully",
-            "table_descriptions": table_descriptions,
-            "neo4j_setup": "existing" if neo4j_matches else "new"
-        }
+        # Always replace the cached reflection so schema drift invalidates the stale one
+        engine_registry.put_metadata(database_name, connection_string, metadata)
+
+        # Regenerate descriptions and embeddings only for tables whose fingerprint changed
+        table_descriptions, changes = neo4j_setup.sync_schema_in_neo4j(
+            database_name,
+            db_engine,
+            metadata,
+            progress_callback=job.progress_callback("describe"),
+            run_stage=job.run_stage
+        )
+
+        # Prompt text per table, so queries assemble the schema context without walking the reflection
+        job.run_stage("prompt_fragments", lambda: len(prompt_fragments.fragment_cache.put(
+            database_name,
+            schema_fingerprint(metadata),
+            prompt_fragments.build_fragments(metadata.tables, table_descriptions)
+        )))
+    except Exception:
+        # Don't keep a broken engine or a half-reflected schema around
+        engine_registry.invalidate(database_name)
+        raise
+
+    schema_changed = any(changes[key] for key in ("added", "changed", "dropped"))
+    if schema_changed:
+        # Cached results may come from tables that no longer look the same
+        result_cache.result_cache.invalidate(database_name)
+    print(f"Neo4j sync - added: {len(changes['added'])}, changed: {len(changes['changed'])}, dropped: {len(changes['dropped'])}")
+
+    return {
+        "status": "success",
+        "message": "Database configured successfully",
+        "table_descriptions": table_descriptions,
+        "neo4j_setup": "updated" if schema_changed else "existing",
+        "schema_changes": changes
+    }
+
+@app.post("/api/configure-db")
+async def configure_database(config: DBConfig, response: Response, background: bool = False):
+    """
+    Configure a database. With ?background=true the setup runs as a job and its id is
+    returned immediately; poll /api/configure-db/jobs/{job_id} for per-stage progress.
+    A database that is already being set up joins the running job instead of starting another.
+    """
+    print(config)
+    try:
+        # Generate a unique database name
+        database_name = generate_database_name(config)
+        job = setup_jobs.submit(database_name, functools.partial(setup_database, config, database_name))
     except Exception as e:
         traceback.print_exc()  # Print the full error for debugging
         raise HTTPException(
@@ -132,39 +250,104 @@ async def configure_database(config: DBConfig):
             detail=f"Failed to configure database: {str(e)}"
         )
 
+    if background:
+        response.status_code = 202
+        return {
+            "status": "accepted",
+            "job_id": job.id,
+            "status_url": f"/api/configure-db/jobs/{job.id}"
+        }
+
+    await asyncio.wrap_future(job.future)
+    if job.status != "succeeded":
+        raise HTTPException(
+            status_code=500, 
+            detail=f"Failed to configure database: {job.error}"
+        )
+    return job.result
+
+@app.get("/api/configure-db/jobs/{job_id}")
+async def get_configure_job(job_id: str):
+    job = setup_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown setup job: {job_id}")
+    return job.to_dict()
+
+@app.post("/api/configure-db/jobs/{job_id}/resume")
+async def resume_configure_job(job_id: str):
+    """Re-run a failed setup job from the stage that failed."""
+    job = setup_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown setup job: {job_id}")
+    resumed = setup_jobs.resume(job_id)
+    if resumed is None:
+        raise HTTPException(status_code=409, detail=f"Setup job {job_id} is {job.status}, only failed jobs can be resumed")
+    return {
+        "status": "accepted",
+        "job_id": resumed.id,
+        "status_url": f"/api/configure-db/jobs/{resumed.id}"
+    }
+
+def execute_user_query(request: QueryRequest):
+    """Blocking query work: run the pipeline and encode its results in the requested format."""
+    return encode_results(answer_user_query(request), request.resultFormat)
+
+def answer_user_query(request: QueryRequest, on_event=None):
+    """Run the pipeline and format its results for the frontend; on_event is passed to run_pipeline."""
+    # Generate database name from config in request
+    connection_string = create_connection_string(request.dbConfig)
+    database_name = generate_database_name(request.dbConfig)
+
+    # Reuse the pooled engine and reflected metadata for this database
+    db_engine, metadata = engine_registry.get(database_name, connection_string)
+
+    # Run the query pipeline and get the full results, passing engine and metadata
+    results, generated_sql, table_name, related_questions = user_query_runner.run_pipeline(
+        request.query, 
+        database_name,
+        dbtype=request.dbConfig.type,
+        engine=db_engine,
+        metadata=metadata,
+        budget=query_budget(request.dbConfig),
+        on_event=on_event,
+        cache_policy=result_cache_policy(request.dbConfig)
+    )
+    
+    # Format results for frontend
+    formatted_results = format_query_results(results)
+    
+    # Add the generated SQL to the response
+    formatted_results["query"] = generated_sql
+    if not isinstance(results, str):
+        formatted_results["export_id"] = validated_queries.put(database_name, connection_string, generated_sql, request.query)
+    formatted_results["table_name"] = table_name
+    formatted_results["related_questions"] = related_questions
+    
+    return formatted_results
+
+def encode_results(formatted_results: dict, result_format: str):
+    """Build the response body in the requested format; runs on the executor since it's CPU-bound."""
+    if result_format == "columnar":
+        payload = {"status": "success", "results": result_encoding.to_columnar(formatted_results)}
+        return Response(content=result_encoding.dumps(payload), media_type="application/json")
+    if result_format == "arrow":
+        return Response(content=result_encoding.encode_arrow(formatted_results), media_type=ARROW_MEDIA_TYPE)
+    return {
+        "status": "success",
+        "results": formatted_results
+    }
+
+def check_result_format(result_format: str):
+    if result_format not in RESULT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported result format: {result_format}")
+    if result_format == "arrow" and result_encoding.pa is None:
+        raise HTTPException(status_code=400, detail="Arrow responses require pyarrow on the server")
+
 @app.post("/api/run-query")
 async def run_query(request: QueryRequest):
+    check_result_format(request.resultFormat)
     try:
-        # Create new engine and metadata for this request
-        connection_string = create_connection_string(request.dbConfig)
-        db_engine = create_engine(connection_string)
-        metadata = MetaData()
-        metadata.reflect(bind=db_engine)
-
-        # Generate database name from config in request
-        database_name = generate_database_name(request.dbConfig)
-
-        # Run the query pipeline and get the full results, passing engine and metadata
-        results, generated_sql, table_name, related_questions = user_query_runner.run_pipeline(
-            request.query, 
-            database_name,
-            dbtype=request.dbConfig.type,
-            engine=db_engine,
-            metadata=metadata
-        )
-        
-        # Format results for frontend
-        formatted_results = format_query_results(results)
-        
-        # Add the generated SQL to the response
-        formatted_results["query"] = generated_sql
-        formatted_results["table_name"] = table_name
-        formatted_results["related_questions"] = related_questions
-        
-        return {
-            "status": "success",
-            "results": formatted_results
-        }
+        return await run_blocking(execute_user_query, request)
     except Exception as e:
         traceback.print_exc()  # Print the full error for debugging
         raise HTTPException(
@@ -172,11 +355,132 @@ async def run_query(request: QueryRequest):
             detail=f"Query execution failed: {str(e)}"
         )
 
+def sse_event(event: str, data) -> bytes:
+    return f"event: {event}\ndata: ".encode() + result_encoding.dumps(data) + b"\n\n"
+
+@app.post("/api/run-query/stream")
+async def run_query_stream(request: QueryRequest):
+    """
+    Server-Sent Events version of /api/run-query, sent as the pipeline progresses:
+    tables, sql_token (SQL generation output), sql, rows (first page, with empty
+    related_questions until title), title, then result with the same payload
+    /api/run-query returns, or error. Events are JSON, so resultFormat may be "rows" or
+    "columnar" (applied to rows and result); Arrow needs /api/run-query.
+    """
+    check_result_format(request.resultFormat)
+    if request.resultFormat == "arrow":
+        raise HTTPException(status_code=400, detail="Arrow results can't be streamed as events; use /api/run-query")
+    columnar = request.resultFormat == "columnar"
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def on_event(event, data):
+        # Called on the pipeline's worker threads
+        if event == "rows":
+            data = {**format_query_results(data["results"]), "query": data["query"], "related_questions": []}
+            if columnar:
+                data = result_encoding.to_columnar(data)
+        loop.call_soon_threadsafe(events.put_nowait, (event, data))
+
+    async def run():
+        try:
+            result = await run_blocking(answer_user_query, request, on_event)
+            if columnar:
+                result = result_encoding.to_columnar(result)
+            events.put_nowait(("result", result))
+        except Exception as e:
+            traceback.print_exc()
+            events.put_nowait(("error", {"detail": f"Query execution failed: {str(e)}"}))
+        events.put_nowait(None)
+
+    async def stream():
+        pipeline = asyncio.ensure_future(run())
+        while (item := await events.get()) is not None:
+            yield sse_event(*item)
+        await pipeline
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/api/export/{export_id}")
+async def export_results(export_id: str, format: str = "csv"):
+    """Stream the full result of a previously validated query as CSV, NDJSON or Parquet."""
+    if format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported export format: {format}")
+    if format == "parquet" and result_export.pa is None:
+        raise HTTPException(status_code=400, detail="Parquet export requires pyarrow on the server")
+    query = validated_queries.get(export_id)
+    if query is None:
+        raise HTTPException(status_code=404, detail="Unknown export id; re-run the query")
+
+    db_engine = engine_registry.get_engine(query["database_name"], query["connection_string"])
+    # Starlette iterates sync generators in its threadpool, so the event loop stays free
+    return StreamingResponse(
+        result_export.export_query(
+            db_engine, query["sql"], format, preamble=result_export.csv_preamble(query) if format == "csv" else None
+        ),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="query-result-{export_id[:8]}.{format}"'}
+    )
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Stage latency histograms and LLM token counters in the Prometheus text format."""
+    return tracing.render_metrics()
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    return {"semantic_cache": answer_cache.stats(), "result_cache": result_cache.result_cache.stats()}
+
+def format_result_page(page: ResultPage):
+    return {
+        "columns": page.columns,
+        "rows": page.rows,
+        "offset": page.offset,
+        "cursor": page.cursor,  # Pass to /api/run-query/pages/{cursor} for the next page
+        "row_count": page.row_count,  # Total rows, once known
+        "truncated": page.truncated,  # True when RESULT_MAX_ROWS cut the result short
+        "review_url": f"/api/run-query/reviews/{page.review_id}" if page.review_id else None,  # Background judge verdict
+        "cached": page.cached_at is not None,  # Served from the result cache
+        "cached_age": round(time.time() - page.cached_at, 3) if page.cached_at is not None else None,  # Seconds since it was executed
+        "display_query": False
+    }
+
+@app.get("/api/run-query/pages/{cursor}")
+async def get_result_page(cursor: str, page_size: int = RESULT_PAGE_SIZE, format: str = "rows"):
+    """Fetch the next page of a streamed query result."""
+    check_result_format(format)
+    page = await run_blocking(result_cursors.fetch_page, cursor, max(1, min(page_size, RESULT_PAGE_SIZE)))
+    if page is None:
+        raise HTTPException(status_code=410, detail="Result cursor expired or already exhausted; re-run the query")
+    return await run_blocking(encode_results, format_result_page(page), format)
+
+@app.get("/api/run-query/reviews/{review_id}")
+def get_judge_review(review_id: str):
+    """Verdict of a background judge review, with the corrected result if the judge said no."""
+    review = judge_reviews.get(review_id)
+    if review is None:
+        raise HTTPException(status_code=404, detail="Review not found")
+    response = review.to_dict()
+    if review.status in ("corrected", "failed") and review.result is not None:
+        response["query"] = review.sql
+        response["result"] = format_query_results(review.result)
+    if review.status == "corrected" and review.table_name is not None:
+        response["table_name"] = review.table_name
+        response["related_questions"] = review.related_questions
+    return response
+
 def format_query_results(results):
     try:
         if isinstance(results, str):  # Error message
             return {"error": results, "columns": [], "rows": []}
         
+        if isinstance(results, ResultPage):  # First page of a streamed result
+            return format_result_page(results)
+
         if not results:  # Empty results
             return {"columns": [], "rows": []}
         
@@ -0,0 +1,156 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import time
+import traceback
+import uuid
+import tracing
+
+# Database setups running at once, and how many finished jobs stay queryable
+SETUP_WORKERS = int(os.getenv("SETUP_WORKERS", "2"))
+JOB_HISTORY_SIZE = int(os.getenv("JOB_HISTORY_SIZE", "100"))
+
+
+class SetupJob:
+    """
+    One run of the configure pipeline for a database, split into named stages.
+
+    Results of completed stages are kept on the job, so resuming a failed job
+    skips straight to the stage that failed.
+    """
+
+    def __init__(self, database_name: str):
+        self.id = uuid.uuid4().hex
+        self.database_name = database_name
+        self.status = "pending"
+        self.error = None
+        self.result = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.stages = OrderedDict()
+        self.stage_results = {}
+        self.future = None
+        self.target = None
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        return self.status in ("pending", "running")
+
+    def run_stage(self, name: str, func):
+        """Run one stage, or return its stored result if it already completed."""
+        with self._lock:
+            stage = self.stages.setdefault(name, {"status": "pending"})
+            if stage["status"] == "done":
+                return self.stage_results.get(name)
+            stage.update(status="running", started_at=time.time(), finished_at=None, error=None)
+        try:
+            with tracing.span(f"configure_{name}"):
+                result = func()
+        except Exception as e:
+            with self._lock:
+                stage.update(status="failed", finished_at=time.time(), error=str(e))
+            raise
+        with self._lock:
+            stage.update(status="done", finished_at=time.time())
+            self.stage_results[name] = result
+        return result
+
+    def progress_callback(self, name: str):
+        """Return a callback(completed, total, item) that records progress on a stage."""
+        def report(completed, total, item=None):
+            with self._lock:
+                stage = self.stages.setdefault(name, {"status": "running"})
+                stage["progress"] = {"completed": completed, "total": total, "last": item}
+        return report
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "status": self.status,
+                "error": self.error,
+                "created_at": self.created_at,
+                "finished_at": self.finished_at,
+                "stages": {name: dict(stage) for name, stage in self.stages.items()},
+                "result": self.result,
+            }
+
+
+class SetupJobManager:
+    """Runs setup jobs on a bounded background pool, at most one active job per database."""
+
+    def __init__(self, max_workers: int = SETUP_WORKERS, history_size: int = JOB_HISTORY_SIZE):
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="setup")
+        self.history_size = history_size
+        self._jobs = OrderedDict()
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def submit(self, database_name: str, target):
+        """
+        Start `target(job)` for a database and return the job.
+
+        If the database is already being set up, the running job is returned instead.
+        """
+        with self._lock:
+            active_id = self._active.get(database_name)
+            if active_id is not None and self._jobs[active_id].active:
+                return self._jobs[active_id]
+            job = SetupJob(database_name)
+            self._jobs[job.id] = job
+            self._start(job, target)
+            self._trim_history()
+            return job
+
+    def resume(self, job_id: str):
+        """Re-run a failed job from the stage that failed. Returns None if the job can't be resumed."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status != "failed":
+                return None
+            active_id = self._active.get(job.database_name)
+            if active_id is not None and self._jobs[active_id].active:
+                return self._jobs[active_id]
+            job.error = None
+            job.finished_at = None
+            self._start(job, job.target)
+            return job
+
+    def get(self, job_id: str):
+        return self._jobs.get(job_id)
+
+    def _start(self, job, target):
+        job.status = "pending"
+        job.target = target
+        self._active[job.database_name] = job.id
+        job.future = self.executor.submit(self._run, job, target)
+
+    def _run(self, job, target):
+        job.status = "running"
+        try:
+            with tracing.trace(job.id):
+                job.result = target(job)
+            job.status = "succeeded"
+        except Exception as e:
+            traceback.print_exc()
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                if self._active.get(job.database_name) == job.id:
+                    del self._active[job.database_name]
+        return job
+
+    def _trim_history(self):
+        finished = [job_id for job_id, job in self._jobs.items() if not job.active]
+        for job_id in finished[:max(0, len(self._jobs) - self.history_size)]:
+            del self._jobs[job_id]
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+setup_jobs = SetupJobManager()
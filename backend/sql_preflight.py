@@ -0,0 +1,176 @@
+"""
+Pre-flight EXPLAIN for generated SQL.
+
+Before a query runs, the dialect's EXPLAIN (or equivalent) is used to catch errors and
+estimate its cost. Queries whose estimate exceeds the database's budget are rejected with
+a message for the correction loop, so they never execute.
+"""
+import json
+import os
+import re
+from sqlalchemy import text
+
+try:
+    import sqlglot
+    from sqlglot import exp
+except ImportError:  # Only needed to resolve table aliases in SQLite plans
+    sqlglot = None
+
+try:
+    from google.cloud import bigquery
+except ImportError:  # Installed with the BigQuery SQLAlchemy dialect
+    bigquery = None
+
+# Pre-flight on/off and the default budget; 0 means no limit
+PREFLIGHT_ENABLED = os.getenv("PREFLIGHT_ENABLED", "true").lower() == "true"
+PREFLIGHT_MAX_ROWS = float(os.getenv("PREFLIGHT_MAX_ROWS", "0"))
+PREFLIGHT_MAX_COST = float(os.getenv("PREFLIGHT_MAX_COST", "0"))
+PREFLIGHT_MAX_BYTES = float(os.getenv("PREFLIGHT_MAX_BYTES", "0"))
+
+_PG_COST_PATTERN = re.compile(r"cost=[\d.]+\.\.([\d.]+) rows=(\d+)")
+# "SCAN orders", or "SCAN TABLE orders" before SQLite 3.36
+_SQLITE_SCAN_PATTERN = re.compile(r"^SCAN (?:TABLE )?(\S+)")
+
+
+class QueryEstimate:
+    def __init__(self, rows=None, cost=None, bytes_scanned=None, plan=""):
+        self.rows = rows
+        self.cost = cost
+        self.bytes_scanned = bytes_scanned
+        self.plan = plan
+
+
+class QueryBudgetError(ValueError):
+    """Raised when a query's estimated cost exceeds the budget; the message explains by how much."""
+
+
+def default_budget():
+    return {"max_rows": PREFLIGHT_MAX_ROWS, "max_cost": PREFLIGHT_MAX_COST, "max_bytes": PREFLIGHT_MAX_BYTES}
+
+
+def _table_aliases(sql_query, dialect):
+    if sqlglot is None:
+        return {}
+    try:
+        expression = sqlglot.parse_one(sql_query, dialect=dialect)
+    except Exception:
+        return {}
+    return {table.alias_or_name: table.name for table in expression.find_all(exp.Table)}
+
+
+def _sqlite_table_rows(connection, table_name):
+    """Cheap row estimate: sqlite_stat1 if ANALYZE ran, otherwise MAX(rowid), which is an index lookup."""
+    try:
+        stat = connection.execute(
+            text("SELECT stat FROM sqlite_stat1 WHERE tbl = :table AND idx IS NULL"), {"table": table_name}
+        ).scalar()
+        if stat:
+            return int(stat.split()[0])
+    except Exception:
+        pass
+    try:
+        quoted = table_name.replace('"', '""')
+        return connection.execute(text(f'SELECT MAX(rowid) FROM "{quoted}"')).scalar() or 0
+    except Exception:
+        return None
+
+
+def _explain_sqlite(connection, sql_query, dialect):
+    plan = connection.execute(text(f"EXPLAIN QUERY PLAN {sql_query}")).fetchall()
+    aliases = _table_aliases(sql_query, dialect)
+
+    # Full scans under the same parent are nested loops, so their row counts multiply
+    loops = {}
+    for _, parent, _, detail in plan:
+        match = _SQLITE_SCAN_PATTERN.match(detail)
+        if not match:
+            continue
+        table_rows = _sqlite_table_rows(connection, aliases.get(match.group(1), match.group(1)))
+        if table_rows is not None:
+            loops[parent] = loops.get(parent, 1) * max(1, table_rows)
+    return QueryEstimate(
+        rows=sum(loops.values()),
+        plan="\n".join(row[3] for row in plan),
+    )
+
+
+def _explain_postgres(connection, sql_query, dialect):
+    plan = [row[0] for row in connection.execute(text(f"EXPLAIN {sql_query}")).fetchall()]
+    match = _PG_COST_PATTERN.search(plan[0]) if plan else None
+    if not match:
+        return QueryEstimate(plan="\n".join(plan))
+    return QueryEstimate(rows=int(match.group(2)), cost=float(match.group(1)), plan="\n".join(plan))
+
+
+def _explain_snowflake(connection, sql_query, dialect):
+    plan = connection.execute(text(f"EXPLAIN USING JSON {sql_query}")).scalar()
+    stats = json.loads(plan).get("GlobalStats", {})
+    return QueryEstimate(bytes_scanned=stats.get("bytesAssigned"), plan=plan)
+
+
+def _explain_bigquery(connection, sql_query, dialect):
+    # A dry run validates the query and reports the bytes it would bill, without running it
+    client = connection.connection.dbapi_connection._client
+    job = client.query(sql_query, job_config=bigquery.QueryJobConfig(dry_run=True, use_query_cache=False))
+    return QueryEstimate(
+        bytes_scanned=job.total_bytes_processed,
+        plan=f"Dry run: {job.total_bytes_processed} bytes processed",
+    )
+
+
+def _explain_validate_only(connection, sql_query, dialect):
+    # Trino/Presto: validates the query without estimating it
+    connection.execute(text(f"EXPLAIN (TYPE VALIDATE) {sql_query}")).fetchall()
+    return QueryEstimate()
+
+
+# SQLAlchemy dialect name -> EXPLAIN implementation
+EXPLAINERS = {
+    "sqlite": _explain_sqlite,
+    "postgresql": _explain_postgres,
+    "redshift": _explain_postgres,
+    "snowflake": _explain_snowflake,
+    "bigquery": _explain_bigquery,
+    "trino": _explain_validate_only,
+}
+
+
+def explain(engine, sql_query, dialect=None):
+    """
+    Return a QueryEstimate for `sql_query`, or None if the dialect has no pre-flight.
+
+    Errors from EXPLAIN (syntax, unknown objects) propagate, so the caller can send them
+    back for correction without having run the query.
+    """
+    explainer = EXPLAINERS.get(engine.dialect.name)
+    if explainer is None:
+        return None
+    sql_query = sql_query.strip().rstrip(";")
+    with engine.connect() as connection:
+        return explainer(connection, sql_query, dialect)
+
+
+def check_budget(estimate, budget):
+    """List the ways an estimate exceeds the budget."""
+    violations = []
+    if estimate is None:
+        return violations
+    if budget.get("max_rows") and estimate.rows is not None and estimate.rows > budget["max_rows"]:
+        violations.append(f"it is estimated to read {estimate.rows:,} rows (budget {budget['max_rows']:,.0f})")
+    if budget.get("max_cost") and estimate.cost is not None and estimate.cost > budget["max_cost"]:
+        violations.append(f"its estimated cost is {estimate.cost:,.0f} (budget {budget['max_cost']:,.0f})")
+    if budget.get("max_bytes") and estimate.bytes_scanned is not None and estimate.bytes_scanned > budget["max_bytes"]:
+        violations.append(f"it would scan {estimate.bytes_scanned:,} bytes (budget {budget['max_bytes']:,.0f})")
+    return violations
+
+
+def preflight(engine, sql_query, budget=None, dialect=None):
+    """EXPLAIN the query and raise QueryBudgetError if it's over budget. Returns the estimate."""
+    estimate = explain(engine, sql_query, dialect)
+    violations = check_budget(estimate, budget or default_budget())
+    if violations:
+        raise QueryBudgetError(
+            "Query rejected before execution because " + " and ".join(violations)
+            + ". Add filters, aggregate earlier or select fewer rows."
+        )
+    return estimate
@@ -0,0 +1,229 @@
+"""
+Offline checks for generated SQL, run before anything touches the database.
+
+Queries are parsed for the engine's dialect and checked against the reflected MetaData
+for unknown tables, unknown or ambiguous columns and functions the dialect can't run.
+Problems are returned as messages to feed back to the model.
+"""
+import re
+import weakref
+from sqlalchemy import text
+
+try:
+    import sqlglot
+    from sqlglot import exp
+    from sqlglot.errors import ErrorLevel, ParseError, UnsupportedError
+    from sqlglot.optimizer.scope import traverse_scope
+except ImportError:  # Without sqlglot only the identifier pre-pass runs
+    sqlglot = None
+
+# SQLAlchemy dialect name -> sqlglot dialect
+SQLGLOT_DIALECTS = {
+    "sqlite": "sqlite",
+    "postgresql": "postgres",
+    "redshift": "redshift",
+    "snowflake": "snowflake",
+    "bigquery": "bigquery",
+    "mssql": "tsql",
+    "oracle": "oracle",
+    "trino": "trino",
+    "databricks": "databricks",
+    "teradatasql": "teradata",
+    "dremio": "dremio",
+}
+
+# Generated names that look like calls but are syntax, not functions
+_SYNTAX_CALLS = {"CAST", "TRY_CAST", "EXISTS", "IN", "NOT", "VALUES"}
+
+_function_names = weakref.WeakKeyDictionary()
+
+
+class SQLValidationError(ValueError):
+    """Raised when generated SQL fails the offline checks; the message lists every problem."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("Query rejected before execution:\n- " + "\n- ".join(errors))
+
+
+def dialect_for_engine(engine):
+    return SQLGLOT_DIALECTS.get(engine.dialect.name)
+
+
+def known_functions(engine):
+    """Function names the database reports (SQLite only), cached per engine; None if unknown."""
+    if engine.dialect.name != "sqlite":
+        return None
+    if engine not in _function_names:
+        try:
+            with engine.connect() as connection:
+                rows = connection.execute(text("SELECT name FROM pragma_function_list")).fetchall()
+            _function_names[engine] = {row[0].upper() for row in rows}
+        except Exception:
+            # Older SQLite builds don't expose the function list
+            _function_names[engine] = None
+    return _function_names[engine]
+
+
+def _quote(name, dialect):
+    if sqlglot is None:
+        return f'"{name}"'
+    return exp.to_identifier(name, quoted=True).sql(dialect=dialect)
+
+
+def rewrite_identifiers(sql_query, metadata, dialect=None):
+    """
+    Map table references onto the exact reflected table names.
+
+    Handles the `:Table Name` form the generation prompt asks for, then, if sqlglot is
+    available, fixes the case of table names and quotes names that need quoting.
+    """
+    table_names = list(metadata.tables.keys())
+    # Longest names first so ":Order Details" isn't consumed by ":Order"
+    for table_name in sorted(table_names, key=len, reverse=True):
+        pattern = re.compile(f":{re.escape(table_name)}:?(?![\\w])")
+        sql_query = pattern.sub(lambda _: _quote(table_name, dialect), sql_query)
+
+    if sqlglot is None:
+        return sql_query
+    try:
+        expression = sqlglot.parse_one(sql_query, dialect=dialect)
+    except ParseError:
+        # Leave unparseable SQL alone; validation reports the parse error
+        return sql_query
+
+    by_lower = {name.lower(): name for name in table_names}
+    changed = False
+    for table in expression.find_all(exp.Table):
+        exact = by_lower.get(table.name.lower())
+        if exact is not None and (table.name != exact or (not table.this.quoted and not exact.isidentifier())):
+            table.set("this", exp.to_identifier(exact, quoted=True))
+            changed = True
+    return expression.sql(dialect=dialect) if changed else sql_query
+
+
+def _column_sets(metadata):
+    return {
+        name.lower(): {column.name.lower() for column in table.columns}
+        for name, table in metadata.tables.items()
+    }
+
+
+def _function_name(node, dialect):
+    if isinstance(node, exp.Anonymous):
+        return node.name.upper()
+    match = re.match(r"([A-Za-z_][\w]*)\(", node.sql(dialect=dialect))
+    return match.group(1).upper() if match else None
+
+
+def _scope_tables(scope, columns_by_table):
+    """({alias: column names} of the scope's reflected tables, whether it also reads other sources)."""
+    tables = {}
+    has_other_source = False
+    for alias, source in scope.sources.items():
+        if isinstance(source, exp.Table) and source.name.lower() in columns_by_table:
+            tables[alias.lower()] = columns_by_table[source.name.lower()]
+        else:
+            has_other_source = True
+    return tables, has_other_source
+
+
+def _resolve_column(column, scope, columns_by_table):
+    """
+    Return the problem with a column reference, or None if it resolves.
+
+    Like the database, look in the column's own scope first and then in the enclosing
+    ones, so correlated subqueries can use the outer tables.
+    """
+    name = column.name.lower()
+    while scope is not None:
+        tables, has_other_source = _scope_tables(scope, columns_by_table)
+        if column.table:
+            columns = tables.get(column.table.lower())
+            if columns is not None:
+                return None if name in columns else f"Unknown column: {column.table}.{column.name}"
+            if column.table.lower() in {alias.lower() for alias in scope.sources}:
+                return None  # A CTE or derived table, whose columns aren't checked
+        else:
+            matches = [alias for alias, columns in tables.items() if name in columns]
+            if len(matches) > 1:
+                return (f"Ambiguous column {column.name}: it exists in {', '.join(sorted(matches))}; "
+                        "qualify it with a table name.")
+            select_aliases = {
+                select.alias.lower() for select in getattr(scope.expression, "selects", []) if select.alias
+            }
+            if matches or has_other_source or name in select_aliases:
+                return None
+        scope = scope.parent
+    return None if column.table else f"Unknown column: {column.name}"
+
+
+def validate_sql(sql_query, metadata, dialect=None, functions=None):
+    """
+    Return a list of problems with `sql_query`, empty if it looks runnable.
+
+    `functions` is an optional set of function names the target database supports.
+    Columns are resolved scope by scope, inner to outer; a bare column that exists in
+    some other table of the schema is only reported as a warning.
+    """
+    if sqlglot is None:
+        return []
+    try:
+        statements = [statement for statement in sqlglot.parse(sql_query, dialect=dialect) if statement is not None]
+    except ParseError as e:
+        return [f"Syntax error: {e}"]
+    if len(statements) != 1:
+        return [f"Expected exactly one SQL statement, found {len(statements)}."]
+    expression = statements[0]
+    if not isinstance(expression, (exp.Query, exp.Subquery)):
+        return ["Only read-only SELECT queries are allowed."]
+
+    errors = []
+    columns_by_table = _column_sets(metadata)
+    cte_names = {cte.alias_or_name.lower() for cte in expression.find_all(exp.CTE)}
+
+    for table in expression.find_all(exp.Table):
+        name = table.name.lower()
+        if name and name not in columns_by_table and name not in cte_names:
+            errors.append(f"Unknown table: {table.name}")
+
+    try:
+        scopes = traverse_scope(expression)
+    except Exception as e:
+        print(f"Warning: could not resolve the columns of the generated SQL, skipping column checks: {e}")
+        scopes = []
+    all_columns = set().union(*columns_by_table.values()) if columns_by_table else set()
+    # A scope's columns include those of its subqueries, which come first: each column is checked once,
+    # against the innermost scope that contains it and then the scopes around it
+    checked = set()
+    for scope in scopes:
+        for column in scope.columns:
+            if id(column) in checked:
+                continue
+            checked.add(id(column))
+            name = column.name.lower()
+            if not name or name == "*":
+                continue
+            problem = _resolve_column(column, scope, columns_by_table)
+            if problem is None:
+                continue
+            if problem.startswith("Unknown column") and not column.table and name in all_columns:
+                # The column exists elsewhere in the schema, so this may be a scoping case the check
+                # gets wrong; the database has the final say
+                print(f"Warning: {problem}")
+            else:
+                errors.append(problem)
+
+    try:
+        expression.sql(dialect=dialect, unsupported_level=ErrorLevel.RAISE)
+    except UnsupportedError as e:
+        errors.append(f"Not supported by the {dialect} dialect: {e}")
+
+    if functions:
+        for node in expression.find_all(exp.Func):
+            name = _function_name(node, dialect)
+            if name and name not in functions and name not in _SYNTAX_CALLS:
+                errors.append(f"Function {name} does not exist in this database.")
+
+    # Keep the order stable but report each problem once
+    return list(dict.fromkeys(errors))
@@ -0,0 +1,148 @@
+"""
+In-memory stand-in for the Neo4j driver, for offline benchmarks.
+
+It understands exactly the Cypher statements neo4j_setup, user_query_runner and few_shot
+send (Table nodes with RELATES_TO edges keyed by database and name, their Column nodes
+and Example nodes) and raises on anything else, so a new query shows up as a failure instead of a silently
+wrong benchmark.
+"""
+import threading
+import time
+
+
+class StubResult(list):
+    def consume(self):
+        return None
+
+
+class StubGraphDriver:
+    """Holds {database: {name: properties}} and {database: {(source, target)}} behind one lock."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.tables = {}
+        self.edges = {}
+        self.examples = {}
+        self.columns = {}
+        self.round_trips = 0
+        self._lock = threading.Lock()
+
+    def session(self, *args, **kwargs):
+        return StubGraphSession(self)
+
+    def close(self):
+        pass
+
+    def run(self, query, parameters=None, **params):
+        if self.latency:
+            time.sleep(self.latency)
+        params = {**(parameters or {}), **params}
+        with self._lock:
+            self.round_trips += 1
+            return StubResult(self._run(" ".join(query.split()), params))
+
+    def _run(self, query, params):
+        database = params.get("database", params.get("database_name"))
+        tables = self.tables.setdefault(database, {}) if database is not None else None
+        edges = self.edges.setdefault(database, set()) if database is not None else None
+        rows = params.get("rows", [])
+
+        if query.startswith("CREATE INDEX"):
+            return []
+        if "(c:Column" in query:
+            return self._run_columns(query, database, rows)
+        if "DETACH DELETE t" in query:
+            names = set(rows) if "UNWIND" in query else set(tables)
+            for name in names:
+                tables.pop(name, None)
+            edges.difference_update({edge for edge in edges if edge[0] in names or edge[1] in names})
+            return []
+        if "MERGE (t:Table" in query:
+            for row in rows:
+                tables.setdefault(row["name"], {}).update(description=row["description"], fingerprint=row["fingerprint"])
+            return []
+        if "MERGE (a)-[:RELATES_TO]->(b)" in query:
+            edges.update((row["source"], row["target"]) for row in rows
+                         if row["source"] in tables and row["target"] in tables)
+            return []
+        if "DELETE r" in query:
+            edges.difference_update((row["source"], row["target"]) for row in rows)
+            return []
+        if "SET t.fingerprint = row.fingerprint" in query or "SET t.embedding = row.embedding" in query:
+            key = "fingerprint" if "fingerprint" in query.split("SET", 1)[1] else "embedding"
+            for row in rows:
+                if row["name"] in tables:
+                    tables[row["name"]][key] = row[key]
+            return []
+        if "MERGE (e:Example" in query:
+            self.examples.setdefault(database, {})[params["question"]] = {
+                "question": params["question"], "sql": params["sql"],
+                "embedding": params["embedding"], "created_at": params["created_at"],
+            }
+            return []
+        if "MATCH (e:Example)" in query:
+            return sorted(self.examples.get(database, {}).values(), key=lambda example: example["created_at"])
+        if "RETURN a.name AS source, b.name AS target" in query:
+            return [{"source": source, "target": target} for source, target in edges]
+        if "as has_embedding" in query:
+            return [
+                {
+                    "database": database,
+                    "name": name,
+                    "description": properties.get("description"),
+                    "has_embedding": properties.get("embedding") is not None,
+                    "fingerprint": properties.get("fingerprint"),
+                }
+                for name, properties in tables.items()
+            ]
+        if "t.embedding AS embedding" in query:
+            return [
+                {"table_name": name, "description": properties.get("description"), "embedding": properties["embedding"]}
+                for name, properties in tables.items()
+                if properties.get("embedding") is not None
+            ]
+        raise NotImplementedError(f"Stub graph does not understand: {query[:120]}")
+
+    def _run_columns(self, query, database, rows):
+        """Column nodes as {database: {(table, name): embedding}}."""
+        columns = self.columns.setdefault(database, {})
+        if "DETACH DELETE c" in query:
+            tables = set(rows) if "UNWIND" in query else {table for table, _ in columns}
+            for key in [key for key in columns if key[0] in tables]:
+                del columns[key]
+            return []
+        if "MERGE (c:Column" in query:
+            for row in rows:
+                if row["table"] in self.tables.get(database, {}):
+                    columns[(row["table"], row["name"])] = row["embedding"]
+            return []
+        if "RETURN DISTINCT t.name AS name" in query:
+            return [{"name": table} for table in {table for table, _ in columns}]
+        if "c.embedding AS embedding" in query:
+            return [
+                {"table_name": table, "column_name": name, "embedding": embedding}
+                for (table, name), embedding in columns.items()
+            ]
+        raise NotImplementedError(f"Stub graph does not understand: {query[:120]}")
+
+
+class StubGraphSession:
+    def __init__(self, driver):
+        self._driver = driver
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def close(self):
+        pass
+
+    def run(self, query, parameters=None, **params):
+        return self._driver.run(query, parameters, **params)
+
+    def execute_write(self, work, *args, **kwargs):
+        return work(self, *args, **kwargs)
+
+    execute_read = execute_write
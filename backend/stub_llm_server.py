@@ -0,0 +1,286 @@
+"""
+Deterministic local stand-in for the OpenAI embeddings and chat completions APIs
+(including function calls), for offline testing and benchmarks.
+
+Chat replies are chosen from the prompt: the judge always says yes, SQL prompts get a
+query against the first table in the schema context, and function calls get arguments
+filled in from the function's JSON schema. Latency and failures can be injected.
+
+Run it and point the OpenAI clients at it:
+    python stub_llm_server.py --port 8100 --chat-latency 0.3 --error-rate 0.01
+    OPENAI_BASE_URL=http://localhost:8100/v1 python server.py
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+import numpy as np
+
+EMBEDDING_DIMENSIONS = 1536
+
+app = FastAPI()
+
+# Request counters and fault injection settings, shared by all handlers
+stats = {
+    "embedding_requests": 0, "embedding_inputs": 0, "chat_requests": 0, "function_calls": 0,
+    "prompt_tokens": 0, "completion_tokens": 0, "rate_limited": 0, "errors": 0,
+}
+settings = {
+    "rate_limit_every": 0,  # Answer every Nth request of each kind with a 429
+    "error_rate": 0.0,  # Fraction of requests answered with a 500
+    "embedding_latency": 0.0,  # Seconds added to each embeddings request
+    "chat_latency": 0.0,  # Seconds added to each chat completion (time to first token when streaming)
+    "prompt_latency": 0.0,  # Seconds added per 1,000 prompt tokens, like prompt processing on a real model
+    "token_latency": 0.0,  # Seconds between streamed chunks
+    "embedding_dimensions": EMBEDDING_DIMENSIONS,
+}
+_stats_lock = threading.Lock()
+_random = random.Random(0)
+
+_TABLE_NAME_PATTERN = re.compile(r"Table Name: (.+)")
+
+
+def stub_embedding(text: str, dimensions: int = EMBEDDING_DIMENSIONS):
+    """Return a unit vector derived from the text's hash, so equal texts embed identically."""
+    seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def encode_embedding(vector, encoding_format: str):
+    """Floats, or little-endian float32 bytes in base64 as the API sends when the SDK asks for it."""
+    if encoding_format == "base64":
+        return base64.b64encode(np.asarray(vector, dtype="<f4").tobytes()).decode()
+    return vector
+
+
+def approximate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _error_response(status_code: int, message: str, code: str):
+    headers = {"retry-after": "0"} if status_code == 429 else None
+    return JSONResponse(
+        status_code=status_code,
+        headers=headers,
+        content={"error": {"message": f"{message} (stub)", "type": "requests", "code": code}},
+    )
+
+
+def _injected_fault(request_number: int):
+    """Decide, under the stats lock, whether this request fails; returns the error response or None."""
+    if settings["rate_limit_every"] and request_number % settings["rate_limit_every"] == 0:
+        stats["rate_limited"] += 1
+        return _error_response(429, "Rate limit reached", "rate_limit_exceeded")
+    if settings["error_rate"] and _random.random() < settings["error_rate"]:
+        stats["errors"] += 1
+        return _error_response(500, "Injected server error", "server_error")
+    return None
+
+
+def _stub_value(schema: dict, name: str):
+    kind = schema.get("type")
+    if kind == "array":
+        return [_stub_value(schema.get("items", {}), f"{name} {i}") for i in range(1, 4)]
+    if kind == "object":
+        return {key: _stub_value(value, key) for key, value in schema.get("properties", {}).items()}
+    if kind in ("integer", "number"):
+        return 1
+    if kind == "boolean":
+        return True
+    return f"Stub {name.replace('_', ' ')}"
+
+
+def stub_function_arguments(parameters: dict) -> str:
+    """JSON arguments with a placeholder value for every property of the function's schema."""
+    return json.dumps(_stub_value(parameters, "value"))
+
+
+def stub_reply(messages) -> str:
+    """Pick a plausible reply for the prompts the backend sends."""
+    last = str(messages[-1].get("content") or "")
+    if "Reply with 'yes' or 'no'" in last:
+        return "yes"
+    if "Describe the following table schema" in last:
+        return "Stub description. " + last.splitlines()[-1][:200]
+    if "SQL Query:" in last or "correct the SQL query" in last:
+        for message in messages:
+            match = _TABLE_NAME_PATTERN.search(str(message.get("content") or ""))
+            if match:
+                table_name = match.group(1).strip().replace('"', '""')
+                return f'Plan: read a sample of the table.\n```sql\nSELECT * FROM "{table_name}" LIMIT 10;\n```'
+        return "```sql\nSELECT 1;\n```"
+    return "Stub analysis: the answer needs an identifier column and one measure column."
+
+
+@app.post("/v1/embeddings")
+async def create_embeddings(request: Request):
+    body = await request.json()
+    inputs = body["input"]
+    if isinstance(inputs, str):
+        inputs = [inputs]
+
+    if settings["embedding_latency"]:
+        await asyncio.sleep(settings["embedding_latency"])
+
+    prompt_tokens = sum(approximate_tokens(text) for text in inputs)
+    with _stats_lock:
+        stats["embedding_requests"] += 1
+        fault = _injected_fault(stats["embedding_requests"])
+        if fault is None:
+            stats["embedding_inputs"] += len(inputs)
+            stats["prompt_tokens"] += prompt_tokens
+    if fault is not None:
+        return fault
+
+    dimensions = body.get("dimensions") or settings["embedding_dimensions"]
+    encoding_format = body.get("encoding_format", "float")
+    return {
+        "object": "list",
+        "model": body.get("model", "stub-embedding"),
+        "data": [
+            {"object": "embedding", "index": i, "embedding": encode_embedding(stub_embedding(text, dimensions), encoding_format)}
+            for i, text in enumerate(inputs)
+        ],
+        "usage": {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens},
+    }
+
+
+@app.post("/v1/chat/completions")
+async def create_chat_completion(request: Request):
+    body = await request.json()
+    messages = body["messages"]
+    prompt_tokens = sum(approximate_tokens(str(message.get("content") or "")) for message in messages)
+    latency = settings["chat_latency"] + settings["prompt_latency"] * prompt_tokens / 1000
+    if latency:
+        await asyncio.sleep(latency)
+
+    functions = body.get("functions") or [tool["function"] for tool in body.get("tools", [])]
+    with _stats_lock:
+        stats["chat_requests"] += 1
+        request_number = stats["chat_requests"]
+        fault = _injected_fault(request_number)
+    if fault is not None:
+        return fault
+
+    message = {"role": "assistant", "content": None}
+    finish_reason = "stop"
+    if functions:
+        # Honour a forced function_call / tool_choice, otherwise call the first function
+        forced = body.get("function_call") or (body.get("tool_choice") or {}).get("function")
+        function = next((f for f in functions if isinstance(forced, dict) and f["name"] == forced.get("name")), functions[0])
+        call = {"name": function["name"], "arguments": stub_function_arguments(function.get("parameters", {}))}
+        if body.get("tools"):
+            message["tool_calls"] = [{"id": "call_stub", "type": "function", "function": call}]
+            finish_reason = "tool_calls"
+        else:
+            message["function_call"] = call
+            finish_reason = "function_call"
+        completion_text = call["arguments"]
+    else:
+        message["content"] = completion_text = stub_reply(messages)
+
+    completion_tokens = approximate_tokens(completion_text)
+    with _stats_lock:
+        stats["function_calls"] += 1 if functions else 0
+        stats["prompt_tokens"] += prompt_tokens
+        stats["completion_tokens"] += completion_tokens
+    usage = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+    if body.get("stream") and not functions:
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+        return StreamingResponse(
+            _stream_chunks(f"chatcmpl-stub-{request_number}", body.get("model", "stub-chat"), completion_text, usage if include_usage else None),
+            media_type="text/event-stream",
+        )
+    return {
+        "id": f"chatcmpl-stub-{request_number}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub-chat"),
+        "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+        "usage": usage,
+    }
+
+
+async def _stream_chunks(completion_id: str, model: str, text: str, usage):
+    """Chat completion chunks of about four characters each, like a token stream."""
+    def chunk(delta, finish_reason=None, chunk_usage=None):
+        payload = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [] if chunk_usage else [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        if chunk_usage:
+            payload["usage"] = chunk_usage
+        return f"data: {json.dumps(payload)}\n\n"
+
+    yield chunk({"role": "assistant", "content": ""})
+    for start in range(0, len(text), 4):
+        if settings["token_latency"]:
+            await asyncio.sleep(settings["token_latency"])
+        yield chunk({"content": text[start:start + 4]})
+    yield chunk({}, finish_reason="stop")
+    if usage:
+        yield chunk(None, chunk_usage=usage)
+    yield "data: [DONE]\n\n"
+
+
+@app.get("/stats")
+async def get_stats():
+    with _stats_lock:
+        return dict(stats)
+
+
+@app.post("/stats/reset")
+async def reset_stats():
+    with _stats_lock:
+        for key in stats:
+            stats[key] = 0
+    return {"status": "success"}
+
+
+def start_in_thread(port: int):
+    """Start the stub server on a daemon thread and return the uvicorn server handle."""
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Local stub of the OpenAI embeddings and chat APIs")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="Answer every Nth request with a 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with a 500")
+    parser.add_argument("--embedding-latency", type=float, default=0.0, help="Seconds added to each embeddings request")
+    parser.add_argument("--chat-latency", type=float, default=0.0, help="Seconds added to each chat completion")
+    parser.add_argument("--prompt-latency", type=float, default=0.0, help="Seconds added per 1,000 prompt tokens")
+    args = parser.parse_args()
+
+    settings.update(
+        rate_limit_every=args.rate_limit_every,
+        error_rate=args.error_rate,
+        embedding_latency=args.embedding_latency,
+        chat_latency=args.chat_latency,
+        prompt_latency=args.prompt_latency,
+    )
+    uvicorn.run(app, host="0.0.0.0", port=args.port)
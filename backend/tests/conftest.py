@@ -0,0 +1,37 @@
+"""
+Shared fixtures. The backend modules are flat, so the backend directory goes on sys.path;
+the LLM clients are built at import time and need some API key, never used by the tests.
+"""
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine, text, MetaData
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("DEEPSEEK_API_KEY", "test")
+
+
+@pytest.fixture
+def shop_engine(tmp_path):
+    """File-backed SQLite database with customers and their orders."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'shop.db'}")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE customers (id INTEGER PRIMARY KEY, name TEXT)"))
+        connection.execute(text(
+            "CREATE TABLE orders (id INTEGER PRIMARY KEY, customer_id INTEGER REFERENCES customers(id), amount REAL)"
+        ))
+        connection.execute(text("INSERT INTO customers (id, name) VALUES (1, 'Ada'), (2, 'Grace'), (3, 'Linus')"))
+        connection.execute(text(
+            "INSERT INTO orders (customer_id, amount) VALUES (1, 5), (1, 20), (2, 12.5), (3, 3)"
+        ))
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def shop_metadata(shop_engine):
+    metadata = MetaData()
+    metadata.reflect(bind=shop_engine)
+    return metadata
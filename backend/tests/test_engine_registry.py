@@ -0,0 +1,30 @@
+from engine_registry import EngineRegistry
+
+
+def test_reflects_once_and_reuses_the_engine(shop_engine, tmp_path):
+    registry = EngineRegistry(max_size=2)
+    connection_string = f"sqlite:///{tmp_path / 'shop.db'}"
+    engine, metadata = registry.get("shop", connection_string)
+    assert set(metadata.tables) == {"customers", "orders"}
+    assert registry.get("shop", connection_string) == (engine, metadata)
+    registry.clear()
+
+
+def test_evicts_least_recently_used(tmp_path):
+    registry = EngineRegistry(max_size=2)
+    engines = {name: registry.get_engine(name, f"sqlite:///{tmp_path / name}.db") for name in ("a", "b")}
+    registry.get_engine("a", f"sqlite:///{tmp_path / 'a'}.db")
+    registry.get_engine("c", f"sqlite:///{tmp_path / 'c'}.db")
+    assert registry.get_engine("a", f"sqlite:///{tmp_path / 'a'}.db") is engines["a"]
+    assert registry.get_engine("b", f"sqlite:///{tmp_path / 'b'}.db") is not engines["b"]
+    registry.clear()
+
+
+def test_put_metadata_replaces_the_reflection(shop_metadata, tmp_path):
+    registry = EngineRegistry()
+    connection_string = f"sqlite:///{tmp_path / 'shop.db'}"
+    registry.put_metadata("shop", connection_string, shop_metadata)
+    assert registry.get("shop", connection_string)[1] is shop_metadata
+    registry.invalidate("shop")
+    assert registry.get("shop", connection_string)[1] is not shop_metadata
+    registry.clear()
@@ -0,0 +1,32 @@
+import pytest
+
+from schema_fingerprint import schema_fingerprint
+from semantic_cache import SemanticCache
+import user_query_runner
+
+
+@pytest.fixture
+def offline_pipeline(monkeypatch):
+    """Patch the embedding and LLM calls of the pipeline; returns the list of LLM calls made."""
+    calls = []
+    monkeypatch.setattr(user_query_runner, "get_openai_embeddings", lambda texts: [[1.0, 0.0] for _ in texts])
+    monkeypatch.setattr(user_query_runner, "analyze_required_columns", lambda question: calls.append("column_analysis"))
+    monkeypatch.setattr(user_query_runner, "answer_cache", SemanticCache())
+    monkeypatch.setattr(user_query_runner.few_shot, "has_examples", lambda database_name: False)
+    return calls
+
+
+def test_semantic_cache_hit_makes_no_llm_call(offline_pipeline, shop_engine, shop_metadata):
+    sql = "SELECT name FROM customers ORDER BY id"
+    user_query_runner.answer_cache.store("shop", schema_fingerprint(shop_metadata), "Who are our customers?", [1.0, 0.0], {
+        "sql": sql, "table_name": "Customers", "related_questions": [],
+    })
+    events = []
+    results, final_sql, table_name, _ = user_query_runner.run_pipeline(
+        "List our customers", "shop", engine=shop_engine, metadata=shop_metadata,
+        on_event=lambda event, data: events.append(event)
+    )
+    assert final_sql == sql and table_name == "Customers"
+    assert [row[0] for row in results.rows] == ["Ada", "Grace", "Linus"]
+    assert events == ["sql", "rows", "title"]
+    assert offline_pipeline == []
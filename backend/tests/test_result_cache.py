@@ -0,0 +1,93 @@
+import time
+
+import pytest
+from sqlalchemy import text
+
+import result_cache
+from result_cache import ResultCache
+from result_pages import execute_paged
+
+SQL = "SELECT SUM(amount) FROM orders"
+
+
+def _run(cache, engine, sql, policy):
+    """Look the query up, executing and storing it on a miss; returns the page served."""
+    page, version = cache.lookup(engine, "shop", sql, policy)
+    if page is None:
+        page = execute_paged(engine, sql)
+        cache.store(engine, "shop", sql, page, version, policy)
+    return page
+
+
+def _add_order(engine):
+    time.sleep(0.01)  # Let the file's mtime move on
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO orders (customer_id, amount) VALUES (2, 100)"))
+
+
+def test_off_by_default(shop_engine):
+    assert result_cache.default_policy()["ttl"] == 0
+    cache = ResultCache()
+    _run(cache, shop_engine, SQL, None)
+    assert cache.stats()["entries"] == 0
+
+
+@pytest.mark.parametrize("directory", [None, "disk"])
+def test_hit_for_the_same_normalized_sql(shop_engine, tmp_path, directory):
+    cache = ResultCache(directory=directory and str(tmp_path / directory))
+    policy = {"ttl": 60, "probe": "none"}
+    first = _run(cache, shop_engine, SQL, policy)
+    hit = _run(cache, shop_engine, "select sum(amount)\n  from orders;", policy)
+    assert hit.cached_at is not None and hit.rows == first.rows
+
+
+def test_expires_after_the_ttl(shop_engine, monkeypatch):
+    cache = ResultCache()
+    policy = {"ttl": 60, "probe": "none"}
+    _run(cache, shop_engine, SQL, policy)
+    now = time.time()
+    monkeypatch.setattr(result_cache.time, "time", lambda: now + 61)
+    assert cache.lookup(shop_engine, "shop", SQL, policy)[0] is None
+    assert cache.stats()["expired"] == 1
+
+
+@pytest.mark.parametrize("probe", ["row_count", "last_modified"])
+def test_probe_detects_changed_data(shop_engine, probe):
+    cache = ResultCache()
+    policy = {"ttl": 60, "probe": probe}
+    before = _run(cache, shop_engine, SQL, policy)
+    assert _run(cache, shop_engine, SQL, policy).cached_at is not None
+    _add_order(shop_engine)
+    after = _run(cache, shop_engine, SQL, policy)
+    assert after.cached_at is None and after.rows[0][0] == before.rows[0][0] + 100
+    assert cache.stats()["stale"] == 1
+
+
+def test_without_a_probe_changes_are_served_until_expiry(shop_engine):
+    cache = ResultCache()
+    policy = {"ttl": 60, "probe": "none"}
+    before = _run(cache, shop_engine, SQL, policy)
+    _add_order(shop_engine)
+    assert _run(cache, shop_engine, SQL, policy).rows == before.rows
+
+
+def test_evicts_least_recently_used_beyond_max_bytes(shop_engine):
+    cache = ResultCache(max_bytes=250)  # Room for two single-value results
+    policy = {"ttl": 60, "probe": "none"}
+    for sql in ("SELECT 1", "SELECT 2", "SELECT 1", "SELECT 3"):
+        _run(cache, shop_engine, sql, policy)
+    assert cache.stats()["evictions"] == 1 and cache.stats()["entries"] == 2
+    assert cache.lookup(shop_engine, "shop", "SELECT 1", policy)[0] is not None
+    assert cache.lookup(shop_engine, "shop", "SELECT 2", policy)[0] is None
+
+
+def test_invalidate_drops_a_database(shop_engine):
+    cache = ResultCache()
+    _run(cache, shop_engine, SQL, {"ttl": 60, "probe": "none"})
+    cache.invalidate("shop")
+    assert cache.stats()["entries"] == 0
+
+
+def test_bare_table_names_resolve_in_the_current_schema():
+    assert result_cache._schema_and_name("sales.orders") == ("sales", "orders")
+    assert result_cache._schema_and_name("orders") == (None, "orders")
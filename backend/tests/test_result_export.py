@@ -0,0 +1,46 @@
+import io
+
+import pyarrow.parquet as pq
+from sqlalchemy import text
+
+import result_export
+
+
+def _read_parquet(chunks):
+    return pq.read_table(io.BytesIO(b"".join(result_export.encode_parquet(chunks))))
+
+
+def test_parquet_widens_columns_whose_type_drifts():
+    table = _read_parquet([(["value"], [[1], [2]]), (["value"], [["x"], [None]])])
+    assert table.column("value").to_pylist() == ["1", "2", "x", None]
+
+
+def test_parquet_mixed_numbers_become_float():
+    table = _read_parquet([(["value"], [[1]]), (["value"], [[2.5]])])
+    assert table.column("value").to_pylist() == [1.0, 2.5]
+
+
+def test_parquet_keeps_duplicate_column_names_apart():
+    table = _read_parquet([(["id", "id"], [[1, 10], [2, 20]])])
+    assert table.column_names == ["id", "id_2"]
+    assert table.column("id_2").to_pylist() == [10, 20]
+
+
+def test_csv_export_streams_every_chunk_after_the_preamble(shop_engine):
+    query = {"sql": "SELECT id, name FROM customers ORDER BY id", "question": "Who are our customers?", "created_at": 0}
+    body = b"".join(result_export.export_query(
+        shop_engine, query["sql"], "csv", chunk_size=2, preamble=result_export.csv_preamble(query)
+    )).decode()
+    lines = body.splitlines()
+    assert lines[0] == "User Query: Who are our customers?"
+    assert lines[2] == f"SQL Query: {query['sql']}"
+    assert lines[4:] == ["id,name", "1,Ada", "2,Grace", "3,Linus"]
+
+
+def test_export_of_an_empty_result_still_has_a_schema(shop_engine):
+    with shop_engine.begin() as connection:
+        connection.execute(text("DELETE FROM orders"))
+    csv_body = b"".join(result_export.export_query(shop_engine, "SELECT id, amount FROM orders", "csv"))
+    assert csv_body.decode().splitlines() == ["id,amount"]
+    table = pq.read_table(io.BytesIO(b"".join(result_export.export_query(shop_engine, "SELECT id, amount FROM orders", "parquet"))))
+    assert table.num_rows == 0 and table.column_names == ["id", "amount"]
@@ -0,0 +1,31 @@
+from sqlalchemy import text
+
+import result_judge
+import result_pages
+import user_query_runner
+
+
+def test_rejected_background_review_closes_its_cursor_and_retitles(shop_engine, monkeypatch):
+    with shop_engine.begin() as connection:
+        connection.execute(text("INSERT INTO orders (customer_id, amount) VALUES (:c, :a)"),
+                           [{"c": 1, "a": n} for n in range(1000)])
+
+    def llm(conversation_history, model=None):
+        if model == "gpt-4o-mini":
+            return "no"
+        return "```sql\nSELECT name FROM customers\n```"
+
+    monkeypatch.setattr(result_judge, "JUDGE_ASYNC", True)
+    monkeypatch.setattr(user_query_runner, "generate_sql_query", llm)
+    monkeypatch.setattr(user_query_runner, "get_relevant_name_and_questions",
+                        lambda question, sql: ("Customers", ["How many customers are there?"]))
+
+    rows, _ = user_query_runner.execute_sql_query(
+        "SELECT amount FROM orders", [], "default", shop_engine, judge_policy="always", user_query="Customer names?"
+    )
+    assert rows.cursor and rows.review_id
+    review = result_judge.judge_reviews.get(rows.review_id).future.result(timeout=10)
+
+    assert review.status == "corrected" and review.sql.strip() == "SELECT name FROM customers"
+    assert (review.table_name, review.related_questions) == ("Customers", ["How many customers are there?"])
+    assert result_pages.result_cursors.fetch_page(rows.cursor) is None
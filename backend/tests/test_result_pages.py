@@ -0,0 +1,51 @@
+from sqlalchemy import create_engine, text
+
+from result_pages import ResultCursorRegistry, execute_paged
+import result_pages
+
+
+def _numbers_engine(path, rows, **pool):
+    engine = create_engine(f"sqlite:///{path}", **pool)
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE numbers (n INTEGER)"))
+        connection.execute(text("INSERT INTO numbers (n) VALUES (:n)"), [{"n": n} for n in range(rows)])
+    return engine
+
+
+def test_pages_through_a_result_and_closes_the_cursor(tmp_path, monkeypatch):
+    monkeypatch.setattr(result_pages, "result_cursors", ResultCursorRegistry())
+    engine = _numbers_engine(tmp_path / "n.db", 25)
+    page = execute_paged(engine, "SELECT n FROM numbers ORDER BY n", page_size=10)
+    assert page.columns == ["n"] and len(page) == 10 and page.cursor
+    seen = [row[0] for row in page.rows]
+    while page.cursor:
+        page = result_pages.result_cursors.fetch_page(page.cursor, 10)
+        seen.extend(row[0] for row in page.rows)
+    assert seen == list(range(25)) and page.row_count == 25
+    assert engine.pool.checkedout() == 0
+
+
+def test_max_rows_truncates(tmp_path, monkeypatch):
+    monkeypatch.setattr(result_pages, "result_cursors", ResultCursorRegistry())
+    engine = _numbers_engine(tmp_path / "n.db", 25)
+    page = execute_paged(engine, "SELECT n FROM numbers", page_size=10, max_rows=10)
+    assert page.truncated and page.cursor is None
+
+
+def test_idle_cursors_never_starve_the_pool(tmp_path, monkeypatch):
+    monkeypatch.setattr(result_pages, "result_cursors", ResultCursorRegistry())
+    engine = _numbers_engine(tmp_path / "n.db", 50, pool_size=2, max_overflow=0, pool_timeout=1)
+    pages = [execute_paged(engine, "SELECT n FROM numbers", page_size=10) for _ in range(5)]
+    # Half the pool is left for queries: only the newest cursor survives
+    assert all(page.cursor for page in pages)
+    assert engine.pool.checkedout() == 1
+    assert result_pages.result_cursors.fetch_page(pages[0].cursor) is None
+    assert len(result_pages.result_cursors.fetch_page(pages[-1].cursor, 10)) == 10
+
+
+def test_no_cursor_when_the_pool_has_no_room(tmp_path, monkeypatch):
+    monkeypatch.setattr(result_pages, "result_cursors", ResultCursorRegistry())
+    engine = _numbers_engine(tmp_path / "n.db", 50, pool_size=1, max_overflow=0, pool_timeout=1)
+    page = execute_paged(engine, "SELECT n FROM numbers", page_size=10)
+    assert len(page) == 10 and page.cursor is None and page.truncated
+    assert engine.pool.checkedout() == 0
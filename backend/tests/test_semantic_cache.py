@@ -0,0 +1,25 @@
+from semantic_cache import SemanticCache
+
+
+def test_hit_above_threshold_only():
+    cache = SemanticCache(threshold=0.95)
+    cache.store("db", "fp", "total sales", [1.0, 0.0], {"sql": "SELECT 1"})
+    entry, similarity = cache.lookup("db", "fp", [1.0, 0.01])
+    assert entry["sql"] == "SELECT 1" and similarity > 0.95
+    assert cache.lookup("db", "fp", [0.0, 1.0]) == (None, None)
+
+
+def test_schema_change_drops_the_database():
+    cache = SemanticCache()
+    cache.store("db", "fp", "total sales", [1.0, 0.0], {"sql": "SELECT 1"})
+    assert cache.lookup("db", "other", [1.0, 0.0]) == (None, None)
+    assert cache.stats()["entries"] == 0
+
+
+def test_discard_keeps_the_other_answers():
+    cache = SemanticCache()
+    cache.store("db", "fp", "total sales", [1.0, 0.0], {"sql": "SELECT 1"})
+    cache.store("db", "fp", "order count", [0.0, 1.0], {"sql": "SELECT 2"})
+    cache.discard("db", "total sales")
+    assert cache.lookup("db", "fp", [1.0, 0.0]) == (None, None)
+    assert cache.lookup("db", "fp", [0.0, 1.0])[0]["sql"] == "SELECT 2"
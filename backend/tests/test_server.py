@@ -0,0 +1,58 @@
+import json
+
+from fastapi.testclient import TestClient
+import pytest
+
+from result_pages import ResultPage
+import server
+
+
+def _events(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+@pytest.fixture
+def fake_pipeline(monkeypatch, shop_engine, shop_metadata):
+    """A run_pipeline that reports every stage in order without any LLM."""
+    def run_pipeline(user_query, database_name, on_event=None, **kwargs):
+        sql = "SELECT name FROM customers"
+        page = ResultPage(["name"], [["Ada"], ["Grace"]], 0, row_count=2)
+        on_event("tables", {"retrieved": ["customers"], "tables": ["customers"]})
+        on_event("sql_token", {"text": sql})
+        on_event("sql", {"query": sql, "cached": False})
+        on_event("rows", {"results": page, "query": sql})
+        on_event("title", {"table_name": "Customers", "related_questions": ["Who ordered most?"]})
+        return page, sql, "Customers", ["Who ordered most?"]
+
+    monkeypatch.setattr(server.user_query_runner, "run_pipeline", run_pipeline)
+    monkeypatch.setattr(server.engine_registry, "get", lambda database_name, connection_string: (shop_engine, shop_metadata))
+    return TestClient(server.app)
+
+
+def _request(result_format="rows"):
+    return {"query": "Who are our customers?", "dbConfig": {"type": "default", "database": "shop.db"},
+            "resultFormat": result_format}
+
+
+def test_stream_sends_stages_in_order(fake_pipeline):
+    response = fake_pipeline.post("/api/run-query/stream", json=_request())
+    events = _events(response.text)
+    assert [event for event, _ in events] == ["tables", "sql_token", "sql", "rows", "title", "result"]
+    rows = events[3][1]
+    assert rows["rows"] == [["Ada"], ["Grace"]] and rows["related_questions"] == []
+    result = events[-1][1]
+    assert result["table_name"] == "Customers" and result["related_questions"] == ["Who ordered most?"]
+
+
+def test_stream_honours_the_columnar_format(fake_pipeline):
+    events = _events(fake_pipeline.post("/api/run-query/stream", json=_request("columnar")).text)
+    assert events[3][1]["data"] == [["Ada", "Grace"]]
+    assert events[-1][1]["format"] == "columnar"
+
+
+def test_stream_refuses_arrow(fake_pipeline):
+    assert fake_pipeline.post("/api/run-query/stream", json=_request("arrow")).status_code == 400
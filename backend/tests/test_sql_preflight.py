@@ -0,0 +1,38 @@
+import pytest
+
+import sql_preflight
+import user_query_runner
+
+
+def test_nested_scans_multiply(shop_engine):
+    estimate = sql_preflight.explain(shop_engine, "SELECT * FROM customers, orders", "sqlite")
+    assert estimate.rows == 3 * 4
+
+
+def test_scan_pattern_reads_old_and_new_sqlite_plans():
+    assert sql_preflight._SQLITE_SCAN_PATTERN.match("SCAN orders").group(1) == "orders"
+    assert sql_preflight._SQLITE_SCAN_PATTERN.match("SCAN TABLE orders").group(1) == "orders"
+
+
+def test_over_budget_query_is_rejected(shop_engine):
+    with pytest.raises(sql_preflight.QueryBudgetError, match="12 rows"):
+        sql_preflight.preflight(shop_engine, "SELECT * FROM customers, orders", {"max_rows": 5}, "sqlite")
+    assert sql_preflight.preflight(shop_engine, "SELECT * FROM customers", {"max_rows": 5}, "sqlite").rows == 3
+
+
+def test_over_budget_query_goes_through_the_correction_loop(shop_engine, shop_metadata, monkeypatch):
+    prompts = []
+
+    def corrected(conversation_history, model=None):
+        prompts.append(conversation_history[-1]["content"])
+        return "```sql\nSELECT name FROM customers ORDER BY id\n```"
+
+    monkeypatch.setattr(user_query_runner, "generate_sql_query", corrected)
+    history = [{"role": "user", "content": "Which customers do we have?"}]
+    results, final_sql = user_query_runner.execute_sql_query(
+        "SELECT customers.name FROM customers, orders", history, "default", shop_engine, shop_metadata,
+        budget={"max_rows": 5}, judge_policy="off"
+    )
+    assert final_sql.strip() == "SELECT name FROM customers ORDER BY id"
+    assert [row[0] for row in results.rows] == ["Ada", "Grace", "Linus"]
+    assert "estimated to read 12 rows" in prompts[0]
@@ -0,0 +1,38 @@
+import pytest
+
+from sql_validation import validate_sql, rewrite_identifiers
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT name FROM customers WHERE id IN (SELECT customer_id FROM orders WHERE amount > 10)",
+    "SELECT name FROM customers WHERE EXISTS (SELECT 1 FROM orders WHERE orders.customer_id = customers.id AND amount > 5)",
+    "SELECT name, (SELECT SUM(amount) FROM orders WHERE orders.customer_id = customers.id) AS total FROM customers",
+    "SELECT c.name, o.amount FROM customers c JOIN orders o ON o.customer_id = c.id ORDER BY amount",
+    "WITH big AS (SELECT customer_id, SUM(amount) AS total FROM orders GROUP BY customer_id) "
+    "SELECT name, total FROM customers JOIN big ON big.customer_id = customers.id",
+    "SELECT name, COUNT(*) AS n FROM customers GROUP BY name ORDER BY n DESC",
+])
+def test_accepts_valid_queries(sql, shop_metadata):
+    assert validate_sql(sql, shop_metadata, "sqlite") == []
+
+
+@pytest.mark.parametrize("sql, problem", [
+    ("SELECT name FROM clients", "Unknown table: clients"),
+    ("SELECT email FROM customers", "Unknown column: email"),
+    ("SELECT name FROM customers WHERE id IN (SELECT customer_id FROM orders WHERE discount > 0)", "Unknown column: discount"),
+    ("SELECT c.amount FROM customers c", "Unknown column: c.amount"),
+    ("SELECT id FROM customers JOIN orders ON orders.customer_id = customers.id", "Ambiguous column id"),
+    ("DELETE FROM customers", "Only read-only SELECT queries are allowed."),
+    ("SELECT 1; SELECT 2", "Expected exactly one SQL statement, found 2."),
+])
+def test_rejects_invalid_queries(sql, problem, shop_metadata):
+    assert any(error.startswith(problem) for error in validate_sql(sql, shop_metadata, "sqlite"))
+
+
+def test_column_of_another_table_is_only_a_warning(shop_metadata, capsys):
+    assert validate_sql("SELECT amount FROM customers", shop_metadata, "sqlite") == []
+    assert "Unknown column: amount" in capsys.readouterr().out
+
+
+def test_rewrites_prompt_table_references(shop_metadata):
+    assert rewrite_identifiers("SELECT * FROM :customers", shop_metadata, "sqlite") == 'SELECT * FROM "customers"'
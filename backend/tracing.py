@@ -0,0 +1,271 @@
+"""
+Per-stage timing spans and Prometheus-style metrics for the query and configure pipelines.
+
+Spans are opened with `with tracing.span("stage"):` and collected on the trace of the
+current request, which lives in a context variable; wrap work handed to thread pools
+with `propagate` so its spans land on the same trace. Every finished span also feeds the
+stage histograms served by `render_metrics`.
+
+With TRACING_ENABLED off (the default) `span` returns a shared no-op object and nothing
+is recorded.
+"""
+import contextvars
+import os
+import threading
+import time
+import uuid
+
+# Collect spans and metrics, and return them to clients in a Server-Timing header
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+TRACE_HEADER = os.getenv("TRACE_HEADER", "true").lower() == "true"
+
+# Upper bounds (seconds) of the stage latency histogram buckets
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Trace:
+    """All spans recorded for one request or setup job."""
+
+    def __init__(self, request_id: str = None):
+        self.request_id = request_id or uuid.uuid4().hex
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def server_timing(self) -> str:
+        """Format the spans as a Server-Timing header value, in the order they finished."""
+        with self._lock:
+            spans = list(self.spans)
+        return ", ".join(f"{span.name};dur={span.duration * 1000:.1f}" for span in spans)
+
+    def to_dict(self):
+        with self._lock:
+            return {"request_id": self.request_id, "spans": [span.to_dict() for span in self.spans]}
+
+
+class Span:
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.attributes = attributes
+        self.start = None
+        self.duration = None
+        self._token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+        return self
+
+    def add(self, **counts):
+        """Add to numeric attributes, e.g. tokens over several LLM calls in one stage."""
+        for key, value in counts.items():
+            self.attributes[key] = self.attributes.get(key, 0) + value
+        return self
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(self)
+        stage_seconds.observe(self.name, self.duration)
+        if exc_type is not None:
+            stage_errors.inc(self.name)
+        return False
+
+    def to_dict(self):
+        return {"name": self.name, "start": self.start, "duration": self.duration, **self.attributes}
+
+
+class _NullSpan:
+    def set(self, **attributes):
+        return self
+
+    def add(self, **counts):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _NullTrace:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_TRACE = _NullTrace()
+
+
+class _TraceScope:
+    def __init__(self, request_id):
+        self.trace = Trace(request_id)
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current_trace.set(self.trace)
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_trace.reset(self._token)
+        return False
+
+
+def span(name: str, **attributes):
+    """Time a stage of the current trace. A no-op when tracing is off."""
+    if not TRACING_ENABLED:
+        return _NULL_SPAN
+    return Span(name, attributes)
+
+
+def trace(request_id: str = None):
+    """Make a new trace current for the duration of the block; yields the Trace (None when off)."""
+    if not TRACING_ENABLED:
+        return _NULL_TRACE
+    return _TraceScope(request_id)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def annotate(**attributes):
+    """Set attributes on the innermost open span, if any."""
+    if TRACING_ENABLED:
+        current = _current_span.get()
+        if current is not None:
+            current.set(**attributes)
+
+
+def record_llm_usage(usage):
+    """Count the tokens of one LLM call on the current span and in the token counters."""
+    if not TRACING_ENABLED or usage is None:
+        return
+    current = _current_span.get()
+    stage = current.name if current is not None else "other"
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    if current is not None:
+        current.add(llm_calls=1, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+    llm_tokens.inc((stage, "prompt"), prompt_tokens)
+    llm_tokens.inc((stage, "completion"), completion_tokens)
+
+
+def count_correction(reason: str):
+    if TRACING_ENABLED:
+        sql_corrections.inc(reason)
+
+
+def propagate(func):
+    """Bind `func` to the caller's trace so spans opened in a worker thread are recorded on it."""
+    if not TRACING_ENABLED:
+        return func
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        # Each call gets its own copy; one Context can't be entered by two threads at once
+        return context.copy().run(func, *args, **kwargs)
+    return run
+
+
+def _format_labels(names, values):
+    return ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        labels = labels if isinstance(labels, tuple) else (labels,)
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{{{_format_labels(self.label_names, labels)}}} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label_names, buckets=STAGE_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value: float):
+        labels = labels if isinstance(labels, tuple) else (labels,)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+                    break
+            series["sum"] += value
+            series["count"] += 1
+
+    def totals(self):
+        """{labels: (count, sum)} for every series."""
+        with self._lock:
+            return {labels: (series["count"], series["sum"]) for labels, series in self._series.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                label_text = _format_labels(self.label_names, labels)
+                cumulative = 0
+                for bound, count in zip(self.buckets, series["counts"]):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+                lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {series["count"]}')
+                lines.append(f"{self.name}_sum{{{label_text}}} {series['sum']}")
+                lines.append(f"{self.name}_count{{{label_text}}} {series['count']}")
+        return lines
+
+
+stage_seconds = Histogram("pipeline_stage_duration_seconds", "Time spent in each pipeline stage.", ["stage"])
+stage_errors = Counter("pipeline_stage_errors_total", "Pipeline stages that raised.", ["stage"])
+llm_tokens = Counter("pipeline_llm_tokens_total", "LLM tokens used, by stage and kind.", ["stage", "kind"])
+sql_corrections = Counter("pipeline_sql_corrections_total", "LLM correction rounds, by the reason for the retry.", ["reason"])
+
+METRICS = (stage_seconds, stage_errors, llm_tokens, sql_corrections)
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
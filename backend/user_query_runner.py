@@ -1,89 +1,125 @@
 import json
-from neo4j import GraphDatabase
-import openai
+from concurrent.futures import ThreadPoolExecutor
+import clients
+import os
 import re
-from sqlalchemy import create_engine, MetaData, text
-
-client = openai.OpenAI()
-deepseek_client = openai.OpenAI(base_url="https://api.deepseek.com/v1", api_key="sk-f49970f9d15d43188556aa455f374404")
-
-# Neo4j Connection Details
-NEO4J_URI = "bolt://localhost:7687"
-NEO4J_USER = "neo4j"
-NEO4J_PASSWORD = "test123123"
-
-# Connect to Neo4j
-neo4j_driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+import weakref
+from sqlalchemy import create_engine, MetaData
+from result_pages import execute_paged, result_cursors
+from result_cache import result_cache
+from schema_fingerprint import schema_fingerprint
+import few_shot
+from semantic_cache import answer_cache
+import prompt_fragments
+import result_judge
+import schema_pruning
+import sql_preflight
+import sql_validation
+import tracing
+from vector_index import EmbeddingIndex, table_indexes
+
+# Shared LLM clients and Neo4j driver (see clients.py)
+client = clients.openai_client
+deepseek_client = clients.deepseek_client
+neo4j_driver = clients.neo4j_driver
+
+# Worker pool for pipeline stages that run concurrently within one request
+PIPELINE_STAGE_WORKERS = int(os.getenv("PIPELINE_STAGE_WORKERS", "16"))
+stage_executor = ThreadPoolExecutor(max_workers=PIPELINE_STAGE_WORKERS, thread_name_prefix="stage")
+
+# LLM correction rounds after the first attempt fails validation, execution or the judge
+MAX_SQL_CORRECTIONS = int(os.getenv("MAX_SQL_CORRECTIONS", "2"))
+
+# Upper bound on tables passed to SQL generation after related-table expansion
+MAX_EXPANDED_TABLES = int(os.getenv("MAX_EXPANDED_TABLES", "15"))
+
+_adjacency_cache = weakref.WeakKeyDictionary()
 
 # Function to generate embeddings using OpenAI
 def get_openai_embeddings(texts):
-    response  = client.embeddings.create(
-    input=texts,
-    model="text-embedding-3-small"
-    )
+    with tracing.span("embed"):
+        response  = client.embeddings.create(
+        input=texts,
+        model="text-embedding-3-small"
+        )
+        tracing.record_llm_usage(response.usage)
     return [data.embedding for data in response.data]
 
-# Step 3: Find Relevant Tables Using GDS Similarity
-def find_relevant_tables_gds(query_embedding, database_name: str, top_k: int = 5):
-    """Use Neo4j GDS to compute similarity between the query embedding and stored embeddings."""
+def load_table_index(database_name: str):
+    """Load every table embedding of a database from Neo4j into an in-memory index."""
     with neo4j_driver.session() as session:
-        # Add query embedding as temporary node
-        session.run(
-            """
-            MERGE (q:Query {id: 'query'})
-            SET q.embedding = $embedding
-            """,
-            embedding=query_embedding,
-        )
-
-        # Compute similarity with database context
         result = session.run(
             """
-            MATCH (q:Query {id: 'query'}), (t:Table)
-            WHERE t.embedding IS NOT NULL 
+            MATCH (t:Table)
+            WHERE t.embedding IS NOT NULL
             AND t.database = $database
-            RETURN t.name AS table_name,
-                   t.description AS description,
-                   gds.similarity.cosine(q.embedding, t.embedding) AS similarity
-            ORDER BY similarity DESC
-            LIMIT $top_k
+            RETURN t.name AS table_name, t.description AS description, t.embedding AS embedding
             """,
             database=database_name,
-            top_k=top_k,
         )
+        records = list(result)
+    return EmbeddingIndex(
+        [record["table_name"] for record in records],
+        [record["embedding"] for record in records],
+        payloads=[record["description"] for record in records],
+    )
 
-        # Cleanup temporary node
-        session.run("MATCH (q:Query {id: 'query'}) DETACH DELETE q")
+# Step 3: Find Relevant Tables Using the In-Memory Vector Index
+def find_relevant_tables(query_embedding, database_name: str, top_k: int = 5):
+    """Score the query embedding against the database's table embeddings in memory."""
+    index = table_indexes.get(database_name, load_table_index)
+    return [
+        {
+            "table_name": table_name,
+            "description": description,
+            "similarity": similarity
+        }
+        for table_name, description, similarity in index.search(query_embedding, top_k)
+    ]
 
-        return [
-            {
-                "table_name": record["table_name"],
-                "description": record["description"],
-                "similarity": record["similarity"]
-            } 
-            for record in result
-        ]
+def foreign_key_adjacency(metadata):
+    """Undirected table adjacency built from the reflected foreign keys, cached per MetaData."""
+    adjacency = _adjacency_cache.get(metadata)
+    if adjacency is None:
+        adjacency = {table_name: [] for table_name in metadata.tables}
+        for table_name, table in metadata.tables.items():
+            for fk in table.foreign_keys:
+                target = fk.column.table.name
+                if target == table_name or target not in adjacency:
+                    continue
+                if target not in adjacency[table_name]:
+                    adjacency[table_name].append(target)
+                if table_name not in adjacency[target]:
+                    adjacency[target].append(table_name)
+        _adjacency_cache[metadata] = adjacency
+    return adjacency
 
 # Step 4: Expand Related Tables Recursively
-def expand_related_tables_recursively(database_name: str, initial_tables: list[str], depth: int = 2):
-    """Expand related tables with database context"""
-    related_tables = set(initial_tables)
-    with neo4j_driver.session() as session:
-        for table in initial_tables:
-            # Use ..depth syntax instead of $depth parameter
-            query = f"""
-            MATCH (t:Table {{name: $table, database: $database}})
-                  -[:RELATES_TO*1..{depth}]-(related:Table)
-            WHERE related.database = $database      
-            RETURN DISTINCT related.name AS related_table
-            """
-            result = session.run(
-                query,
-                table=table,
-                database=database_name
-            )
-            related_tables.update(record["related_table"] for record in result)
-    return list(related_tables)
+def expand_related_tables(metadata, initial_tables: list[str], depth: int = 2, max_tables: int = MAX_EXPANDED_TABLES):
+    """
+    Breadth-first expansion over foreign keys, up to `depth` hops from the initial tables.
+
+    Tables are added nearest-first, seeds in ranking order, and expansion stops at
+    `max_tables` so hub tables can't flood the prompt. Seeds are always kept.
+    """
+    adjacency = foreign_key_adjacency(metadata)
+    seeds = [table for table in dict.fromkeys(initial_tables) if table in adjacency]
+    related_tables = list(seeds)
+    seen = set(seeds)
+    frontier = seeds
+    for _ in range(depth):
+        next_frontier = []
+        for table in frontier:
+            for neighbor in adjacency[table]:
+                if neighbor in seen:
+                    continue
+                if len(related_tables) >= max_tables:
+                    return related_tables
+                seen.add(neighbor)
+                related_tables.append(neighbor)
+                next_frontier.append(neighbor)
+        frontier = next_frontier
+    return related_tables
 
 def parse_sql_from_response(response_text):
     """
@@ -113,79 +149,164 @@ def parse_sql_from_response(response_text):
     # If no valid SQL is found, raise an error
     raise ValueError("No valid SQL query found in the LLM response.")
 
-def generate_sql_query(messages, model="gpt-4o"):
+def generate_sql_query(messages, model="gpt-4o", on_token=None):
     """
     Generate SQL query using OpenAI LLM with conversation history.
+
+    With `on_token`, the completion is streamed and on_token(text) is called per chunk.
     """
+    if on_token is not None:
+        return _stream_completion(messages, on_token)
     response = deepseek_client.chat.completions.create(
         model="deepseek-chat",
         messages=messages,
     )
+    tracing.record_llm_usage(response.usage)
     return response.choices[0].message.content.strip()
 
-def execute_sql_query(sql_query, conversation_history, dbtype, engine):
-    with engine.connect() as connection:
+def _stream_completion(messages, on_token):
+    stream = deepseek_client.chat.completions.create(
+        model="deepseek-chat",
+        messages=messages,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    parts = []
+    for chunk in stream:
+        if chunk.usage is not None:
+            tracing.record_llm_usage(chunk.usage)
+        if chunk.choices and chunk.choices[0].delta.content:
+            parts.append(chunk.choices[0].delta.content)
+            on_token(parts[-1])
+    return "".join(parts).strip()
+
+def execute_validated_sql(sql_query, engine, database_name=None, cache_policy=None):
+    """Execute SQL that already passed validation, without the judge or correction steps."""
+    if database_name is None:
+        return execute_paged(engine, sql_query)
+    rows, version = result_cache.lookup(engine, database_name, sql_query, cache_policy)
+    if rows is None:
+        rows = execute_paged(engine, sql_query)
+        result_cache.store(engine, database_name, sql_query, rows, version, cache_policy)
+    return rows
+
+def correction_message(error, dbtype):
+    db_type_str = "SQLite" if dbtype == "default" else "PostgreSQL"
+    return {"role": "user", "content": f"""
+            The following SQL query failed with error: {str(error)}
+
+            Please correct the SQL query to work with {db_type_str} database. Pay attention to date functions and syntax differences.
+            Return only the corrected SQL query without any explanations.
+            """}
+
+def execute_sql_query(sql_query, conversation_history, dbtype, engine, metadata=None, max_corrections: int = MAX_SQL_CORRECTIONS, budget=None, judge_policy=None, database_name=None, cache_policy=None, user_query=None):
+    """
+    Execute the query and return (first ResultPage, final SQL), asking the LLM to correct it on failure.
+
+    When `metadata` is given, each attempt is first checked offline against the reflected
+    schema and dialect, then EXPLAINed against `budget` (see sql_preflight), so invalid or
+    too expensive SQL goes back to the model without being executed.
+    With `database_name`, a still-valid result of the same SQL is served from the result
+    cache (see result_cache) without preflight or execution, and new complete results are stored.
+    The first successful attempt may be judged (see result_judge); with JUDGE_ASYNC the
+    page is returned right away and carries the id of the background review, which
+    titles a corrected answer anew from `user_query`.
+    On persistent failure the error message is returned instead of a page.
+    """
+    dialect = sql_validation.dialect_for_engine(engine)
+    functions = sql_validation.known_functions(engine) if metadata is not None else None
+    for attempt in range(max_corrections + 1):
         try:
-            result = connection.execute(text(sql_query))
-            rows = result.fetchall()
-            conversation_history.append({"role": "user", "content": f"SQL query execution result: {str(rows)[:100]}\nDoes the result accurately answer my question? Reply with 'yes' or 'no'."})
-            yes_or_no = generate_sql_query(conversation_history, "gpt-4o-mini")
-            print("yes_or_no", yes_or_no)
-            if "no" in yes_or_no.lower():
-                raise ValueError("User indicated that the query did not return the correct result.")
+            if metadata is not None:
+                with tracing.span("validate"):
+                    sql_query = sql_validation.rewrite_identifiers(sql_query, metadata, dialect)
+                    errors = sql_validation.validate_sql(sql_query, metadata, dialect, functions)
+                    if errors:
+                        raise sql_validation.SQLValidationError(errors)
+
+            rows, version = None, None
+            if database_name is not None:
+                with tracing.span("result_cache") as span:
+                    rows, version = result_cache.lookup(engine, database_name, sql_query, cache_policy)
+                    span.set(hit=rows is not None)
+
+            if rows is None and metadata is not None and sql_preflight.PREFLIGHT_ENABLED:
+                with tracing.span("preflight") as span:
+                    estimate = sql_preflight.preflight(engine, sql_query, budget, dialect)
+                    if estimate is not None:
+                        span.set(estimated_rows=estimate.rows, estimated_cost=estimate.cost)
+
+            if rows is None:
+                with tracing.span("execute", attempt=attempt) as span:
+                    rows = execute_paged(engine, sql_query)
+                    span.set(rows=len(rows.rows))
+                if database_name is not None:
+                    result_cache.store(engine, database_name, sql_query, rows, version, cache_policy)
+            # Only the first attempt goes through the judge, corrections are trusted once they run
+            if attempt == 0 and result_judge.should_judge(judge_policy):
+                if result_judge.JUDGE_ASYNC:
+                    review = result_judge.judge_reviews.submit(
+                        review_result, rows, sql_query, list(conversation_history),
+                        dbtype, engine, metadata, max_corrections, budget, database_name, cache_policy, user_query
+                    )
+                    rows.review_id = review.id
+                    return rows, sql_query
+                conversation_history.append(result_judge.judge_message(rows))
+                with tracing.span("judge"):
+                    yes_or_no = generate_sql_query(conversation_history, "gpt-4o-mini")
+                print("yes_or_no", yes_or_no)
+                if not result_judge.accepts(yes_or_no):
+                    if rows.cursor:
+                        result_cursors.close(rows.cursor)
+                    raise ValueError(result_judge.REJECTION_MESSAGE)
+                rows.judged = True
             return rows, sql_query
         except Exception as e:
-            print(f"Error executing query: {e}")
-            connection.rollback()
-            db_type_str = "SQLite" if dbtype == "default" else "PostgreSQL"
-            error_message = f"""
-            The following SQL query failed with error: {str(e)}
+            print(f"Error executing query (attempt {attempt + 1}): {e}")
+            if attempt == max_corrections:
+                return str(e), sql_query
+            conversation_history.append(correction_message(e, dbtype))
+            tracing.count_correction(type(e).__name__)
 
-            Please correct the SQL query to work with {db_type_str} database. Pay attention to date functions and syntax differences.
-            Return only the corrected SQL query without any explanations.
-            """
-            conversation_history.append({"role": "user", "content": error_message})
-            
             # Get corrected query from LLM
-            corrected_query = generate_sql_query(conversation_history)
-            corrected_sql = parse_sql_from_response(corrected_query)
-            
-            try:
-                # Execute corrected query
-                result = connection.execute(text(corrected_sql))
-                return result.fetchall(), corrected_sql
-            except Exception as e2:
-                connection.rollback()
-                print(f"Error executing query even after correction: {e2}\nOriginal error: {e}", "Error while executing query")
-                error_message = f"""
-                The following SQL query failed with error: {str(e2)}
-
-                Please correct the SQL query to work with {db_type_str} database. Pay attention to date functions and syntax differences.
-                Return only the corrected SQL query without any explanations.
-                """
-                conversation_history.append({"role": "user", "content": error_message})
-                
-                # Get corrected query from LLM
+            with tracing.span("correct", attempt=attempt + 1, reason=type(e).__name__):
                 corrected_query = generate_sql_query(conversation_history)
-                corrected_sql = parse_sql_from_response(corrected_query)
-                
-                try:
-                    # Execute corrected query
-                    result = connection.execute(text(corrected_sql))
-                    return result.fetchall(), corrected_sql
-                except Exception as e3:
-                    connection.rollback()
-                    print(f"Error executing query even after correction: {e3}\nOriginal error: {e2}", "Error while executing query")
-                    return str(e3), corrected_sql
-
-def generate_sql_query_from_user_query(user_query, relevant_tables, metadata_tables, dbtype):
+            sql_query = parse_sql_from_response(corrected_query)
+
+def review_result(review, rows, sql_query, conversation_history, dbtype, engine, metadata, max_corrections, budget, database_name=None, cache_policy=None, user_query=None):
     """
-    Generate an SQL query based on the user query in two steps:
-    1. Analyze required columns
-    2. Generate SQL query based on schema and required columns
+    Background judge step: returns (status, verdict, sql, result) for the review.
+
+    A "no" closes the rejected result's cursor and starts the same correction loop the
+    synchronous judge would have, minus the judge; a corrected answer gets its own title
+    and related questions on the review.
     """
-    # First LLM call to analyze required columns
-    tables = metadata_tables
+    conversation_history.append(result_judge.judge_message(rows))
+    with tracing.span("judge", review_id=review.id):
+        yes_or_no = generate_sql_query(conversation_history, "gpt-4o-mini")
+    print("yes_or_no", review.id, yes_or_no)
+    if result_judge.accepts(yes_or_no):
+        return "accepted", yes_or_no, sql_query, None
+    if rows.cursor:
+        result_cursors.close(rows.cursor)
+    if max_corrections < 1:
+        return "failed", yes_or_no, sql_query, result_judge.REJECTION_MESSAGE
+
+    conversation_history.append(correction_message(result_judge.REJECTION_MESSAGE, dbtype))
+    corrected_sql = parse_sql_from_response(generate_sql_query(conversation_history))
+    results, corrected_sql = execute_sql_query(
+        corrected_sql, conversation_history, dbtype, engine, metadata,
+        max_corrections=max_corrections - 1, budget=budget, judge_policy="off",
+        database_name=database_name, cache_policy=cache_policy
+    )
+    if isinstance(results, str):
+        return "failed", yes_or_no, corrected_sql, results
+    if user_query is not None:
+        review.table_name, review.related_questions = get_relevant_name_and_questions(user_query, corrected_sql)
+    return "corrected", yes_or_no, corrected_sql, results
+
+def analyze_required_columns(user_query):
+    """First LLM call: describe the output columns the question needs, without looking at the schema."""
     column_analysis_prompt = f"""
     You are an expert data analyst. Based on the user's question, analyze and describe what columns are required in the output to precisely answer the user's question. Focus only on understanding the data needs from the question itself, without considering the database schema yet.
 
@@ -195,24 +316,28 @@ def generate_sql_query_from_user_query(user_query, relevant_tables, metadata_tab
     """
 
     conversation_history = [{"role": "user", "content": column_analysis_prompt}]
-    column_analysis = generate_sql_query(conversation_history, "gpt-4o-mini")
+    with tracing.span("column_analysis"):
+        column_analysis = generate_sql_query(conversation_history, "gpt-4o-mini")
     print("column_analysis", column_analysis)
-    # Prepare schema context (same as before)
-    context = "Relevant Database Schema:\n\n"
-    for table in relevant_tables:
-        description = tables[table].description if tables[table].description else "No description available."
-        context += f"Table Name: {table}\nDescription: {description}\n"
-        columns = [f"{col.name} ({col.type})" for col in tables[table].columns]
-        context += f"Columns: {', '.join(columns)}\n\n"
-
-    # Add relationships (same as before)
-    context += "Relationships Between Tables:\n"
-    for table in relevant_tables:
-        for fk in tables[table].foreign_keys:
-            source = fk.parent.table.name
-            target = fk.column.table.name
-            if source in relevant_tables and target in relevant_tables:
-                context += f"- {source} relates to {target} via {fk.parent.name} -> {fk.column.name}\n"
+    return column_analysis
+
+def generate_sql_query_from_user_query(user_query, relevant_tables, metadata_tables, dbtype, column_analysis=None, on_token=None, examples=None, columns=None, fragments=None):
+    """
+    Generate an SQL query based on the user query in two steps:
+    1. Analyze required columns (skipped if `column_analysis` was computed already,
+       and left out of the prompt when it is empty)
+    2. Generate SQL query based on schema, required columns and the few-shot `examples`
+
+    The schema context is assembled from prebuilt `fragments` (see prompt_fragments), built
+    from the reflected tables when not given; `columns` ({table name: column names}, see
+    schema_pruning) limits the columns listed per table.
+    """
+    if fragments is None:
+        fragments = prompt_fragments.build_fragments(metadata_tables)
+    if column_analysis is None:
+        column_analysis = analyze_required_columns(user_query)
+    column_section = f"Required Column Analysis:\n    {column_analysis}" if column_analysis else ""
+    context = prompt_fragments.render_schema(fragments, relevant_tables, columns)
 
     # Second LLM call with database-specific instructions
     db_specific_instructions = "Use SQLite compatible syntax." if dbtype == "default" else "Use PostgreSQL syntax."
@@ -220,9 +345,9 @@ def generate_sql_query_from_user_query(user_query, relevant_tables, metadata_tab
     sql_generation_prompt = f"""
     You are an expert SQL assistant who writes SQL queries for {dbtype} database type. {db_specific_instructions}
 
-    Required Column Analysis:
-    {column_analysis}
+    {column_section}
 
+    {few_shot.format_examples(examples)}
     {context}
     
     Next, based on the provided SQL database tables and their schema, write instructions for the plan on how you intend to write the SQL query to generate the required output columns, please add any more columns if required. Finally, write a valid SQL query to answer the question. Write only one SQL statement in your final answer. Make sure Table names are exact and case-sensitive and space-sensitive (Use colons to enclose space-separated table names).
@@ -231,16 +356,9 @@ def generate_sql_query_from_user_query(user_query, relevant_tables, metadata_tab
     """
 
     conversation_history = [{"role": "user", "content": sql_generation_prompt}]
-    llm_response = generate_sql_query(conversation_history, "gpt-4o-mini")
+    llm_response = generate_sql_query(conversation_history, "gpt-4o-mini", on_token=on_token)
     return llm_response, conversation_history
 
-def correct_table_names(sql_query, table_names):
-    # Replace :TableName with "TableName" only for known table names
-    for table_name in table_names:
-        pattern = f":{re.escape(table_name)}"
-        sql_query = sql_query.replace(pattern, f'"{table_name}"')
-    return sql_query
-
 def get_relevant_name_and_questions(user_query, sql_query):
     function_schemas = [
         {
@@ -264,52 +382,183 @@ def get_relevant_name_and_questions(user_query, sql_query):
         }
     ]
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-        {
-            "role": "user",
-            "content": f"To answer this query: {user_query}\nBusiness analyst came up with this SQL query: {sql_query}\nWhat should be the title of the table generated by executing the SQL query? What are three related questions about the table generated after SQL execution that can be answered to provide more insight?"
-        }
-    ],
-    functions=function_schemas,
-    function_call={"name": "set_table_details"} 
-    )
+    with tracing.span("title"):
+        response = client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[
+                {
+                    "role": "user",
+                    "content": f"To answer this query: {user_query}\nBusiness analyst came up with this SQL query: {sql_query}\nWhat should be the title of the table generated by executing the SQL query? What are three related questions about the table generated after SQL execution that can be answered to provide more insight?"
+                }
+            ],
+            functions=function_schemas,
+            function_call={"name": "set_table_details"}
+        )
+        tracing.record_llm_usage(response.usage)
     # Parse the response
     function_call = response.choices[0].message.function_call
     arguments = json.loads(function_call.arguments)
     return arguments["table_title"], arguments["related_questions"]
 
 
-def run_pipeline(user_query: str, database_name: str, dbtype: str = "default", engine=None, metadata=None, top_k: int = 5, expansion_depth: int = 2):
+def _ignore_event(event, data):
+    pass
+
+def retrieve_examples(database_name, query_embedding, metadata, dialect):
+    """Stored question/SQL pairs closest to the question that still validate against the current schema."""
+    examples = []
+    for example, similarity in few_shot.find_examples(database_name, query_embedding):
+        if sql_validation.validate_sql(example["sql"], metadata, dialect):
+            continue
+        examples.append((example, similarity))
+    return examples
+
+def store_example(database_name, user_query, sql_query, query_embedding):
+    try:
+        few_shot.store_example(database_name, user_query, sql_query, query_embedding)
+    except Exception as e:
+        print(f"Warning: could not store few-shot example: {e}")
+
+def run_pipeline(user_query: str, database_name: str, dbtype: str = "default", engine=None, metadata=None, top_k: int = 5, expansion_depth: int = 2, budget=None, on_event=None, cache_policy=None):
     """
-    Run the complete query pipeline with database context
+    Run the complete query pipeline with database context.
+
+    Stages that only depend on the user query run concurrently:
+    - after a semantic cache miss, column analysis runs alongside the example lookup and
+      table retrieval; for a database with stored few-shot examples it waits for the
+      example lookup instead, and is skipped when an example is a strong enough match
+    - title and related questions run alongside SQL execution and the judge step,
+      and are regenerated only if the correction loop changed the SQL
+
+    on_event(event, data) is called as stages finish, for streaming clients:
+    "tables", "sql_token" (SQL generation output as it arrives), "sql", "rows" and "title".
+    `cache_policy` ({"ttl", "probe"}) controls the result cache of this database.
     """
     if not engine or not metadata:
         raise ValueError("Database configuration not provided")
+    emit = on_event or _ignore_event
         
     tables = metadata.tables
+    dialect = sql_validation.dialect_for_engine(engine)
+
     # Generate embedding for the user query
     query_embedding = get_openai_embeddings([user_query])[0]
 
+    # Reuse the validated SQL of a near-identical earlier question, skipping every LLM call
+    with tracing.span("cache_lookup") as span:
+        fingerprint = schema_fingerprint(metadata)
+        cached, similarity = answer_cache.lookup(database_name, fingerprint, query_embedding)
+        span.set(hit=cached is not None)
+    if cached is not None:
+        print(f"Semantic cache hit ({similarity:.3f}): {cached['question']}")
+        try:
+            with tracing.span("execute", cached=True) as span:
+                results = execute_validated_sql(cached["sql"], engine, database_name, cache_policy)
+                span.set(rows=len(results.rows), result_cached=results.cached_at is not None)
+            emit("sql", {"query": cached["sql"], "cached": True})
+            emit("rows", {"results": results, "query": cached["sql"]})
+            emit("title", {"table_name": cached["table_name"], "related_questions": cached["related_questions"]})
+            return results, cached["sql"], cached["table_name"], cached["related_questions"]
+        except Exception as e:
+            print(f"Cached SQL failed, regenerating: {e}")
+            answer_cache.discard(database_name, cached["question"])
+
+    # Column analysis needs nothing but the question, so start it now unless an example may replace it
+    column_analysis_future = None
+    if not few_shot.has_examples(database_name):
+        column_analysis_future = stage_executor.submit(tracing.propagate(analyze_required_columns), user_query)
+
+    # Validated answers to similar questions become few-shot examples; a close one makes column analysis redundant
+    with tracing.span("few_shot") as span:
+        examples = retrieve_examples(database_name, query_embedding, metadata, dialect)
+        strong_match = bool(examples) and examples[0][1] >= few_shot.FEW_SHOT_STRONG_SIMILARITY
+        span.set(examples=len(examples), strong_match=strong_match)
+    if strong_match and column_analysis_future is not None:
+        column_analysis_future.cancel()
+    elif not strong_match and column_analysis_future is None:
+        column_analysis_future = stage_executor.submit(tracing.propagate(analyze_required_columns), user_query)
+
     # Find initial relevant tables with database context
-    relevant_tables = find_relevant_tables_gds(query_embedding, database_name, top_k=top_k)
+    with tracing.span("retrieve", top_k=top_k):
+        relevant_tables = find_relevant_tables(query_embedding, database_name, top_k=top_k)
     initial_table_names = [table["table_name"] for table in relevant_tables]
 
-    # Expand related tables with database context
-    expanded_tables = expand_related_tables_recursively(database_name, initial_table_names, depth=expansion_depth)
+    # Expand related tables over the reflected foreign keys
+    with tracing.span("expand") as span:
+        expanded_tables = expand_related_tables(metadata, initial_table_names, depth=expansion_depth)
+        span.set(tables=len(expanded_tables))
+
+    # Keep the schema context within its token budget: keys, join columns and the columns closest to the question
+    with tracing.span("prune_columns") as span:
+        fragments = prompt_fragments.fragment_cache.get(database_name, fingerprint, metadata)
+        expanded_tables, columns = schema_pruning.select_columns(
+            metadata, expanded_tables, query_embedding, database_name,
+            required_tables=len(set(initial_table_names) & set(tables)),
+            descriptions={table: fragments[table].description for table in expanded_tables}
+        )
+        span.set(tables=len(expanded_tables), columns=sum(
+            len(columns[table]) if columns is not None else len(tables[table].columns) for table in expanded_tables
+        ))
+    emit("tables", {"retrieved": initial_table_names, "tables": expanded_tables})
 
     # Generate SQL query with database type
-    llm_response, conversation_history = generate_sql_query_from_user_query(user_query, expanded_tables, tables, dbtype)
+    column_analysis = "" if strong_match else column_analysis_future.result()
+    with tracing.span("generate_sql", examples=len(examples)):
+        llm_response, conversation_history = generate_sql_query_from_user_query(
+            user_query, expanded_tables, tables, dbtype, column_analysis=column_analysis,
+            on_token=(lambda token: emit("sql_token", {"text": token})) if on_event else None,
+            examples=examples, columns=columns, fragments=fragments
+        )
     conversation_history.append({"role": "assistant", "content": llm_response})
     
-    # Parse and fix SQL query
+    # Parse SQL and map table references onto the exact reflected names
     sql_query = parse_sql_from_response(llm_response)
-    unbinded_sql_query = correct_table_names(sql_query, expanded_tables)
+    unbinded_sql_query = sql_validation.rewrite_identifiers(sql_query, metadata, dialect)
+    emit("sql", {"query": unbinded_sql_query, "cached": False})
+
+    # Title and related questions only need the question and the SQL, so overlap them with execution
+    title_future = stage_executor.submit(tracing.propagate(get_relevant_name_and_questions), user_query, unbinded_sql_query)
 
     # Execute the SQL query
-    results, sql_query = execute_sql_query(unbinded_sql_query, conversation_history, dbtype, engine)
-    table_name, relevant_questions = get_relevant_name_and_questions(user_query, sql_query)
+    results, sql_query = execute_sql_query(
+        unbinded_sql_query, conversation_history, dbtype, engine, metadata, budget=budget,
+        database_name=database_name, cache_policy=cache_policy, user_query=user_query
+    )
+    emit("rows", {"results": results, "query": sql_query})
+    if sql_query == unbinded_sql_query:
+        table_name, relevant_questions = title_future.result()
+    else:
+        title_future.cancel()
+        table_name, relevant_questions = get_relevant_name_and_questions(user_query, sql_query)
+    emit("title", {"table_name": table_name, "related_questions": relevant_questions})
+
+    def cache_answer(final_sql):
+        answer_cache.store(database_name, fingerprint, user_query, query_embedding, {
+            "sql": final_sql,
+            "table_name": table_name,
+            "related_questions": relevant_questions
+        })
+
+    def remember_example(final_sql):
+        stage_executor.submit(store_example, database_name, user_query, final_sql, query_embedding)
+
+    def review_done(review):
+        # A corrected answer was never judged and its title describes the rejected SQL, so only accepted ones are cached
+        if review.status == "accepted":
+            cache_answer(review.sql)
+        if review.status == "accepted" or (review.status == "corrected" and not few_shot.FEW_SHOT_REQUIRE_JUDGE):
+            remember_example(review.sql)
+
+    # Only answers that executed successfully are worth reusing; judged ones once the judge agrees.
+    # Few-shot examples also need the judge's approval unless FEW_SHOT_REQUIRE_JUDGE is off.
+    if not isinstance(results, str):
+        review = result_judge.judge_reviews.get(results.review_id) if results.review_id else None
+        if review is None:
+            cache_answer(sql_query)
+            if results.judged or not few_shot.FEW_SHOT_REQUIRE_JUDGE:
+                remember_example(sql_query)
+        else:
+            review.future.add_done_callback(lambda future: review_done(review))
     
     return results, sql_query, table_name, relevant_questions
 
@@ -0,0 +1,77 @@
+import threading
+import numpy as np
+
+
+class EmbeddingIndex:
+    """
+    Immutable in-memory index of L2-normalized embeddings.
+
+    Each search only allocates local arrays, so one index can be shared by
+    concurrent requests without any locking. Refreshing means building a new
+    index and swapping it into the registry.
+    """
+
+    def __init__(self, keys, embeddings, payloads=None):
+        self.keys = list(keys)
+        self.payloads = list(payloads) if payloads is not None else [None] * len(self.keys)
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        if matrix.ndim != 2:
+            matrix = matrix.reshape(len(self.keys), -1)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.matrix = matrix / norms
+        self.matrix.setflags(write=False)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def search(self, query_embedding, top_k: int = 5):
+        """Return [(key, payload, cosine similarity)] for the top_k nearest embeddings."""
+        if not self.keys or top_k <= 0:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+        scores = self.matrix @ (query / norm)
+        top_k = min(top_k, len(self.keys))
+        if top_k < len(self.keys):
+            candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            candidates = np.arange(len(self.keys))
+        ranked = candidates[np.argsort(-scores[candidates])]
+        return [(self.keys[i], self.payloads[i], float(scores[i])) for i in ranked]
+
+
+class IndexRegistry:
+    """Thread-safe map of database name -> EmbeddingIndex, loaded lazily."""
+
+    def __init__(self):
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def get(self, database_name: str, loader):
+        """Return the index for a database, calling `loader(database_name)` on a miss."""
+        index = self._indexes.get(database_name)
+        if index is not None:
+            return index
+        with self._lock:
+            load_lock = self._load_locks.setdefault(database_name, threading.Lock())
+        # Only one request loads a given database; the rest wait and reuse its result
+        with load_lock:
+            index = self._indexes.get(database_name)
+            if index is None:
+                index = loader(database_name)
+                self._indexes[database_name] = index
+            return index
+
+    def put(self, database_name: str, index: EmbeddingIndex):
+        self._indexes[database_name] = index
+
+    def invalidate(self, database_name: str):
+        self._indexes.pop(database_name, None)
+
+
+# Table description embeddings, one index per database
+table_indexes = IndexRegistry()
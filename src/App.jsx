@@ -121,6 +121,13 @@ const TableScrollWrapper = styled.div`
   max-width: 100%;
 `;
 
+// Age of a cached result in seconds, as "42 s", "3 min" or "2 h"
+const formatAge = (seconds) => {
+  if (seconds < 60) return `${Math.round(seconds)} s`;
+  if (seconds < 3600) return `${Math.round(seconds / 60)} min`;
+  return `${Math.round(seconds / 3600)} h`;
+};
+
 function App() {
   const ROW_LIMIT = 10; // Configure row limit here
   const mainContentRef = useRef(null); // Add this line
@@ -136,11 +143,16 @@ function App() {
     setDbConfig(config);  // Store the db config
   };
 
-  const handleQueryResults = (results, userQuery) => {
+  // Streaming queries report the first rows, then update the same entry with the full result
+  const handleQueryResults = (results, userQuery, entryId = Date.now(), isUpdate = false) => {
+    if (isUpdate) {
+      setQueryHistory(prev => prev.map(entry => entry.id === entryId ? { ...entry, ...results } : entry));
+      return;
+    }
     setCurrentView('queries'); // Switch to queries view when results are received
     scrollToTop();
     setQueryHistory(prev => [{
-      id: Date.now(),
+      id: entryId,
       timestamp: new Date().toLocaleString(),
       userQuery,  // Store the user's natural language query
       ...results
@@ -173,6 +185,18 @@ function App() {
   };
 
   const handleDownload = (result) => {
+    // Results with more rows on the server are streamed by it (with the same metadata header);
+    // complete ones are already here
+    if (result.export_id && (result.cursor || result.truncated)) {
+      const a = document.createElement('a');
+      a.href = `${process.env.REACT_APP_API_URL}/api/export/${result.export_id}?format=csv`;
+      a.download = `query-result-${result.id}.csv`;
+      document.body.appendChild(a);
+      a.click();
+      document.body.removeChild(a);
+      return;
+    }
+
     const csvContent = convertToCSV(result);
     const blob = new Blob([csvContent], { type: 'text/csv;charset=utf-8;' });
     const url = window.URL.createObjectURL(blob);
@@ -257,7 +281,8 @@ function App() {
         {currentView === 'queries' ? (
           queryHistory.map((result, index) => {
             const displayRows = getDisplayData(result.rows, ROW_LIMIT);
-            const remainingRows = result.rows.length - ROW_LIMIT;
+            const totalRows = result.row_count ?? result.rows.length;
+            const remainingRows = totalRows - ROW_LIMIT;
             
             return (
               <QueryResultSection key={result.id}>
@@ -267,6 +292,9 @@ function App() {
                       {queryHistory.length - index}: {result.table_name}
                     </QueryHeader>
                     <QueryTimestamp>Generated at: {result.timestamp}</QueryTimestamp>
+                    {result.cached && (
+                      <QueryTimestamp>Cached result, last run {formatAge(result.cached_age)} ago</QueryTimestamp>
+                    )}
                   </div>
                   <DownloadButton onClick={() => handleDownload(result)}>
                     <RiFileDownloadLine /> Download
@@ -283,9 +311,14 @@ function App() {
                     {remainingRows} more rows available. Download the full results to view all data.
                   </MoreRowsText>
                 )}
+                {result.cursor && (
+                  <MoreRowsText>
+                    More rows are available on the server. Download the full results to view all data.
+                  </MoreRowsText>
+                )}
                 <RelatedQuestions>
                   <h4>Related Questions:</h4>
-                  {result.related_questions.map((question, idx) => (
+                  {(result.related_questions ?? []).map((question, idx) => (
                     <RelatedQuestion 
                       key={idx} 
                       onClick={() => chatRef.current.handleExternalMessage(question)}
@@ -88,6 +88,30 @@ const SendButton = styled.button`
   justify-content: center;
 `;
 
+// Read a Server-Sent Events response, calling onEvent(event, data) for each JSON message
+const readEventStream = async (response, onEvent) => {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const block = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      let event = 'message';
+      const data = [];
+      block.split('\n').forEach(line => {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data.push(line.slice(5).trimStart());
+      });
+      if (data.length) onEvent(event, JSON.parse(data.join('\n')));
+    }
+  }
+};
+
 function Chat({ onQueryResults, dbConfig }, ref) {  // Add dbConfig prop
   const [messages, setMessages] = useState([
     { text: "Hi, how can I help you analyze the revenue data?", isUser: false }
@@ -96,17 +120,28 @@ function Chat({ onQueryResults, dbConfig }, ref) {  // Add dbConfig prop
   const [isLoading, setIsLoading] = useState(false);
   const messagesEndRef = useRef(null);
 
+  // Replace the in-progress messages (status line, SQL being written) with new ones
+  const showProgress = (...transient) => {
+    setMessages(prev => [
+      ...prev.filter(msg => !msg.isTransient),
+      ...transient.map(msg => ({ isUser: false, isTransient: true, ...msg }))
+    ]);
+  };
+
   const handleMessage = async (message) => {
     if (!message.trim() || !dbConfig) return;  // Check for dbConfig
     
+    const entryId = Date.now();
+    let rowsShown = false;
+    let status = "Finding relevant tables...";
+    let sqlDraft = "";
     try {
       setIsLoading(true);
-      setMessages(prev => [...prev, 
-        { text: message, isUser: true },
-        { text: "Fetching details...", isUser: false, isLoading: true }
-      ]);
+      setMessages(prev => [...prev, { text: message, isUser: true }]);
+      showProgress({ text: status, isLoading: true });
 
-      const response = await fetch(`${process.env.REACT_APP_API_URL}/api/run-query`, {
+      // Stages arrive as they finish: tables, the SQL as it is written, first rows, then the title
+      const response = await fetch(`${process.env.REACT_APP_API_URL}/api/run-query/stream`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -116,25 +151,44 @@ function Chat({ onQueryResults, dbConfig }, ref) {  // Add dbConfig prop
           dbConfig: dbConfig  // Add dbConfig to request
         }),
       });
-
-      const data = await response.json();
-      
-      if (data.status === 'success') {
-        // Keep showing SQL query in chat
-        setMessages(prev => [
-          ...prev.filter(msg => !msg.isLoading),
-          { text: "Here's the SQL query:", isUser: false },
-          { text: data.results.query, isUser: false, isCode: true },
-          { text: "Query executed successfully! Check the results in the reports view.", isUser: false }
-        ]);
-        
-        onQueryResults(data.results, message);
-      } else {
-        throw new Error(data.message);
+      if (!response.ok) {
+        throw new Error(`request failed with status ${response.status}`);
       }
+
+      await readEventStream(response, (event, data) => {
+        if (event === 'tables') {
+          status = `Using tables: ${data.tables.join(', ')}. Writing the SQL query...`;
+          showProgress({ text: status, isLoading: true });
+        } else if (event === 'sql_token') {
+          sqlDraft += data.text;
+          showProgress({ text: status, isLoading: true }, { text: sqlDraft, isCode: true });
+        } else if (event === 'sql') {
+          status = "Running the query...";
+          showProgress({ text: status, isLoading: true }, { text: data.query, isCode: true });
+        } else if (event === 'rows') {
+          // Show the first page right away; the title and related questions follow
+          onQueryResults(data, message, entryId);
+          rowsShown = true;
+          status = "Summarizing the results...";
+          showProgress({ text: status, isLoading: true }, { text: data.query, isCode: true });
+        } else if (event === 'result') {
+          // Keep showing SQL query in chat
+          showProgress();
+          setMessages(prev => [
+            ...prev,
+            { text: "Here's the SQL query:", isUser: false },
+            { text: data.query, isUser: false, isCode: true },
+            { text: "Query executed successfully! Check the results in the reports view.", isUser: false }
+          ]);
+          onQueryResults(data, message, entryId, rowsShown);
+        } else if (event === 'error') {
+          throw new Error(data.detail);
+        }
+      });
     } catch (err) {
+      showProgress();
       setMessages(prev => [
-        ...prev.filter(msg => !msg.isLoading),
+        ...prev,
         { text: "Sorry, I couldn't process your query: " + err.message, isUser: false }
       ]);
     } finally {
@@ -173,14 +173,40 @@ function Sidebar({ onTablesUpdate, currentView, onViewChange, onTitleChange }) {
     'Finalizing setup...'
   ];
 
-  useEffect(() => {
-    if (isLoading && loadingStage < loadingMessages.length - 1) {
-      const timer = setTimeout(() => {
-        setLoadingStage(prev => prev + 1);
-      }, 1000); // Increased to 3.5 seconds per message
-      return () => clearTimeout(timer);
+  // Map backend setup job stages onto the loading messages above
+  const JOB_STAGE_MESSAGES = {
+    connect: 0,
+    reflect: 1,
+    plan: 1,
+    prune: 1,
+    describe: 2,
+    graph: 3,
+    embed: 4
+  };
+
+  const waitForSetupJob = async (statusUrl) => {
+    while (true) {
+      const response = await fetch(`${process.env.REACT_APP_API_URL}${statusUrl}`);
+      const job = await response.json();
+      if (!response.ok) {
+        throw new Error(job.detail || 'Setup job not found');
+      }
+
+      const running = Object.entries(job.stages).find(([, stage]) => stage.status === 'running');
+      if (running && running[0] in JOB_STAGE_MESSAGES) {
+        setLoadingStage(JOB_STAGE_MESSAGES[running[0]]);
+      }
+
+      if (job.status === 'succeeded') {
+        setLoadingStage(loadingMessages.length - 1);
+        return job.result;
+      }
+      if (job.status === 'failed') {
+        throw new Error(job.error);
+      }
+      await new Promise(resolve => setTimeout(resolve, 2000));
     }
-  }, [isLoading, loadingStage]);
+  };
 
   const defaultDatabases = ['northwind.db'];
 
@@ -240,7 +266,8 @@ function Sidebar({ onTablesUpdate, currentView, onViewChange, onTitleChange }) {
             platform: formData.platform
           };
 
-      const response = await fetch(`${process.env.REACT_APP_API_URL}/api/configure-db`, {
+      // Run setup as a background job and poll it, so large databases don't hit request timeouts
+      const response = await fetch(`${process.env.REACT_APP_API_URL}/api/configure-db?background=true`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -248,7 +275,11 @@ function Sidebar({ onTablesUpdate, currentView, onViewChange, onTitleChange }) {
         body: JSON.stringify(config),
       });
 
-      const data = await response.json();
+      const job = await response.json();
+      if (!response.ok) {
+        throw new Error(job.detail);
+      }
+      const data = await waitForSetupJob(job.status_url);
       
       if (data.status === 'success') {
         await new Promise(resolve => setTimeout(resolve, 5000));